@@ -0,0 +1,98 @@
+""" Compare the two MST engines of the super-graph (modified Prim and modified Kruskal):
+    check that they give the same consensus on the bundled datasets, and time them
+    on these datasets and on super-graphs built from large sets of random trees.
+"""
+import argparse
+import glob
+import random
+import timeit
+import ete3
+from utils.trees import read_trees
+from primconstree.super_graph import SuperGraph
+from primconstree.algorithm import mst_to_consensus, spanning_tree
+
+
+DATASETS = ["datasets/articles-illustrations/*.txt", "datasets/kmedoids/*.txt", "datasets/simulated/*.txt",
+            "datasets/biological/47_ribosomal_proteins_trees.txt"]
+
+
+def random_trees(n_trees: int, n_leaves: int, seed: int = 0) -> list[ete3.Tree]:
+    """ Generate random binary trees with random branch lengths on the same leaves
+
+    Args:
+        n_trees (int): number of trees
+        n_leaves (int): number of leaves of each tree
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        list[ete3.Tree]: the random trees
+    """
+    random.seed(seed)
+    names = [f"t{i}" for i in range(n_leaves)]
+    trees = []
+    for _ in range(n_trees):
+        t = ete3.Tree()
+        t.populate(n_leaves, names_library=names, random_branches=True)
+        trees.append(t)
+    return trees
+
+
+def compare_engines(super_graph: SuperGraph, repeat: int = 3) -> tuple[bool, float, float]:
+    """ Compute the consensus with both engines and both criteria, and time the MST computation
+
+    Args:
+        super_graph (SuperGraph): the super-graph
+        repeat (int, optional): number of timed runs (best one kept). Defaults to 3.
+
+    Returns:
+        tuple: (same consensus for both criteria, prim time, kruskal time) in seconds
+    """
+    same = True
+    times = {"prim": 0., "kruskal": 0.}
+    for old in [False, True]:
+        trees = []
+        for engine in times:
+            mst = spanning_tree(super_graph, old, engine)
+            trees.append(mst_to_consensus(super_graph, mst).write())
+            times[engine] += min(timeit.repeat(lambda: spanning_tree(super_graph, old, engine),
+                                               number=1, repeat=repeat))
+        same &= trees[0] == trees[1]
+    return same, times["prim"], times["kruskal"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--root', type=str, help='directory containing the datasets folder', default='..')
+    parser.add_argument('--trees', type=int, nargs="+", help='number of random trees of the synthetic instances', default=[100, 500])
+    parser.add_argument('--leaves', type=int, nargs="+", help='number of leaves of the synthetic instances', default=[50, 200])
+    parser.add_argument('--repeat', type=int, help='number of timed runs', default=3)
+    args = parser.parse_args()
+
+    print(f"{'instance':<60} {'nodes':>8} {'edges':>9} {'same':>5} {'prim (s)':>9} {'kruskal (s)':>11}")
+    def report(name, super_graph):
+        same, t_prim, t_kruskal = compare_engines(super_graph, args.repeat)
+        g = super_graph.graph
+        print(f"{name:<60} {g.number_of_nodes():>8} {g.number_of_edges():>9} {str(same):>5} "
+              f"{t_prim:>9.3f} {t_kruskal:>11.3f}")
+        return same
+
+    all_same = True
+    for pattern in DATASETS:
+        for filename in sorted(glob.glob(f"{args.root}/{pattern}")):
+            try:
+                input_trees = read_trees(filename)
+                super_graph = SuperGraph(input_trees)
+            except Exception as e: # Some datasets are not on the same taxa
+                print(f"{filename:<60} skipped ({e})")
+                continue
+            all_same &= report(filename, super_graph)
+
+    for n_trees in args.trees:
+        for n_leaves in args.leaves:
+            super_graph = SuperGraph(random_trees(n_trees, n_leaves))
+            all_same &= report(f"random {n_trees} trees x {n_leaves} leaves", super_graph)
+
+    print("All consensus identical" if all_same else "Some consensus differ")
+
+if __name__ == '__main__':
+    main()
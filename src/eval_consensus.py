@@ -2,94 +2,143 @@
     on different datasets, compute metrics, and save results in a file.
 """
 import logging
-import json
 import os
-import subprocess
 from itertools import product
 import timeit
 from Bio.Phylo.Consensus import majority_consensus
 from Bio import Phylo
 import ete3
 from utils.trees import phylo_to_ete3, read_trees, map_from_fact, set_cst_length    
-from primconstree.algorithm import primconstree
+from primconstree.algorithm import primconstree, primconstree_variants
+from primconstree.super_graph import SuperGraph
+from primconstree.baselines import majority_rule, extended_majority, frequency_difference
 from utils.distances import average_rf, average_bsd, average_tqd, average_kc
-from utils.misc import create_unique_file
+from utils.results import ResultsStore
+from utils.cache import CachedTrees, load_cached, cache_directory
+from utils.runner import ProcessRunner, ProcessResult
 
 
 PATH_TO_FACT1 = "src/tools/fact" #FACT compiled binary
 PATH_TO_FACT2 = "src/tools/fact2" #FACT2 compiled binary
+# PrimConsTree algorithms computed from a shared super-graph: name => (old_prim, avg_on_merge)
+PCT_VARIANTS = {"pct": (False, False), "old_pct": (True, False), "pct_avg": (False, True), "old_pct_avg": (True, True)}
+# Baselines computed in process from the super-graph clade counts: name => consensus function
+BASELINES = {"nmaj": majority_rule, "nmaj_plus": extended_majority, "nfreq": frequency_difference}
+# Algorithms computed by the FACT binaries (external processes reading the nexus files)
+FACT_ALGS = ["freq1", "freq2", "maj_plus"]
 
 
-def consensus(filename: str, alg: list, coal:float) -> tuple[ete3.Tree, timeit.Timer]:
+def fact_job(alg: str, input_file: str) -> dict:
+    """ Return the external process computing a FACT consensus (options of utils.runner.ProcessRunner.run())
+    """
+    if alg in ["freq1", "freq2"]:
+        cmd = [os.path.abspath(PATH_TO_FACT2), "freq", os.path.abspath(input_file)]
+    elif alg == "maj_plus":
+        cmd = [os.path.abspath("src/utils/fact1.sh"), os.path.abspath(PATH_TO_FACT1), os.path.abspath(input_file), "100000000"]
+    else:
+        raise ValueError(f"Unknown FACT algorithm {alg}")
+    return {"cmd": cmd}
+
+
+def fact_consensus(alg: str, output: str, coal: float) -> ete3.Tree:
+    """ Read a FACT consensus from the output of its process (see fact_job())
+    """
+    cons = ete3.Tree(map_from_fact(output.replace('\n', ';')))
+    return set_cst_length(cons, 1 if alg == "freq1" else 1/coal)
+
+
+def log_fact_failure(key: tuple, result: ProcessResult) -> None:
+    """ Log a FACT process failed after all its attempts (key: k, n, c, batch, algorithm)
+    """
+    if not result.ok:
+        logging.error("FACT %s failed on k=%i n=%i c=%s b=%i: %s", key[4], *key[:4], result.stderr.strip())
+
+
+def consensus(filename: str, alg: list, coal:float, input_trees: list[ete3.Tree] = None, cached: CachedTrees = None,
+              fact_output: str = None, runner: ProcessRunner = None) -> tuple[ete3.Tree, timeit.Timer]:
     """ Com pute the consensus tree from a list of input trees using the specified algorithm
 
     Args:
         filename (str): appropriate input file for the consensus method
-        alg (str): algorithm to use (pct, old_pct, maj)
+        alg (str): algorithm to use (pct, old_pct, maj, nmaj, nmaj_plus, nfreq, freq1, freq2, maj_plus)
+        input_trees (list[ete3.Tree], optional): the input trees already built, used instead of parsing filename
+            for the PrimConsTree variants and the baselines. Defaults to None.
+        cached (CachedTrees, optional): the input trees loaded from the dataset cache, used instead of
+            parsing filename for the majority consensus of Bio.Phylo. Defaults to None.
+        fact_output (str, optional): output of the FACT process already run for this input (see fact_job()). Defaults to None.
+        runner (ProcessRunner, optional): runner of the FACT processes. Defaults to None (default runner).
 
     Returns:
         tuple: consensus, timit timer for benchmark
-    """                             
-    def fcdt1(input_file):
-        cmd = [PATH_TO_FACT2, "freq", input_file]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        cons = ete3.Tree(map_from_fact(result.stdout.replace('\n', ';')))
-        return set_cst_length(cons, 1)
-    def fcdt2(input_file):
-        cmd = [PATH_TO_FACT2, "freq", input_file]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        cons = ete3.Tree(map_from_fact(result.stdout.replace('\n', ';')))
-        return set_cst_length(cons, 1/coal)
-
-    if alg == "pct":
-        input_trees = read_trees(filename)
-        cons = primconstree(input_trees, False, False, False)
-        tm = timeit.Timer(lambda: primconstree(input_trees, False, False, False))
+    """
+    if alg in PCT_VARIANTS or alg in BASELINES:
+        input_trees = input_trees if input_trees is not None else read_trees(filename)
+    if alg in PCT_VARIANTS:
+        old_prim, avg_on_merge = PCT_VARIANTS[alg]
+        cons = primconstree(input_trees, old_prim, avg_on_merge, False)
+        tm = timeit.Timer(lambda: primconstree(input_trees, old_prim, avg_on_merge, False))
         return cons, tm
-    if alg == "old_pct":
-        input_trees = read_trees(filename)
-        cons = primconstree(input_trees, True, False, False)
-        tm = timeit.Timer(lambda: primconstree(input_trees, True, False, False))
+    if alg in BASELINES:
+        cons = BASELINES[alg](SuperGraph(input_trees))
+        tm = timeit.Timer(lambda: BASELINES[alg](SuperGraph(input_trees)))
         return cons, tm
     if alg == "maj":
-        input_trees = list(Phylo.parse(filename, "newick")) 
+        input_trees = cached.phylo_trees() if cached is not None else list(Phylo.parse(filename, "newick"))
         bio_cons = majority_consensus(input_trees, 0)
         cons = phylo_to_ete3(bio_cons)
         tm = timeit.Timer(lambda: majority_consensus(input_trees, 0))
         return cons, tm
-    if alg == "freq1":
-        cons = fcdt1(filename)
-        tm = timeit.Timer(lambda: fcdt(filename))
-        return cons, tm
-    if alg == "freq2":
-        cons = fcdt2(filename)
-        tm = timeit.Timer(lambda: fcdt(filename))
+    if alg in FACT_ALGS:
+        runner = runner if runner is not None else ProcessRunner()
+        def run():
+            return runner.run_sync(**fact_job(alg, filename), check=True).stdout
+        cons = fact_consensus(alg, fact_output if fact_output is not None else run(), coal)
+        tm = timeit.Timer(run) if alg != "maj_plus" else None
         return cons, tm
-    if alg == "maj_plus":
-        cmd = ["./src/utils/fact1.sh", PATH_TO_FACT1, filename, "100000000"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        cons = ete3.Tree(map_from_fact(result.stdout.replace('\n', ';')))
-        cons = set_cst_length(cons, 1/coal)
-        return cons, None
     
     raise ValueError(f"Unknown algorithm {alg}")
 
 
-def eval_consensus(alg: str, filename: str, input_trees: list[ete3.Tree], benchmark: int, coal: float) -> dict:
+def consensus_variants(input_trees: list[ete3.Tree], algs: list[str]) -> dict[str, tuple[ete3.Tree, timeit.Timer]]:
+    """ Compute the consensus trees of several PrimConsTree variants from a single super-graph build
+
+    Args:
+        input_trees (list[ete3.Tree]): the list of input trees
+        algs (list[str]): PrimConsTree algorithms to use (keys of PCT_VARIANTS)
+
+    Returns:
+        dict: algorithm => (consensus, timit timer for benchmark). The timer of each variant measures
+            this variant alone (super-graph build included), as consensus().
+    """
+    variants = [PCT_VARIANTS[a] for a in algs]
+    cons = primconstree_variants(input_trees, variants)
+    def timer(old_prim, avg_on_merge):
+        return timeit.Timer(lambda: primconstree(input_trees, old_prim, avg_on_merge, False))
+    return {a: (cons[v], timer(*v)) for a, v in zip(algs, variants)}
+
+
+def eval_consensus(alg: str, filename: str, input_trees: list[ete3.Tree], benchmark: int, coal: float,
+                   precomputed: tuple[ete3.Tree, timeit.Timer] = None, cached: CachedTrees = None,
+                   fact_output: str = None, runner: ProcessRunner = None) -> dict:
     """ Compute consensus trees and metrics for several batches of input trees
 
     Args:
         alg (str): algorithm to use (pct, old_pct, maj)
         filename (str): input file for the consensus
-        input_trees (list): list of input trees as ete3 objects
+        input_trees (list): list of input trees as ete3 objects (also the inputs of the consensus, see consensus())
         benchmark (int): number of iterations for benchmark (0 for no benchmark)
+        precomputed (tuple, optional): (consensus, timer) already computed (see consensus_variants()). Defaults to None.
+        cached (CachedTrees, optional): the input trees loaded from the dataset cache (see consensus()). Defaults to None.
+        fact_output (str, optional): output of the FACT process already run (see consensus()). Defaults to None.
+        runner (ProcessRunner, optional): runner of the external processes. Defaults to None.
 
     Returns:
         dict: input and consensus as newick strings, metrics
     """
     logging.info("Processing algorithm %s", alg)
 
-    cons, tm = consensus(filename, alg, coal)
+    cons, tm = precomputed if precomputed is not None else consensus(filename, alg, coal, input_trees, cached,
+                                                                     fact_output, runner)
     if benchmark > 0 and tm is not None:
         duration = tm.timeit(benchmark)
     else:
@@ -99,8 +148,8 @@ def eval_consensus(alg: str, filename: str, input_trees: list[ete3.Tree], benchm
         "cons": cons.write(),
         #"rf": average_rf(input_trees, cons),
         #"bsd": average_bsd(input_trees, cons, True),
-        #"tdist": average_tqd(input_trees, cons, "triplet_dist"),
-        #"qdist": average_tqd(input_trees, cons, "quartet_dist"),
+        #"tdist": average_tqd(input_trees, cons, "triplet_dist", runner),
+        #"qdist": average_tqd(input_trees, cons, "quartet_dist", runner),
         "kcdist0": average_kc(input_trees, cons, 0),
         "kcdist0.5": average_kc(input_trees, cons, 0.5),
         "kcdist1": average_kc(input_trees, cons, 1)
@@ -113,47 +162,64 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 INPUT_TXT = "datasets/eval/HS" # directory to take the inputs from
 INPUT_NEX = "datasets/eval/FACT" # directory to take the inputs for FACT2 algorithms
-RESULTS_FILE = "outputs/eval/HS-FINAL_Dis.json" # file to output the results
+CACHE_DIR = "datasets/eval/cache" # directory of the parsed inputs cache (see utils.cache)
+RESULTS_DIR = "outputs/eval/HS-FINAL_Dis" # results store to append the results to (see utils.results)
 K = [10, 30, 50, 70, 90, 110, 130, 150] # values for number of trees
 N = [10, 20, 30, 40, 50] # values for number of leaves
 C = [1, 2.5, 5, 7.5, 10] # values for coalescence rate
-ALGS = ["pct", "freq1", "maj", "old_pct", "freq2"] # algorithms to perfoem (maj, pct, old_pct, freq)
+ALGS = ["pct", "freq1", "maj", "old_pct", "freq2"] # algorithms to perfoem (maj, pct, old_pct, pct_avg, old_pct_avg, freq, nmaj, nmaj_plus, nfreq)
 NB_BATCH = 5 # number of batch per combination of parameters
 BENCHMARK = 0 # number of iteration on benchmark execution time (0 for no benchmark)
+CONCURRENCY = os.cpu_count() # number of external processes (FACT, tqDist) run at the same time
+TIMEOUT = 600 # time limit of an external process in seconds (None for no limit)
+RETRIES = 1 # number of additional attempts of a failed external process
 
 
-# Execute evaluation on each parameters combinations
-combinations = []
-for k, n, c, b in product(K, N, C, range(NB_BATCH)):
-    logging.info("Processing combination k=%i n=%i c=%i b=%i batches, with %i benchmark iterations",
-                k, n, c, b, BENCHMARK)
-
-    file_txt = f"{INPUT_TXT}/k{k}_n{n}_c{c}_b{b}.txt"
-    file_nex = f"{INPUT_NEX}/k{k}_n{n}_c{c}_b{b}.nexus"
-    input_trees = read_trees(file_txt)
-
-    # Save parameters
-    comb = {
-        "file": file_txt,
-        "k": k,
-        "n": n,
-        "c": c,
-        "batch": b,
-        "benchmark": BENCHMARK,
-        "inputs": [t.write() for t in input_trees]
-    }
-    
-    # Evaluate consensus trees
-    for a in ALGS:
-        input_file = file_nex if a in ["freq1", "freq2", "maj_plus"] else file_txt
-        comb[a] = eval_consensus(a, input_file, input_trees, BENCHMARK, c)
+# Parse the inputs once (only outdated cache entries are rebuilt)
+# FACT binaries read the nexus files themselves: only the newick inputs are cached
+logging.info("Cached %i input files from %s", cache_directory(INPUT_TXT, CACHE_DIR), INPUT_TXT)
 
-    combinations.append(comb)
+# Run the FACT binaries of all the combinations concurrently, outputs are kept until their evaluation
+runner = ProcessRunner(CONCURRENCY, TIMEOUT, RETRIES)
+fact_jobs = {(k, n, c, b, a): fact_job(a, f"{INPUT_NEX}/k{k}_n{n}_c{c}_b{b}.nexus")
+             for k, n, c, b in product(K, N, C, range(NB_BATCH)) for a in ALGS if a in FACT_ALGS}
+logging.info("Running %i FACT processes (%i concurrent)", len(fact_jobs), runner.concurrency)
+fact_results = runner.run_all(fact_jobs, log_fact_failure)
 
-
-# Save results
-result_file = create_unique_file(RESULTS_FILE)
-with open(result_file, "w") as f:
-    json.dump(combinations, f, indent=4)
-
-logging.info("Saved results to %s", result_file)
+# Execute evaluation on each parameters combinations
+with ResultsStore(RESULTS_DIR) as store:
+    for k, n, c, b in product(K, N, C, range(NB_BATCH)):
+        logging.info("Processing combination k=%i n=%i c=%i b=%i batches, with %i benchmark iterations",
+                    k, n, c, b, BENCHMARK)
+
+        file_txt = f"{INPUT_TXT}/k{k}_n{n}_c{c}_b{b}.txt"
+        file_nex = f"{INPUT_NEX}/k{k}_n{n}_c{c}_b{b}.nexus"
+        # Trees built once from the cache, shared by every algorithm and metric
+        cached = load_cached(file_txt, CACHE_DIR)
+        input_trees = cached.ete3_trees()
+
+        # Save parameters and input trees (stored once, referenced by id)
+        params = {
+            "file": file_txt,
+            "k": k,
+            "n": n,
+            "c": c,
+            "batch": b,
+            "benchmark": BENCHMARK
+        }
+        iid = store.add_inputs(params, [t.write() for t in input_trees])
+
+        # Evaluate consensus trees (PrimConsTree variants share the same super-graph)
+        pct_results = consensus_variants(input_trees, [a for a in ALGS if a in PCT_VARIANTS])
+        for a in ALGS:
+            input_file = file_nex if a in FACT_ALGS else file_txt
+            fact_output = None
+            if a in FACT_ALGS:
+                result = fact_results.pop((k, n, c, b, a))
+                if not result.ok:
+                    continue
+                fact_output = result.stdout
+            store.add_result(iid, params, a, eval_consensus(a, input_file, input_trees, BENCHMARK, c,
+                                                            pct_results.get(a), cached, fact_output, runner))
+
+logging.info("Saved results to %s (%s)", RESULTS_DIR, store.fmt)
@@ -1,16 +1,14 @@
 """ Easily generate trees with HybridSim from a combination of parameters
 """
 from pathlib import Path
-import subprocess
 import ete3
 import re
 import os
-import tempfile
 import shutil
 import logging
-from contextlib import contextmanager
 from itertools import product
 from utils.trees import map_to_fact, LEAVES_MAP
+from utils.runner import ProcessRunner, ProcessResult
 
 coal_pattern = re.compile(r'\[Randomly selected coalescent trees \(with generating lineage trees as comments\)\](.*?)END;', re.DOTALL)
 tree_pattern = re.compile(r'=(.*?)\n')
@@ -40,15 +38,6 @@ end;
 
 
 
-@contextmanager
-def temp_dir():
-    temp_dir = tempfile.mkdtemp()
-    try:
-        yield os.path.abspath(temp_dir)
-    finally:
-        shutil.rmtree(temp_dir)
-
-
 def generate_FACT(trees: list[str]) -> str:
     """ Generate the content for FACT package input nexus file 
     """
@@ -67,37 +56,49 @@ def generate_FACT(trees: list[str]) -> str:
 
     return content
 
-def generate_hs(hs: str, k: int, n: int, c: float, n_batch: int) -> list[list[str]]:
-    """ Generate a list of phylogenetic trees with HybridSim
+
+def hs_job(hs: str, k: int, n: int, c: float, n_batch: int) -> dict:
+    """ Return the HybridSim run generating the trees of a combination of parameters (see utils.runner)
     """
-    with temp_dir() as nexus_dir:
-        # Write the params in the input file
-        params = default_params.format(c, n, k*n_batch)
-        file_in = f"{nexus_dir}/{k}x{n}x{c}_in.nexus"
-        file_out = f"{nexus_dir}/{k}x{n}x{c}_out.nexus"
-        with open(file_in, 'w') as f:
-            f.write(params)
-
-        # Run the simulation
-        java_cmd = [shutil.which("java"), "-jar", hs, "-i", file_in, "-o", file_out]
-        try:
-            subprocess.run(java_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred: {e}")
-
-        # Read the output file and parse regex
-        with open(file_out, 'r') as f:
-            content = f.read()
-
-        match = coal_pattern.search(content)
-        if not match:
-            raise ValueError(f"error in the {block} regex pattern on file {file_out}")
-        tree_block = match.group(1)
-        trees = tree_pattern.findall(tree_block)
+    return {
+        "cmd": [shutil.which("java") or "java", "-jar", os.path.abspath(hs), "-i", "{tmp}/in.nexus", "-o", "{tmp}/out.nexus"],
+        "files": {"in.nexus": default_params.format(c, n, k*n_batch)},
+        "outputs": ["out.nexus"]
+    }
+
+
+def parse_hs(content: str, k: int, n_batch: int) -> list[list[str]]:
+    """ Extract the batches of coalescent trees from a HybridSim output file
+    """
+    match = coal_pattern.search(content)
+    if not match:
+        raise ValueError("error in the coalescent trees regex pattern on HybridSim output")
+    tree_block = match.group(1)
+    trees = tree_pattern.findall(tree_block)
 
     return [trees[i*k:(i+1)*k] for i in range(n_batch)]
 
 
+def generate_hs(hs: str, k: int, n: int, c: float, n_batch: int, runner: ProcessRunner = None) -> list[list[str]]:
+    """ Generate a list of phylogenetic trees with HybridSim
+    """
+    runner = runner if runner is not None else ProcessRunner()
+    result = runner.run_sync(**hs_job(hs, k, n, c, n_batch), check=True)
+    return parse_hs(result.files["out.nexus"], k, n_batch)
+
+
+def write_batches(batches: list[list[str]], k: int, n: int, c: float) -> None:
+    """ Write the input files (newick and FACT nexus) of the batches of a combination of parameters
+    """
+    for i, b in enumerate(batches):
+        path_nwk = DIR_NWK / (f"k{k}_n{n}_c{c}_b{i}.txt")
+        path_nexus = DIR_FACT / (f"k{k}_n{n}_c{c}_b{i}.nexus")
+        with open(path_nwk, 'w') as f:
+            f.write("\n".join(b))
+        with open(path_nexus, 'w') as f:
+            f.write(generate_FACT(b))
+
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 K = [150, 130, 110, 90, 70, 50, 30, 10] # values for number of trees
@@ -108,17 +109,29 @@ NB_BATCH = 5 # number of batch per combination of parameters
 DIR_NWK = Path("datasets/eval/HS") # directory to store input files
 DIR_FACT = Path("datasets/eval/FACT") # directory to store nexus files for FACT package
 HS_PATH = "src/tools/hybridsim319.jar" # path to the hybridsim java program (.jar)
+CONCURRENCY = os.cpu_count() # number of simulations run at the same time
+TIMEOUT = 600 # time limit of a simulation in seconds (None for no limit)
+RETRIES = 2 # number of additional attempts of a failed simulation
 
 os.makedirs(DIR_NWK, exist_ok=True)
 os.makedirs(DIR_FACT, exist_ok=True)
 
-for k, n, c in product(K, N, C):
-    logging.info("Generatig trees for combination k=%i n=%i c=%i.", k, n, c)
-    batches = generate_hs(HS_PATH, k, n, c, NB_BATCH)
-    for i, b in enumerate(batches):
-        path_nwk = DIR_NWK / (f"k{k}_n{n}_c{c}_b{i}.txt")
-        path_nexus = DIR_FACT / (f"k{k}_n{n}_c{c}_b{i}.nexus")
-        with open(path_nwk, 'w') as f:
-            f.write("\n".join(b))
-        with open(path_nexus, 'w') as f:
-            f.write(generate_FACT(b))
+
+def on_result(params: tuple[int, int, float], result: ProcessResult) -> None:
+    """ Write the trees of a combination as soon as its simulation ends
+    """
+    k, n, c = params
+    if not result.ok:
+        logging.error("HybridSim failed for combination k=%i n=%i c=%s: %s", k, n, c, result.stderr.strip())
+        return
+    write_batches(parse_hs(result.files["out.nexus"], k, NB_BATCH), k, n, c)
+    result.files.clear() # Written, no need to keep the simulation output
+    logging.info("Generated trees for combination k=%i n=%i c=%s in %.1fs.", k, n, c, result.duration)
+
+
+# Simulations of the combinations run concurrently, each one in its own temporary directory
+runner = ProcessRunner(CONCURRENCY, TIMEOUT, RETRIES)
+jobs = {(k, n, c): hs_job(HS_PATH, k, n, c, NB_BATCH) for k, n, c in product(K, N, C)}
+logging.info("Generating trees for %i combinations (%i concurrent processes).", len(jobs), runner.concurrency)
+results = runner.run_all(jobs, on_result)
+logging.info("%i combinations failed.", sum(not r.ok for r in results.values()))
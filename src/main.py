@@ -1,6 +1,11 @@
 from utils.trees import read_trees
 from primconstree import algorithm
+from primconstree.stats import STAT_FEATURES
+from primconstree.sketch import SKETCH_FEATURES
+from primconstree.resampling import resampling_support
+from primconstree.subsets import SubsetQuery
 import argparse
+import os
 
 
 def main():
@@ -9,16 +14,78 @@ def main():
     parser.add_argument('version', type=int, help='Primconstree version for the MST criteria (0): last version, (1): previous version', nargs="?", default=0)
     parser.add_argument('avg_on_merge', type=int, help='if (0): sum branch lenght on merging two branches, if (1): average them', nargs="?", default=0)
     parser.add_argument('debug', type=int, help='if (0): return the consensus immediatly, if (1): print informations on several steps and draw graphs', nargs="?", default=0)
+    parser.add_argument('--length-stats', action='store_true', help='annotate the consensus with branch length statistics (mean, variance, min, max, median) as NHX features')
+    parser.add_argument('--dedup', action='store_true', help='incorporate input trees with the same topology once, weighted by their multiplicity')
+    parser.add_argument('--export-dir', type=str, help='write the super-graph and the MST in this directory instead of drawing them (no display needed)', default=None)
+    parser.add_argument('--export-format', type=str, choices=['png', 'svg', 'pdf', 'dot', 'graphml'], help='format of the exported graphs', default='svg')
+    parser.add_argument('--export-top-n', type=int, help='number of most frequent super-graph edges exported', default=1000)
+    parser.add_argument('--export-center', type=int, help='export only the neighbourhood of this node id (leaves are numbered from 0 in input order, then the root)', default=None)
+    parser.add_argument('--export-radius', type=int, help='number of hops of the neighbourhood exported around --export-center', default=1)
+    parser.add_argument('--export-mst-radius', type=int, help='export only the super-graph edges joining nodes at most this number of hops apart in the MST (1: MST edges only)', default=None)
+    parser.add_argument('--resampling', type=str, choices=['bootstrap', 'jackknife'], help='compute the consensus support values by resampling the input trees', default=None)
+    parser.add_argument('--replicates', type=int, help='number of resampling replicates', default=100)
+    parser.add_argument('--workers', type=int, help='number of processes for the resampling replicates (default: number of cpus)', default=None)
+    parser.add_argument('--seed', type=int, help='seed of the resampling random generator', default=None)
+    parser.add_argument('--engine', type=str, choices=algorithm.MST_ENGINES, help='algorithm computing the MST (prim: priority queue, kruskal: sort and union-find)', default='prim')
+    parser.add_argument('--memory-budget', type=float, help='store the super-graph in a SQLite database and keep about this memory (in MB) while building it', default=None)
+    parser.add_argument('--store', type=str, help='database file of the super-graph with --memory-budget (default: temporary file)', default=None)
+    parser.add_argument('--overwrite-store', action='store_true', help='replace the --store file if it exists (an error otherwise)')
+    parser.add_argument('--sketch-size', type=int, help='approximate the super-graph with this number of heavy-hitter counters for the clades and the edges (consensus annotated with the frequency bounds)', default=None)
+    parser.add_argument('--exact-fallback', action='store_true', help='with --sketch-size, count exactly the MST edges whose frequency bounds are ambiguous')
+    parser.add_argument('--hashed-clades', action='store_true', help='identify the clades by 128-bit hashes of their leaves (constant memory per clade, collisions detected and built again exactly)')
+    parser.add_argument('--taxa', type=str, nargs="+", help='consensus restricted to these taxa, projected from the super-graph of all the taxa (same as pruning the input trees with preserve_branch_length=True)', default=None)
+    parser.add_argument('--variants', type=str, nargs="+", help='compute several consensus from a single super-graph, each variant given as <version><avg_on_merge> (e.g. 00 10 01 11), one consensus printed per line', default=None)
 
     args = parser.parse_args()
+    if args.replicates < 1:
+        parser.error("--replicates should be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers should be at least 1")
+    if args.store is not None and os.path.exists(args.store) and not args.overwrite_store:
+        parser.error(f"--store {args.store} already exists (use --overwrite-store to replace it)")
     filename = args.file
     old_pct = bool(args.version)
     avg_on_merge = bool(args.avg_on_merge)
     debug = bool(args.debug)
+    features = STAT_FEATURES if args.length_stats else None
+    if args.sketch_size is not None:
+        features = SKETCH_FEATURES
 
     input_trees = read_trees(filename)
-    consensus = algorithm.primconstree(input_trees, old_pct, avg_on_merge, debug)
-    print(consensus.write())
+    if args.variants:
+        variants = [(bool(int(v[0])), bool(int(v[1]))) for v in args.variants]
+        consensus = algorithm.primconstree_variants(input_trees, variants, debug, length_stats=args.length_stats,
+                                                       deduplicate=args.dedup, engine=args.engine,
+                                                       memory_budget=args.memory_budget, store_path=args.store,
+                                                       overwrite_store=args.overwrite_store,
+                                                       sketch_size=args.sketch_size,
+                                                       exact_fallback=args.exact_fallback,
+                                                       hashed_clades=args.hashed_clades)
+        for v in variants:
+            print(consensus[v].write(features=features))
+        return
+
+    if args.taxa:
+        query = SubsetQuery.from_trees(input_trees)
+        print(query.consensus(args.taxa, old_pct, avg_on_merge, args.engine).write())
+        return
+
+    if args.resampling:
+        consensus = resampling_support(input_trees, args.replicates, args.resampling, old_pct, avg_on_merge,
+                                       workers=args.workers, seed=args.seed)
+        print(consensus.write())
+        return
+
+    consensus = algorithm.primconstree(input_trees, old_pct, avg_on_merge, debug, length_stats=args.length_stats,
+                                       deduplicate=args.dedup, export_dir=args.export_dir,
+                                       export_format=args.export_format, export_top_n=args.export_top_n,
+                                       export_center=args.export_center, export_radius=args.export_radius,
+                                       export_mst_radius=args.export_mst_radius,
+                                       engine=args.engine, memory_budget=args.memory_budget, store_path=args.store,
+                                       overwrite_store=args.overwrite_store,
+                                       sketch_size=args.sketch_size, exact_fallback=args.exact_fallback,
+                                       hashed_clades=args.hashed_clades)
+    print(consensus.write(features=features))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
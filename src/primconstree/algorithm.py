@@ -1,15 +1,21 @@
 """ Module in charge of generating the consensus tree using the PrimConsTree algorithm
 """
 import logging
+import os
 from statistics import fmean
 import ete3
+import networkx as nx
 from .super_graph import SuperGraph
+from .disk_graph import DiskSuperGraph
+from .sketch import SketchSuperGraph
+from .render import export_graph
 
 
 def remove_unecessary_nodes(tree: ete3.Tree, leaves: list[str],
                             average_on_merge: bool = False) -> None:
     """ Remove unnecessary / redundant internal nodes from a tree. 
-        Modify the tree in place.
+        Modify the tree in place. Remaining nodes keep their features (e.g. branch length statistics),
+        which thus describe their own MST edge and not the merged branch.
 
     Args:
         tree (ete3.Tree): the tree to clean
@@ -18,6 +24,7 @@ def remove_unecessary_nodes(tree: ete3.Tree, leaves: list[str],
             removing redundant node, else sum. Defaults to False.
     """
     accumulated_lengths = dict()
+    leaves = set(leaves)
     for node in tree.traverse("postorder"):
         if node.name not in leaves:
             children = node.get_children()
@@ -35,8 +42,108 @@ def remove_unecessary_nodes(tree: ete3.Tree, leaves: list[str],
             node.dist = fmean(lengths)
 
 
+MST_ENGINES = ["prim", "kruskal"]
+
+
+def spanning_tree(super_graph: SuperGraph, old_prim: bool = False, engine: str = "prim") -> nx.Graph:
+    """ Compute the maximum spanning tree of the super-graph, rooted at its root
+
+    Args:
+        super_graph (SuperGraph): the super-graph
+        old_prim (bool, optional): if True, use previous mst criteria (min branch length and edge frequency). Defaults to False.
+        engine (str, optional): "prim" (priority queue) or "kruskal" (sort and union-find). Defaults to "prim".
+
+    Returns:
+        nx.Graph: the mst
+    """
+    if engine == "prim":
+        return super_graph.modified_prim(super_graph.root, old_prim)
+    if engine == "kruskal":
+        return super_graph.modified_kruskal(super_graph.root, old_prim)
+    raise ValueError(f"Unknown MST engine {engine}")
+
+
+# Maximal number of exact passes over the input trees for the ambiguous edges of an approximate super-graph
+FALLBACK_ROUNDS = 3
+
+
+def refined_spanning_tree(super_graph: SketchSuperGraph, old_prim: bool = False, engine: str = "prim",
+                          rounds: int = FALLBACK_ROUNDS) -> nx.Graph:
+    """ Compute the maximum spanning tree of an approximate super-graph, then count exactly the edges whose
+        frequency bounds are ambiguous (see SketchSuperGraph.ambiguous_edges()) and compute it again
+
+    Args:
+        super_graph (SketchSuperGraph): the approximate super-graph
+        old_prim (bool, optional): if True, use previous mst criteria (min branch length and edge frequency). Defaults to False.
+        engine (str, optional): "prim" (priority queue) or "kruskal" (sort and union-find). Defaults to "prim".
+        rounds (int, optional): maximal number of exact passes. Defaults to FALLBACK_ROUNDS.
+
+    Returns:
+        nx.Graph: the mst
+    """
+    mst = spanning_tree(super_graph, old_prim, engine)
+    for _ in range(rounds):
+        ambiguous = super_graph.ambiguous_edges(mst)
+        if not ambiguous:
+            break
+        logging.info("Counting exactly %i ambiguous MST edges", len(ambiguous))
+        super_graph.refine(ambiguous)
+        mst = spanning_tree(super_graph, old_prim, engine)
+    return mst
+
+
+def log_frequency_bounds(super_graph: SketchSuperGraph, mst: nx.Graph) -> None:
+    """ Log the error bounds of the frequencies of the MST edges of an approximate super-graph
+    """
+    bounds = super_graph.frequency_bounds(mst)
+    errors = [high - low for low, high in bounds.values()]
+    logging.info("MST edges with an approximate frequency: %i / %i (max error %i), still ambiguous: %i",
+                 sum(e > 0 for e in errors), len(errors), max(errors, default=0),
+                 len(super_graph.ambiguous_edges(mst)))
+
+
+def build_super_graph(inputs: list[ete3.Tree], length_stats: bool = False, deduplicate: bool = False,
+                      memory_budget: float = None, store_path: str = None, sketch_size: int = None,
+                      hashed_clades: bool = False, overwrite_store: bool = False) -> SuperGraph:
+    """ Build the super-graph in memory, in a database within a memory budget, or approximately from sketches
+
+    Args:
+        inputs (list[ete3.Tree]): list of input trees
+        length_stats (bool, optional): If True, keep the branch length statistics (in memory only). Defaults to False.
+        deduplicate (bool, optional): If True, collapse input trees with the same topology. Defaults to False.
+        memory_budget (float, optional): If given, store the super-graph in a database using about this
+            memory (in MB, see disk_graph.DiskSuperGraph). Defaults to None (in memory).
+        store_path (str, optional): database file of the stored super-graph. Defaults to None (temporary file).
+        sketch_size (int, optional): If given, count the heavy-hitter clades and edges with this number of
+            counters (see sketch.SketchSuperGraph). Defaults to None (exact counts).
+        hashed_clades (bool, optional): If True, identify the clades of the in-memory super-graph by hashed ids
+            (see SuperGraph), not available with memory_budget nor sketch_size. Defaults to False.
+        overwrite_store (bool, optional): If True, replace an existing store_path, otherwise it is an error.
+            Defaults to False.
+
+    Returns:
+        SuperGraph: the super-graph
+    """
+    if hashed_clades and (sketch_size is not None or memory_budget is not None):
+        raise ValueError("Hashed clade ids are only available for the exact super-graph in memory")
+    if sketch_size is not None:
+        if length_stats or memory_budget is not None:
+            raise ValueError("An approximate super-graph can not keep branch length statistics nor be stored on disk")
+        return SketchSuperGraph(inputs, sketch_size, deduplicate)
+    if memory_budget is None:
+        return SuperGraph(inputs, length_stats, deduplicate=deduplicate, hashed_clades=hashed_clades)
+    if length_stats:
+        raise ValueError("Branch length statistics are not available for a super-graph stored on disk")
+    return DiskSuperGraph(inputs, memory_budget, store_path, deduplicate, overwrite_store)
+
+
 def primconstree(inputs: list[ete3.Tree], old_prim: bool = False, avg_on_merge: bool = False,
-                 debug: bool = False) -> ete3.Tree:
+                 debug: bool = False, *, length_stats: bool = False, deduplicate: bool = False,
+                 export_dir: str = None, export_format: str = "svg", export_top_n: int = 1000,
+                 export_center: int = None, export_radius: int = 1, export_mst_radius: int = None,
+                 engine: str = "prim", memory_budget: float = None, store_path: str = None,
+                 overwrite_store: bool = False, sketch_size: int = None, exact_fallback: bool = False,
+                 hashed_clades: bool = False) -> ete3.Tree:
     """ Generate the consensus tree from a set of phylogenetic trees
         using the PrimConsTree algorithm
 
@@ -45,6 +152,34 @@ def primconstree(inputs: list[ete3.Tree], old_prim: bool = False, avg_on_merge:
         old_prim (bool, optional): if True, use previous mst criteria (min branch length and edge frequency) for modified_prim. Defaults to False.
         avg_on_merge (bool, optional): if True, use argument average_on_merge for remove_unecessary_nodes(). Defaults to False.
         debug (bool, optional): If True, display the super-graph / consensus tree at several steps. Defaults to False.
+        length_stats (bool, optional): If True, annotate the consensus nodes with the distribution statistics
+            of the branch lengths of their MST edge (see stats.STAT_FEATURES). Defaults to False.
+        deduplicate (bool, optional): If True, input trees with the same topology are incorporated once in the
+            super-graph, weighted by their multiplicity (same consensus). Defaults to False.
+        export_dir (str, optional): If given, write the super-graph and the MST in this directory (headless,
+            see render.export_graph()) instead of drawing them in debug mode. Defaults to None.
+        export_format (str, optional): format of the exported drawings (png, svg, pdf, dot, graphml). Defaults to "svg".
+        export_top_n (int, optional): number of most frequent super-graph edges exported. Defaults to 1000.
+        export_center (int, optional): If given, export only the neighbourhood of this node id (see
+            render.select_edges()), in the MST too if it contains the node. Defaults to None (whole graphs).
+        export_radius (int, optional): number of hops of the exported neighbourhood. Defaults to 1.
+        export_mst_radius (int, optional): If given, export only the super-graph edges joining nodes at most this
+            number of hops apart in the MST (see render.select_edges()). Defaults to None (whole super-graph).
+        engine (str, optional): algorithm computing the MST, "prim" (SuperGraph.modified_prim()) or "kruskal"
+            (SuperGraph.modified_kruskal()). Defaults to "prim".
+        memory_budget (float, optional): If given, store the super-graph on disk and keep about this memory (in MB)
+            while building it (same consensus, see disk_graph.DiskSuperGraph). Defaults to None (in memory).
+        store_path (str, optional): database file used with memory_budget. Defaults to None (temporary file).
+        overwrite_store (bool, optional): If True, replace an existing store_path file, otherwise it is an error.
+            Defaults to False.
+        sketch_size (int, optional): If given, build an approximate super-graph of the heavy-hitter clades and edges
+            with this number of counters, and annotate the consensus nodes with the bounds of the frequency
+            of their MST edge (see sketch.SKETCH_FEATURES). Defaults to None (exact counts).
+        exact_fallback (bool, optional): If True, count exactly the ambiguous MST edges of the approximate
+            super-graph and compute the MST again (see refined_spanning_tree()). Defaults to False.
+        hashed_clades (bool, optional): If True, identify the clades by fixed-size hashed ids, checked for
+            collisions (same consensus, see SuperGraph). Not available with memory_budget nor sketch_size.
+            Defaults to False.
 
     Returns:
         ete3.Tree: the consensus tree
@@ -52,20 +187,108 @@ def primconstree(inputs: list[ete3.Tree], old_prim: bool = False, avg_on_merge:
     logging.debug("Generating PrimConsTree")
 
     # Super graph generation
-    super_graph = SuperGraph(inputs)
+    super_graph = build_super_graph(inputs, length_stats, deduplicate, memory_budget, store_path, sketch_size,
+                                    hashed_clades, overwrite_store)
     logging.debug("Super-Graph Generated")
     if debug:
         super_graph.display_info(False)
-        super_graph.draw_graph("frequency", False, False)
+        if not export_dir:
+            super_graph.draw_graph("frequency", False, False)
 
     # Modified Prim algorithm
-    super_graph.modified_prim(super_graph.root, old_prim)
+    if exact_fallback and sketch_size is not None:
+        mst = refined_spanning_tree(super_graph, old_prim, engine)
+    else:
+        mst = spanning_tree(super_graph, old_prim, engine)
+    if sketch_size is not None:
+        log_frequency_bounds(super_graph, mst)
     logging.debug("MST found with usig %s criteria", "previous" if old_prim else "current")
-    if debug:
+    if export_dir:
+        # The super-graph is exported once the MST is known, for its neighbourhood
+        if super_graph.graph is not None:
+            export_graph(super_graph, os.path.join(export_dir, f"super_graph.{export_format}"), False,
+                         "frequency", export_top_n, export_center, export_radius, mst_radius=export_mst_radius)
+        center = export_center if export_center is not None and export_center in mst else None
+        export_graph(super_graph, os.path.join(export_dir, f"mst.{export_format}"), True, "avglen",
+                     center=center, radius=export_radius)
+    elif debug:
         super_graph.draw_graph("avglen", False, True)
 
+    return mst_to_consensus(super_graph, mst, avg_on_merge, debug)
+
+
+def primconstree_variants(inputs: list[ete3.Tree], variants: list[tuple[bool, bool]],
+                          debug: bool = False, *, length_stats: bool = False,
+                          deduplicate: bool = False, engine: str = "prim", memory_budget: float = None,
+                          store_path: str = None, overwrite_store: bool = False, sketch_size: int = None,
+                          exact_fallback: bool = False, hashed_clades: bool = False) -> dict[tuple[bool, bool], ete3.Tree]:
+    """ Generate several consensus trees from a single super-graph build.
+        Each distinct MST criteria is computed once and shared by the variants using it,
+        the extraction (conversion and cleaning) is done separately for each variant.
+
+    Args:
+        inputs (list[ete3.Tree]): list of input trees
+        variants (list[tuple[bool, bool]]): list of (old_prim, avg_on_merge) pairs, see primconstree()
+        debug (bool, optional): If True, display the super-graph / consensus trees at several steps. Defaults to False.
+        length_stats (bool, optional): If True, annotate the consensus nodes with branch length statistics. Defaults to False.
+        deduplicate (bool, optional): If True, collapse input trees with the same topology. Defaults to False.
+        engine (str, optional): algorithm computing the MST, "prim" or "kruskal" (see primconstree()). Defaults to "prim".
+        memory_budget (float, optional): If given, store the super-graph on disk (see primconstree()). Defaults to None.
+        store_path (str, optional): database file used with memory_budget. Defaults to None (temporary file).
+        overwrite_store (bool, optional): If True, replace an existing store_path (see primconstree()). Defaults to False.
+        sketch_size (int, optional): If given, build an approximate super-graph (see primconstree()). Defaults to None.
+        exact_fallback (bool, optional): If True, count exactly the ambiguous MST edges (see primconstree()). Defaults to False.
+        hashed_clades (bool, optional): If True, identify the clades by hashed ids (see primconstree()). Defaults to False.
+
+    Returns:
+        dict[tuple[bool, bool], ete3.Tree]: the consensus tree for each (old_prim, avg_on_merge) variant
+    """
+    logging.debug("Generating PrimConsTree for %i variants", len(variants))
+
+    # Super graph generation (shared by every variant)
+    super_graph = build_super_graph(inputs, length_stats, deduplicate, memory_budget, store_path, sketch_size,
+                                    hashed_clades, overwrite_store)
+    logging.debug("Super-Graph Generated")
+    if debug:
+        super_graph.display_info(False)
+        super_graph.draw_graph("frequency", False, False)
+
+    msts = {}
+    consensus = {}
+    for old_prim, avg_on_merge in variants:
+        # Modified Prim algorithm (once per criteria)
+        if old_prim not in msts:
+            if exact_fallback and sketch_size is not None:
+                msts[old_prim] = refined_spanning_tree(super_graph, old_prim, engine)
+            else:
+                msts[old_prim] = spanning_tree(super_graph, old_prim, engine)
+            if sketch_size is not None:
+                log_frequency_bounds(super_graph, msts[old_prim])
+            logging.debug("MST found with usig %s criteria", "previous" if old_prim else "current")
+            if debug:
+                super_graph.draw_graph("avglen", False, True)
+
+        consensus[(old_prim, avg_on_merge)] = mst_to_consensus(super_graph, msts[old_prim],
+                                                               avg_on_merge, debug)
+
+    return consensus
+
+
+def mst_to_consensus(super_graph: SuperGraph, mst: nx.Graph, avg_on_merge: bool = False,
+                     debug: bool = False) -> ete3.Tree:
+    """ Extract the consensus tree from a maximum spanning tree of the super-graph
+
+    Args:
+        super_graph (SuperGraph): the super-graph the mst was computed from
+        mst (nx.Graph): the maximum spanning tree (see SuperGraph.modified_prim())
+        avg_on_merge (bool, optional): if True, use argument average_on_merge for remove_unecessary_nodes(). Defaults to False.
+        debug (bool, optional): If True, display the consensus tree at several steps. Defaults to False.
+
+    Returns:
+        ete3.Tree: the consensus tree
+    """
     # Conversion to ete3
-    tree = super_graph.to_tree(super_graph.root)
+    tree = super_graph.to_tree(super_graph.root, mst)
     if debug:
         print("\nConsensus tree with unecessary nodes\n")
         print(tree)
@@ -86,4 +309,3 @@ def primconstree(inputs: list[ete3.Tree], old_prim: bool = False, avg_on_merge:
             print("\t", n.name, "=>", n.dist)
 
     return tree
-    
\ No newline at end of file
@@ -0,0 +1,120 @@
+""" Classic consensus methods computed from the clade frequencies counted in the super-graph:
+- majority-rule consensus
+- extended majority-rule consensus (greedy)
+- frequency-difference consensus (Goloboff et al., 2003)
+
+Clades are handled as bitsets (int) over the leaf ids of the super-graph.
+"""
+import ete3
+from .super_graph import SuperGraph
+
+
+def compatible(a: int, b: int) -> bool:
+    """ Check if two clades (bitsets) can belong to the same tree (disjoint or nested)
+    """
+    inter = a & b
+    return inter == 0 or inter == a or inter == b
+
+
+def _candidate_clades(table: dict[int, tuple[int, float]]) -> list[tuple[int, int]]:
+    """ Return the non-trivial clades (neither a leaf nor the root) with their frequency,
+        sorted by decreasing frequency (ties broken by size and bitset for reproducibility)
+    """
+    clades = [(mask, freq) for mask, (freq, _) in table.items() if mask & (mask - 1)]
+    return sorted(clades, key=lambda c: (-c[1], -c[0].bit_count(), c[0]))
+
+
+def clades_to_tree(super_graph: SuperGraph, clades: list[int],
+                   table: dict[int, tuple[int, float]] = None) -> ete3.Tree:
+    """ Build a tree from a set of pairwise compatible clades. Branch lengths are the average
+        length of the clade in the input trees, supports its frequency in the input trees.
+
+    Args:
+        super_graph (SuperGraph): the super-graph the clades come from
+        clades (list[int]): the compatible clades as bitsets
+        table (dict, optional): the clade table of the super-graph. Defaults to None (computed).
+
+    Returns:
+        ete3.Tree: the consensus tree
+    """
+    table = super_graph.clade_table() if table is None else table
+    n_trees = len(super_graph.input)
+    leaves_names = {v: k for k, v in super_graph.leaves.items()}
+
+    tree = ete3.Tree()
+    # Deepest node built so far containing each leaf
+    owner = {l: tree for l in leaves_names}
+    for mask in sorted(clades, key=lambda c: -c.bit_count()):
+        freq, length = table[mask]
+        members = [l for l in leaves_names if mask >> l & 1]
+        node = owner[members[0]].add_child(dist=length / freq, support=freq / n_trees)
+        for l in members:
+            owner[l] = node
+
+    for l, name in leaves_names.items():
+        freq, length = table[1 << l]
+        owner[l].add_child(name=name, dist=length / freq)
+    return tree
+
+
+def majority_rule(super_graph: SuperGraph, threshold: float = 0.5) -> ete3.Tree:
+    """ Majority-rule consensus: keep the clades present in more than threshold of the input trees
+
+    Args:
+        super_graph (SuperGraph): the super-graph built from the input trees
+        threshold (float, optional): minimal proportion of input trees (at least 0.5 to ensure
+            compatibility). Defaults to 0.5.
+
+    Returns:
+        ete3.Tree: the consensus tree
+    """
+    if threshold < 0.5:
+        raise ValueError("Threshold should be at least 0.5, use extended_majority() otherwise")
+    n_trees = len(super_graph.input)
+    table = super_graph.clade_table()
+    clades = [mask for mask, freq in _candidate_clades(table) if freq > threshold * n_trees]
+    return clades_to_tree(super_graph, clades, table)
+
+
+def extended_majority(super_graph: SuperGraph) -> ete3.Tree:
+    """ Extended majority-rule consensus: greedily add the most frequent clades
+        compatible with all the clades already selected
+
+    Args:
+        super_graph (SuperGraph): the super-graph built from the input trees
+
+    Returns:
+        ete3.Tree: the consensus tree
+    """
+    table = super_graph.clade_table()
+    selected = []
+    for mask, _ in _candidate_clades(table):
+        if all(compatible(mask, s) for s in selected):
+            selected.append(mask)
+    return clades_to_tree(super_graph, selected, table)
+
+
+def frequency_difference(super_graph: SuperGraph) -> ete3.Tree:
+    """ Frequency-difference consensus: keep the clades more frequent than
+        any clade incompatible with them
+
+    Args:
+        super_graph (SuperGraph): the super-graph built from the input trees
+
+    Returns:
+        ete3.Tree: the consensus tree
+    """
+    table = super_graph.clade_table()
+    clades = _candidate_clades(table)
+    selected = []
+    for mask, freq in clades:
+        # Clades are sorted by decreasing frequency: the first incompatible one is the most frequent
+        for other, other_freq in clades:
+            if other_freq < freq:
+                selected.append(mask)
+                break
+            if not compatible(mask, other):
+                break
+        else:
+            selected.append(mask)
+    return clades_to_tree(super_graph, selected, table)
@@ -0,0 +1,107 @@
+""" Collapse the input trees sharing the same topology into weighted records before building the super-graph.
+
+Each tree is canonicalised as the sorted list of its clades (bitsets over the leaves), so that trees with
+the same rooted topology share the same key whatever the order of the children. The branch lengths of
+the trees collapsed in a record are kept with the position of their tree in the input, so that the length
+sums of the super-graph edges are added in the order of the input trees (see ordered_sum()): the super-graph
+built from the records is the same as the one built from the input trees.
+"""
+from operator import itemgetter
+import ete3
+
+
+class TreeRecord:
+    """
+    A distinct topology of the input trees: a representative tree, the number of input trees
+    with this topology, and their branch lengths for each node of the representative.
+    """
+    __slots__ = ("tree", "multiplicity", "lengths")
+
+    def __init__(self, tree: ete3.Tree, multiplicity: int, lengths: list[list[tuple[int, float]]]):
+        self.tree : ete3.Tree = tree
+        self.multiplicity : int = multiplicity
+        # (input index, branch length) of each collapsed tree for each node
+        # (in canonical order while collapsing, then in the preorder of the representative tree)
+        self.lengths : list[list[tuple[int, float]]] = lengths
+
+
+def ordered_sum(contributions: list[tuple[int, float]]) -> float:
+    """ Sum (input index, branch length) contributions in the order of the input trees,
+        as the super-graph built without collapsing the trees
+
+    Args:
+        contributions (list[tuple[int, float]]): the contributions to an edge, e.g. from TreeRecord.lengths
+
+    Returns:
+        float: the sum of the lengths
+    """
+    total = 0
+    for _, length in sorted(contributions, key=itemgetter(0)):
+        total += length
+    return total
+
+
+def canonical_form(tree: ete3.Tree, leaf_ids: dict[str, int]) -> tuple[list[int], list[int], list[float]]:
+    """ Compute the canonical order of the nodes of a tree
+
+    Args:
+        tree (ete3.Tree): the tree
+        leaf_ids (dict[str, int]): index of each leaf name
+
+    Returns:
+        tuple: (clade bitsets in canonical order, preorder index of the nodes in canonical order,
+            branch lengths in canonical order)
+    """
+    nodes = list(tree.traverse("preorder"))
+    index = {node: i for i, node in enumerate(nodes)}
+    masks = [0] * len(nodes)
+    depths = [0] * len(nodes)
+    for i, node in enumerate(nodes):
+        if node.up is not None:
+            depths[i] = depths[index[node.up]] + 1
+    # Children follow their parent in preorder: accumulate the clades in reverse
+    for i in range(len(nodes) - 1, -1, -1):
+        node = nodes[i]
+        if node.is_leaf():
+            masks[i] |= 1 << leaf_ids[node.name]
+        if node.up is not None:
+            masks[index[node.up]] |= masks[i]
+
+    # Depth only separates nodes of a same clade (unary nodes)
+    order = sorted(range(len(nodes)), key=lambda i: (masks[i], depths[i]))
+    return [masks[i] for i in order], order, [nodes[i].dist for i in order]
+
+
+def collapse_trees(inputs: list[ete3.Tree], same_lengths: bool = False) -> list[TreeRecord]:
+    """ Collapse the input trees with identical topology into weighted records
+
+    Args:
+        inputs (list[ete3.Tree]): the input trees (on the same taxa)
+        same_lengths (bool, optional): if True, only collapse trees with identical topology
+            and identical branch lengths. Defaults to False.
+
+    Returns:
+        list[TreeRecord]: the distinct records, in order of first occurrence
+    """
+    leaf_ids = {l: i for i, l in enumerate(inputs[0].get_leaf_names())}
+    records = {}
+    orders = {}
+    for k, t in enumerate(inputs):
+        masks, order, lengths = canonical_form(t, leaf_ids)
+        key = (tuple(masks), tuple(lengths)) if same_lengths else tuple(masks)
+        if key not in records:
+            records[key] = TreeRecord(t, 1, [[(k, l)] for l in lengths])
+            orders[key] = order
+        else:
+            record = records[key]
+            record.multiplicity += 1
+            for contributions, l in zip(record.lengths, lengths):
+                contributions.append((k, l))
+
+    # Lengths were collected in canonical order: put them back in the preorder of the representative
+    for key, record in records.items():
+        lengths = [None] * len(record.lengths)
+        for j, i in enumerate(orders[key]):
+            lengths[i] = record.lengths[j]
+        record.lengths = lengths
+    return list(records.values())
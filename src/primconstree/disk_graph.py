@@ -0,0 +1,423 @@
+""" Out-of-core super-graph, for clade tables larger than the available memory.
+
+The clade table (clade bitset => node id, node degree) and the edge aggregates (frequency, sum of the
+branch lengths) are stored in a SQLite database instead of a dict and a networkx graph. While building,
+new clades, degree increments and edge contributions are buffered in memory and written with batched upserts,
+and only a bounded cache of clade ids is kept. The MST engines then stream the edges from the database:
+Prim queries the neighbours of each node when it enters the tree, Kruskal reads the edges sorted by SQLite.
+
+The node ids, edge order and aggregated values are the same as for SuperGraph, so that the consensus is the same.
+Only the arrays of the MST engines (a few numbers per node) and the MST itself are kept in memory.
+"""
+import heapq
+import logging
+import os
+import sqlite3
+import tempfile
+import weakref
+import numpy as np
+import networkx as nx
+import ete3
+from .dedup import collapse_trees, ordered_sum
+from .super_graph import SuperGraph, clade_bitsets, kruskal_parents
+
+
+# Estimated memory used by a cached clade id (besides the bitset) and by a buffered upsert, in bytes
+CLADE_ENTRY_BYTES = 120
+UPSERT_ENTRY_BYTES = 250
+
+
+def _encode(values: list[float]) -> bytes:
+    return np.array(values, dtype=np.float64).tobytes()
+
+
+def _decode(blob: bytes) -> list[float]:
+    return [] if blob is None else np.frombuffer(blob, dtype=np.float64).tolist()
+
+
+def _append_lengths(a: bytes, b: bytes) -> bytes:
+    """ Append the (input index, branch length) contributions of b to the ones of a
+        (SQL function used by the edge upserts of collapsed trees)
+    """
+    return b if a is None else a + b
+
+
+def _ordered_merge(a: bytes, b: bytes) -> bytes:
+    """ Add the lengths of b one after the other to the sum stored in a, as SuperGraph adds the lengths
+        of the input trees (SQL function used by the edge upserts)
+    """
+    total = sum(_decode(a))
+    for x in _decode(b):
+        total += x
+    return _encode([total])
+
+
+def _ordered_mean(contributions: bytes, count: float) -> float:
+    """ Sum of the (input index, branch length) contributions in input order divided by count (SQL function)
+    """
+    values = _decode(contributions)
+    return ordered_sum(list(zip(values[::2], values[1::2]))) / count
+
+
+def _sum_mean(total: bytes, count: float) -> float:
+    """ Sum stored by _ordered_merge() divided by count (SQL function)
+    """
+    return _decode(total)[0] / count
+
+
+def _close_store(connection: sqlite3.Connection, path: str) -> None:
+    connection.close()
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+class DiskSuperGraph(SuperGraph):
+    """
+    A super-graph stored in a SQLite database, built and used within a memory budget.
+    self.graph and self.node_ids are not available (None): the clades and edges are only in the database.
+    """
+    def __init__(self, inputs: list[ete3.Tree], memory_budget: float = 256, path: str = None,
+                 deduplicate: bool = False, overwrite: bool = False):
+        """ Instanciate the super-graph in a database and compute associated metrics
+
+        Args:
+            inputs (list[ete3.Tree]): the list of trees to build the super-graph from
+            memory_budget (float, optional): memory (in MB) for the clade id cache, the upsert buffers and the
+                SQLite page cache. Defaults to 256.
+            path (str, optional): the database file (a temporary file removed with the instance if None).
+                Defaults to None.
+            deduplicate (bool, optional): if True, collapse the input trees with the same topology
+                (see SuperGraph). Defaults to False.
+            overwrite (bool, optional): if True, replace the database file if it exists, otherwise an existing
+                file is an error. Defaults to False.
+        """
+        if inputs == []:
+            raise ValueError("Need at least one tree to build the SuperGraph")
+        if memory_budget <= 0:
+            raise ValueError("The memory budget should be positive")
+        if path is not None and os.path.exists(path) and not overwrite:
+            raise FileExistsError(f"The super-graph store {path} already exists (use overwrite to replace it)")
+
+        self.graph : nx.Graph = None
+        self.node_ids : dict[frozenset, int] = None
+        self.leaves : dict[str, int] = {l: i for i, l in enumerate(inputs[0].get_leaf_names())}
+        self.root : int = len(self.leaves)
+        self.mst : nx.Graph = None
+        self.input : list[ete3.Tree] = inputs
+        self.length_stats : bool = False
+        self.tree_edges : list = None
+        # Number of distinct nodes (the next node id)
+        self.n_nodes : int = 0
+
+        # Split the memory budget between the clade id cache, the upsert buffers and the SQLite cache
+        budget = memory_budget * 2**20
+        self._key_size : int = (len(self.leaves) + 8) // 8
+        self._cache_limit : int = max(1000, int(budget / 2 / (CLADE_ENTRY_BYTES + self._key_size)))
+        self._batch_size : int = max(1000, int(budget / 4 / UPSERT_ENTRY_BYTES))
+
+        temporary = path is None
+        if temporary:
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+        elif os.path.exists(path):
+            logging.warning("Overwriting the super-graph store %s", path)
+            os.remove(path)
+        self.path : str = path
+        self.db : sqlite3.Connection = sqlite3.connect(path)
+        self._finalizer = weakref.finalize(self, _close_store, self.db, path if temporary else None)
+        self.db.create_function("append_lengths", 2, _append_lengths, deterministic=True)
+        self.db.create_function("ordered_merge", 2, _ordered_merge, deterministic=True)
+        self.db.create_function("ordered_mean", 2, _ordered_mean, deterministic=True)
+        self.db.create_function("sum_mean", 2, _sum_mean, deterministic=True)
+        # The database is a scratch file rebuilt from the inputs: no journal nor synchronisation
+        self.db.executescript(f"""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA cache_size = -{max(1024, int(budget / 4 / 1024))};
+            PRAGMA temp_store = FILE;
+            CREATE TABLE clades (id INTEGER PRIMARY KEY, key BLOB NOT NULL UNIQUE, ndegree INTEGER NOT NULL);
+            CREATE TABLE edges (parent INTEGER NOT NULL, child INTEGER NOT NULL, frequency NOT NULL,
+                                lensum BLOB, avglen REAL, UNIQUE (parent, child));
+            CREATE INDEX edges_child ON edges (child);
+        """)
+
+        # Bounded cache of the clade ids (bitset key => id) and buffered writes
+        self._cache : dict[bytes, int] = {}
+        self._new_clades : list[tuple[int, bytes]] = []
+        self._degrees : dict[int, int] = {}
+        self._edges : dict[tuple[int, int], list] = {}
+        self._n_lengths : int = 0
+        # The lengths are added in the order of the trees, or kept with their input index for the collapsed
+        # trees and added in input order at the end (see dedup.ordered_sum())
+        self._merge : str = "append_lengths" if deduplicate else "ordered_merge"
+        self._mean : str = "ordered_mean" if deduplicate else "sum_mean"
+
+        # Leaves and root first, as in SuperGraph
+        for i in range(len(self.leaves)):
+            self.get_node_id(1 << i)
+        self.get_node_id((1 << len(self.leaves)) - 1)
+
+        # Build the SuperGraph
+        if deduplicate:
+            for record in collapse_trees(self.input):
+                self.incorporate_tree(record.tree, record.multiplicity, record.lengths)
+        else:
+            for t in self.input:
+                self.incorporate_tree(t)
+        self.flush()
+
+        # Average branch length
+        self.db.execute(f"UPDATE edges SET avglen = {self._mean}(lensum, frequency), lensum = NULL")
+        self.db.commit()
+        logging.debug("Super-Graph stored in %s (%i nodes)", path, self.n_nodes)
+
+    def close(self) -> None:
+        """ Close the database (removed if it is a temporary file)
+        """
+        self._finalizer()
+
+    def get_node_id(self, mask: int) -> int:
+        """ Return a node id (int) from a clade bitset over the leaf ids (create if not exist)
+
+        Args:
+            mask (int): the clade bitset
+
+        Returns:
+            int: the node id
+        """
+        key = mask.to_bytes(self._key_size, "little")
+        nid = self._cache.get(key)
+        if nid is None:
+            row = self.db.execute("SELECT id FROM clades WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                nid = self.n_nodes
+                self.n_nodes += 1
+                self._new_clades.append((nid, key))
+            else:
+                nid = row[0]
+            self._cache[key] = nid
+        return nid
+
+    def incorporate_tree(self, t: ete3.Tree, multiplicity: int = 1,
+                         lengths: list[list[tuple[int, float]]] = None) -> None:
+        """ Incorporate a tree in the supergraph (buffered, see flush())
+
+        Args:
+            t (ete3.Tree): the tree to incorporate
+            multiplicity (int, optional): number of input trees with this topology. Defaults to 1.
+            lengths (list[list[tuple[int, float]]], optional): (input index, branch length) of these trees for each
+                node of t in preorder (see dedup.TreeRecord). Defaults to None (branch lengths of t).
+        """
+        nodes = list(t.traverse("preorder"))
+        index = {node: i for i, node in enumerate(nodes)}
+        masks = clade_bitsets(nodes, self.leaves)
+
+        # Preorder ensure to create the node ids in the same order as SuperGraph
+        for i, node in enumerate(nodes):
+            nid = self.get_node_id(masks[i])
+            if node.up is None:
+                continue
+            self._degrees[nid] = self._degrees.get(nid, 0) + multiplicity
+            parent = self.get_node_id(masks[index[node.up]])
+
+            edge = self._edges.get((parent, nid))
+            if edge is None:
+                edge = self._edges[(parent, nid)] = [0, []]
+            if lengths is None:
+                # Kept in order, see _ordered_merge()
+                edge[1].append(node.dist)
+                self._n_lengths += 1
+            else:
+                for k, length in lengths[i]:
+                    edge[1] += (k, length)
+                self._n_lengths += len(lengths[i])
+            edge[0] += multiplicity
+
+        if len(self._edges) + self._n_lengths + len(self._degrees) >= self._batch_size or len(self._cache) >= self._cache_limit:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write the buffered clades, node degrees and edge contributions in the database (batched upserts)
+            and bound the clade id cache
+        """
+        self.db.executemany("INSERT INTO clades (id, key, ndegree) VALUES (?, ?, 0)", self._new_clades)
+        self.db.executemany("UPDATE clades SET ndegree = ndegree + ? WHERE id = ?",
+                            ((d, nid) for nid, d in self._degrees.items()))
+        self.db.executemany(f"""
+            INSERT INTO edges (parent, child, frequency, lensum) VALUES (?1, ?2, ?3, {self._merge}(NULL, ?4))
+            ON CONFLICT (parent, child) DO UPDATE SET frequency = frequency + excluded.frequency,
+                                                      lensum = {self._merge}(lensum, ?4)""",
+            ((p, c, f, _encode(lengths)) for (p, c), (f, lengths) in self._edges.items()))
+        self.db.commit()
+        self._new_clades, self._degrees, self._edges, self._n_lengths = [], {}, {}, 0
+        if len(self._cache) >= self._cache_limit:
+            self._cache.clear()
+
+    def neighbours(self, u: int) -> list[tuple[int, float, float, float]]:
+        """ Return the neighbours of a node in the order the edges were created
+
+        Args:
+            u (int): the node id
+
+        Returns:
+            list[tuple]: (neighbour id, edge frequency, edge average length, neighbour degree) for each edge
+        """
+        rows = self.db.execute("""
+            SELECT e.parent, e.child, e.frequency, e.avglen, p.ndegree, c.ndegree FROM edges e
+            JOIN clades p ON p.id = e.parent JOIN clades c ON c.id = e.child
+            WHERE e.parent = ? OR e.child = ? ORDER BY e.rowid""", (u, u))
+        return [(c, f, l, dc) if p == u else (p, f, l, dp) for p, c, f, l, dp, dc in rows]
+
+    def node_degrees(self) -> np.ndarray:
+        """ Return the degree of each node (indexed by node id)
+        """
+        ndeg = np.zeros(self.n_nodes)
+        for nid, d in self.db.execute("SELECT id, ndegree FROM clades"):
+            ndeg[nid] = d
+        return ndeg
+
+    def modified_prim(self, src: int, old: bool) -> nx.Graph:
+        """ Create the maximum spanning tree of SuperGraph.modified_prim(), the neighbours of each node
+            being read from the database when it enters the tree
+
+        Args:
+            src (int): the source node id to start the mst
+            old (bool): if True use alternative criteria (min branch length and edge frequency)
+
+        Returns:
+            nx.Graph: the mst as a graph instance
+        """
+        n = self.n_nodes
+        n_leaves = len(self.leaves)
+        key = np.full((n, 2 if old else 3), float('inf'))
+        parent = [-1] * n
+        in_mst = np.zeros(n, dtype=bool)
+
+        pq = []
+        heapq.heappush(pq, ((0, 0) if old else (0, 0, 0)) + (src,))
+        key[src] = 0
+        # Degree of the nodes in the queue, to avoid reading them again
+        ndegree = {src: self.db.execute("SELECT ndegree FROM clades WHERE id = ?", (src,)).fetchone()[0]}
+        while pq:
+            u = heapq.heappop(pq)[-1]
+            if in_mst[u]:
+                continue
+            in_mst[u] = True
+
+            ndeg_in = 1/ndegree.pop(u) if u != self.root else float('inf')
+            for v, f, avg_len, ndeg_v in self.neighbours(u):
+                if v < n_leaves or in_mst[v]:
+                    continue
+                ndeg_out = 1/ndeg_v if v != self.root else float('inf')
+                weights = (avg_len, 1/f) if old else (1/f, ndeg_out, ndeg_in)
+                if tuple(key[v].tolist()) > weights:
+                    key[v] = weights
+                    heapq.heappush(pq, (*weights, v))
+                    parent[v] = u
+                    ndegree[v] = ndeg_v
+
+        # Attach the leaf nodes
+        self.attach_leaves(parent, old)
+
+        self.mst = self.parent_to_graph(parent, src)
+        return self.mst
+
+    def modified_kruskal(self, src: int, old: bool) -> nx.Graph:
+        """ Create the maximum spanning tree of SuperGraph.modified_kruskal(), the edges being sorted
+            and streamed by the database
+
+        Args:
+            src (int): the source node id to root the mst
+            old (bool): if True use alternative criteria (min branch length and edge frequency)
+
+        Returns:
+            nx.Graph: the mst as a graph instance
+        """
+        # Edges are stored from the larger clade (parent) to the smaller one (child), the root has a null degree
+        order = "e.avglen, e.frequency DESC" if old else "e.frequency DESC, c.ndegree DESC, p.ndegree DESC"
+        rows = self.db.execute(f"""
+            SELECT e.parent, e.child FROM edges e
+            JOIN clades p ON p.id = e.parent JOIN clades c ON c.id = e.child
+            WHERE e.parent >= ? AND e.child >= ? ORDER BY {order}, e.child""",
+            (len(self.leaves), len(self.leaves)))
+        parent = kruskal_parents(self.n_nodes, self.n_nodes - len(self.leaves), rows, src)
+
+        # Attach the leaf nodes
+        self.attach_leaves(parent, old)
+
+        self.mst = self.parent_to_graph(parent, src)
+        return self.mst
+
+    def attach_leaves(self, parent: list[int], old: bool) -> None:
+        """ Attach each leaf to its best neighbour (see SuperGraph.attach_leaves())
+
+        Args:
+            parent (list[int]): list of parent node id for each node, modified in place for the leaves
+            old (bool): if True use alternative criteria (min branch length and edge frequency)
+        """
+        k = (float('inf'), float('inf')) if old else (float('inf'), float('inf'), float('inf'))
+        for u in self.leaves.values():
+            key = k
+            for v, f, avg_len, ndeg_v in self.neighbours(u):
+                ndeg_in = 1/ndeg_v if v != self.root else float('inf')
+                weights = (avg_len, 1/f) if old else (1/f, ndeg_in, 0)
+                if key > weights:
+                    key = weights
+                    parent[u] = v
+
+    def parent_to_graph(self, parent: list[int], src: int) -> nx.Graph:
+        """ Yield the spanning tree as a nx.Graph instance from a list of parents (see super_graph.parent_to_graph())
+
+        Args:
+            parent (list[int]): list of parent node id for each node (-1 if not reached)
+            src (int): the source node id of the mst
+
+        Returns:
+            nx.Graph: the mst as a graph instance
+        """
+        g = nx.Graph()
+        g.add_nodes_from((nid, {"ndegree": d}) for nid, d in enumerate(self.node_degrees().tolist()))
+        for i, p in enumerate(parent):
+            if i != src and p != -1:
+                row = self.db.execute("""
+                    SELECT frequency, avglen FROM edges WHERE parent = ? AND child = ?
+                    UNION ALL SELECT frequency, avglen FROM edges WHERE parent = ? AND child = ?""",
+                    (p, i, i, p)).fetchone()
+                g.add_edge(i, p, frequency=row[0], avglen=row[1])
+        return g
+
+    def clade_masks(self) -> dict[int, int]:
+        """ Return the clade of each node as a bitset over the leaf ids (the whole clade table is loaded)
+        """
+        return {nid: int.from_bytes(key, "little") for nid, key in self.db.execute("SELECT id, key FROM clades")}
+
+    def draw_graph(self, edge_attribute: str = "frequency", display_deg: bool = False,
+                   mst: bool = False) -> None:
+        """ Draw the mst (the super-graph is only stored in the database, see SuperGraph.draw_graph())
+        """
+        if not mst:
+            logging.warning("The super-graph is stored in %s and can not be drawn", self.path)
+            return
+        super().draw_graph(edge_attribute, display_deg, mst)
+
+    def display_info(self, list_nodes: bool = False) -> None:
+        """
+        Display object usefull information.
+        arguments:
+            list_nodes: if True, list all distinct nodes with their corresponding clade bitset
+        """
+        print("\n== Displaying SuperGraph infos ==\n")
+        print("Database :", self.path)
+        print("Number of input trees :", len(self.input))
+        print("Number of distict nodes identified :", self.n_nodes)
+        print("Number of edges :", self.db.execute("SELECT COUNT(*) FROM edges").fetchone()[0])
+        print("Species mapping :")
+        for l, i in self.leaves.items():
+            print("\t", i, "<=>", l)
+
+        print("Root node id: ", self.root)
+
+        if list_nodes:
+            print("Listing all distinct node identifier :")
+            for i, key in self.db.execute("SELECT id, key FROM clades ORDER BY id"):
+                print("\t", i, "<=>", bin(int.from_bytes(key, "little")))
@@ -0,0 +1,245 @@
+""" Headless export of the super-graph and its maximum spanning tree.
+Images (png, svg, pdf) are drawn with matplotlib without any display, and graphs can also be written
+as DOT or GraphML files. The layout is tree-aware (depth on x, leaves order on y) and computed on a
+spanning tree of the drawn part of the graph, in time linear in the number of drawn edges.
+"""
+import heapq
+import os
+import networkx as nx
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from .super_graph import SuperGraph
+
+
+IMAGE_FORMATS = [".png", ".svg", ".pdf"]
+MAX_LABELS = 300 # Above this number of drawn nodes, node labels are not drawn by default
+MAX_SIZE = (30, 50) # Maximal figure size in inches (width, height)
+
+
+def tree_layout(tree: nx.Graph, root: int) -> dict[int, tuple[float, float]]:
+    """ Compute the position of the nodes of a tree: depth on x axis, leaves evenly spaced on y axis
+        and internal nodes at the mean height of their children. Iterative, in linear time.
+
+    Args:
+        tree (nx.Graph): the tree (for any graph, the BFS tree of the component of root is placed)
+        root (int): the root node
+
+    Returns:
+        dict[int, tuple[float, float]]: node => (x, y)
+    """
+    depth = {root: 0}
+    order = [root]
+    children = {root: []}
+    for u, v in nx.bfs_edges(tree, root):
+        depth[v] = depth[u] + 1
+        children[u].append(v)
+        children[v] = []
+        order.append(v)
+
+    y = {}
+    next_leaf = 0
+    # Reverse BFS order visits children before their parent
+    for u in reversed(order):
+        if children[u]:
+            y[u] = sum(y[c] for c in children[u]) / len(children[u])
+        else:
+            y[u] = next_leaf
+            next_leaf += 1
+    return {u: (depth[u], y[u]) for u in order}
+
+
+def forest_layout(graph: nx.Graph, roots: list[int]) -> dict[int, tuple[float, float]]:
+    """ Compute a tree layout for each connected component of a graph, using a BFS spanning tree
+        of each component and stacking the components along the y axis
+
+    Args:
+        graph (nx.Graph): the graph
+        roots (list[int]): preferred roots, in order (the first node found in a component is used)
+
+    Returns:
+        dict[int, tuple[float, float]]: node => (x, y)
+    """
+    pos = {}
+    offset = 0
+    for r in list(roots) + list(graph.nodes):
+        if r in pos or r not in graph:
+            continue
+        # The BFS edges of the component form its spanning tree
+        component = tree_layout(graph, r)
+        for u, (x, y) in component.items():
+            pos[u] = (x, y + offset)
+        offset += max(y for _, y in component.values()) + 2
+    return pos
+
+
+def mst_neighbourhood(graph: nx.Graph, mst: nx.Graph, root: int, radius: int) -> list[tuple[int, int]]:
+    """ Return the edges of a graph joining two nodes at most radius hops apart in its spanning tree
+        (radius 1: the spanning tree edges). As the spanning tree covers every node, the neighbourhood is
+        measured along the tree: each distance is found by climbing from both nodes, in O(radius) per edge.
+
+    Args:
+        graph (nx.Graph): the graph (super-graph)
+        mst (nx.Graph): the spanning tree
+        root (int): the root of the spanning tree
+        radius (int): maximal number of hops in the spanning tree
+
+    Returns:
+        list[tuple[int, int]]: the edges of the neighbourhood
+    """
+    parent = {root: None}
+    depth = {root: 0}
+    for u, v in nx.bfs_edges(mst, root):
+        parent[v] = u
+        depth[v] = depth[u] + 1
+
+    def close(u, v):
+        hops = 0
+        while u != v and hops <= radius:
+            if depth[u] < depth[v]:
+                u, v = v, u
+            u = parent[u]
+            hops += 1
+        return u == v and hops <= radius
+
+    return [(u, v) for u, v in graph.edges() if u in depth and v in depth and close(u, v)]
+
+
+def select_edges(super_graph: SuperGraph, mst: bool = False, edge_attribute: str = "frequency",
+                 top_n: int = None, center: int = None, radius: int = 1, mst_radius: int = None) -> nx.Graph:
+    """ Select the part of the super-graph (or of the mst) to draw
+
+    Args:
+        super_graph (SuperGraph): the super-graph
+        mst (bool, optional): if True, select from the mst, otherwise from the super-graph. Defaults to False.
+        edge_attribute (str, optional): attribute ranking the edges for top_n. Defaults to "frequency".
+        top_n (int, optional): keep only the top_n edges with highest edge_attribute. Defaults to None (all).
+        center (int, optional): keep only the neighbourhood of this node id. Defaults to None (whole graph).
+        radius (int, optional): number of hops of the neighbourhood around center. Defaults to 1.
+        mst_radius (int, optional): keep only the super-graph edges joining nodes at most this number of hops
+            apart in the mst (see mst_neighbourhood(), the mst must be computed). Defaults to None (whole graph).
+
+    Returns:
+        nx.Graph: the selected subgraph (a view on the original graph when possible)
+    """
+    graph = super_graph.mst if mst else super_graph.graph
+    if graph is None:
+        raise ValueError("The MST has not been computed (see SuperGraph.modified_prim())")
+
+    if center is not None:
+        graph = nx.ego_graph(graph, center, radius)
+    if mst_radius is not None and not mst:
+        if super_graph.mst is None:
+            raise ValueError("The MST has not been computed (see SuperGraph.modified_prim())")
+        graph = graph.edge_subgraph(mst_neighbourhood(graph, super_graph.mst, super_graph.root, mst_radius))
+    if top_n is not None and top_n < graph.number_of_edges():
+        edges = heapq.nlargest(top_n, graph.edges(data=edge_attribute), key=lambda e: e[2])
+        graph = graph.edge_subgraph((u, v) for u, v, _ in edges)
+    return graph
+
+
+def _node_label(super_graph: SuperGraph, leaves_names: dict[int, str], u: int) -> str:
+    return leaves_names.get(u, "root" if u == super_graph.root else str(u))
+
+
+def write_dot(graph: nx.Graph, path: str, super_graph: SuperGraph, edge_attribute: str = "frequency") -> None:
+    """ Write a graph in DOT format (edge attribute as label and pen width)
+    """
+    leaves_names = {v: k for k, v in super_graph.leaves.items()}
+    values = [d for _, _, d in graph.edges(data=edge_attribute, default=0)]
+    scale = max(values, default=1) or 1
+    with open(path, "w") as f:
+        f.write("graph G {\n")
+        for u in graph.nodes:
+            shape = "box" if u in leaves_names else "ellipse"
+            f.write(f'  {u} [label="{_node_label(super_graph, leaves_names, u)}", shape={shape}];\n')
+        for u, v, d in graph.edges(data=edge_attribute, default=0):
+            f.write(f'  {u} -- {v} [label="{d:.4g}", penwidth={0.5 + 4 * d / scale:.3f}];\n')
+        f.write("}\n")
+
+
+def write_graphml(graph: nx.Graph, path: str) -> None:
+    """ Write a graph in GraphML format (only numeric and string attributes are kept)
+    """
+    def keep(data: dict) -> dict:
+        return {k: v for k, v in data.items() if isinstance(v, (int, float, str))}
+
+    g = nx.Graph()
+    g.add_nodes_from((u, keep(d)) for u, d in graph.nodes(data=True))
+    g.add_edges_from((u, v, keep(d)) for u, v, d in graph.edges(data=True))
+    nx.write_graphml(g, path)
+
+
+def draw_image(graph: nx.Graph, path: str, super_graph: SuperGraph, edge_attribute: str = "frequency",
+               labels: bool = None, title: str = None) -> None:
+    """ Draw a graph in an image file (format given by the extension) with a tree layout, without display
+    """
+    leaves_names = {v: k for k, v in super_graph.leaves.items()}
+    roots = [super_graph.root] if super_graph.root in graph else []
+    roots += sorted(graph.nodes, key=lambda u: -graph.nodes[u].get("ndegree", 0))[:1]
+    pos = forest_layout(graph, roots)
+    labels = graph.number_of_nodes() <= MAX_LABELS if labels is None else labels
+
+    values = [d for _, _, d in graph.edges(data=edge_attribute, default=0)]
+    scale = max(values, default=1) or 1
+    # Figure size grows with the graph, bounded to keep the image encoding time reasonable
+    height = max(4, min(MAX_SIZE[1], 0.15 * (max((y for _, y in pos.values()), default=0) + 1)))
+    width = max(6, min(MAX_SIZE[0], 1.5 * (max((x for x, _ in pos.values()), default=0) + 1)))
+
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    segments = [(pos[u], pos[v]) for u, v in graph.edges]
+    ax.add_collection(LineCollection(segments, linewidths=[0.3 + 3 * d / scale for d in values],
+                                     colors="gray", zorder=1))
+    xs = [pos[u][0] for u in graph.nodes]
+    ys = [pos[u][1] for u in graph.nodes]
+    colors = ["lightgreen" if u in leaves_names else "lightblue" for u in graph.nodes]
+    ax.scatter(xs, ys, s=20, c=colors, zorder=2)
+    if labels:
+        for u in graph.nodes:
+            ax.annotate(_node_label(super_graph, leaves_names, u), pos[u], fontsize=6,
+                        xytext=(3, 0), textcoords="offset points", va="center")
+    ax.autoscale()
+    ax.axis("off")
+    if title:
+        ax.set_title(title)
+    fig.savefig(path, bbox_inches="tight")
+
+
+def export_graph(super_graph: SuperGraph, path: str, mst: bool = False, edge_attribute: str = "frequency",
+                 top_n: int = None, center: int = None, radius: int = 1, labels: bool = None,
+                 mst_radius: int = None) -> nx.Graph:
+    """ Export the super-graph or the mst in a file, format given by the extension:
+        .png, .svg, .pdf (drawn image), .dot / .gv (DOT) or .graphml (GraphML)
+
+    Args:
+        super_graph (SuperGraph): the super-graph
+        path (str): the output file
+        mst (bool, optional): if True, export the mst, otherwise the super-graph. Defaults to False.
+        edge_attribute (str, optional): edge attribute used as label / width and to rank edges. Defaults to "frequency".
+        top_n (int, optional): export only the top_n edges with highest edge_attribute. Defaults to None (all).
+        center (int, optional): export only the neighbourhood of this node id. Defaults to None (whole graph).
+        radius (int, optional): number of hops of the neighbourhood around center. Defaults to 1.
+        labels (bool, optional): draw node labels in images. Defaults to None (only for small graphs).
+        mst_radius (int, optional): export only the super-graph edges joining nodes at most this number of hops
+            apart in the mst (see select_edges()). Defaults to None (whole graph).
+
+    Returns:
+        nx.Graph: the exported graph
+    """
+    graph = select_edges(super_graph, mst, edge_attribute, top_n, center, radius, mst_radius)
+    ext = os.path.splitext(path)[1].lower()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if ext in IMAGE_FORMATS:
+        title = ("MST " if mst else "Super-Graph ") + "with " + edge_attribute
+        draw_image(graph, path, super_graph, edge_attribute, labels, title)
+    elif ext in [".dot", ".gv"]:
+        write_dot(graph, path, super_graph, edge_attribute)
+    elif ext == ".graphml":
+        write_graphml(graph, path)
+    else:
+        raise ValueError(f"Unknown export format {ext}")
+    return graph
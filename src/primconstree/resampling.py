@@ -0,0 +1,233 @@
+""" Support values for the PrimConsTree consensus by resampling the input trees (bootstrap / jackknife).
+
+The contribution of each input tree to the super-graph edges is extracted once as a sparse vector.
+A replicate is then a weighted sum of these vectors (weights drawn from the resampling scheme),
+followed by the modified Prim algorithm: the input trees are never parsed nor incorporated again.
+The replicate super-graph is numbered and summed as SuperGraph on the resampled trees (each input tree
+repeated by its weight, in input order), so that its consensus is the same.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import networkx as nx
+import ete3
+from .super_graph import SuperGraph
+from .algorithm import mst_to_consensus
+
+
+class TreeContributions:
+    """
+    Sparse contributions of the input trees to the super-graph edges. Entries of all the trees are
+    concatenated: entry i adds a branch of length entry_length[i] to edge entry_edge[i] for tree entry_tree[i].
+    """
+    def __init__(self, super_graph: SuperGraph):
+        """ Extract the contributions from a super-graph built with keep_tree_edges=True
+
+        Args:
+            super_graph (SuperGraph): the super-graph
+        """
+        if super_graph.tree_edges is None:
+            raise ValueError("The SuperGraph should be built with keep_tree_edges=True")
+
+        # Edges indexed in the order of the super-graph, (parent id, child id) for each edge index
+        edge_index = {}
+        for e, (u, v) in enumerate(super_graph.graph.edges()):
+            edge_index[(u, v)] = edge_index[(v, u)] = e
+
+        entry_tree, entry_edge, entry_length = [], [], []
+        edge_parent = np.zeros(super_graph.graph.number_of_edges(), dtype=np.int64)
+        edge_child = np.zeros(super_graph.graph.number_of_edges(), dtype=np.int64)
+        for i, edges in enumerate(super_graph.tree_edges):
+            for parent, child, length in edges:
+                e = edge_index[(parent, child)]
+                edge_parent[e], edge_child[e] = parent, child
+                entry_tree.append(i)
+                entry_edge.append(e)
+                entry_length.append(length)
+
+        # Leaf ids in the order of the leaves of each tree (SuperGraph numbers the leaves as its first tree)
+        self.tree_leaves : np.ndarray = np.array([[super_graph.leaves[l] for l in t.get_leaf_names()]
+                                                  for t in super_graph.input], dtype=np.int64)
+        self.n_trees : int = len(super_graph.tree_edges)
+        self.n_nodes : int = super_graph.graph.number_of_nodes()
+        self.leaves : dict[str, int] = super_graph.leaves
+        self.root : int = super_graph.root
+        self.edge_parent : np.ndarray = edge_parent
+        self.edge_child : np.ndarray = edge_child
+        self.entry_tree : np.ndarray = np.array(entry_tree, dtype=np.int64)
+        self.entry_edge : np.ndarray = np.array(entry_edge, dtype=np.int64)
+        self.entry_length : np.ndarray = np.array(entry_length, dtype=np.float64)
+
+    def weighted_graph(self, weights: np.ndarray) -> SuperGraph:
+        """ Build the super-graph corresponding to the input trees weighted by their multiplicity:
+            node ids, edge order and length sums are the ones of SuperGraph built from the input trees
+            repeated by their weight, in input order
+
+        Args:
+            weights (np.ndarray): the weight of each input tree (integers, except to only weight the frequencies)
+
+        Returns:
+            SuperGraph: the reweighted super-graph (nodes and edges of the trees with a null weight are removed)
+        """
+        w = weights[self.entry_tree]
+        kept = np.flatnonzero(w > 0)
+        w = w[kept]
+        edges = self.entry_edge[kept]
+        children = self.edge_child[edges]
+        n_leaves = len(self.leaves)
+
+        # Leaves numbered as the first kept tree, internal nodes in order of first appearance (entries are in
+        # preorder of each tree)
+        renumber = np.full(self.n_nodes, -1, dtype=np.int64)
+        renumber[self.tree_leaves[self.entry_tree[kept[0]]]] = np.arange(n_leaves)
+        renumber[self.root] = self.root
+        first = np.full(self.n_nodes, len(kept), dtype=np.int64)
+        np.minimum.at(first, children, np.arange(len(kept)))
+        internal = np.flatnonzero(first[self.root + 1:] < len(kept)) + self.root + 1
+        renumber[internal[np.argsort(first[internal], kind="stable")]] = np.arange(len(internal)) + self.root + 1
+        n_nodes = self.root + 1 + len(internal)
+
+        n_edges = len(self.edge_parent)
+        freq = np.bincount(edges, w, minlength=n_edges)
+        ndegree = np.bincount(renumber[children], w, minlength=n_nodes)
+        # Lengths added one copy after the other, as SuperGraph
+        lensum = [0] * n_edges
+        for e, length, k in zip(edges.tolist(), self.entry_length[kept].tolist(), w.tolist()):
+            if k == int(k):
+                for _ in range(int(k)):
+                    lensum[e] += length
+            else:
+                lensum[e] += k * length
+
+        graph = nx.Graph()
+        graph.add_nodes_from((i, {"ndegree": d}) for i, d in enumerate(ndegree.tolist()))
+        first_entry = np.full(n_edges, len(kept), dtype=np.int64)
+        np.minimum.at(first_entry, edges, np.arange(len(kept)))
+        for e in np.argsort(first_entry, kind="stable")[:np.count_nonzero(freq)].tolist():
+            graph.add_edge(int(renumber[self.edge_parent[e]]), int(renumber[self.edge_child[e]]),
+                           avglen=lensum[e] / freq[e], frequency=freq[e])
+        leaves = {l: int(renumber[i]) for l, i in self.leaves.items()}
+        return SuperGraph.from_graph(graph, dict(sorted(leaves.items(), key=lambda x: x[1])), self.root)
+
+
+def resampling_weights(n_trees: int, replicates: int, method: str = "bootstrap",
+                       keep_fraction: float = 0.5, seed: int = None) -> np.ndarray:
+    """ Draw the weights of the input trees for each replicate
+
+    Args:
+        n_trees (int): number of input trees
+        replicates (int): number of replicates
+        method (str, optional): "bootstrap" (sampling with replacement) or "jackknife" (sampling
+            without replacement). Defaults to "bootstrap".
+        keep_fraction (float, optional): proportion of input trees kept by each jackknife replicate. Defaults to 0.5.
+        seed (int, optional): seed of the random generator. Defaults to None.
+
+    Returns:
+        np.ndarray: replicates x n_trees matrix of weights
+    """
+    rng = np.random.default_rng(seed)
+    if method == "bootstrap":
+        return rng.multinomial(n_trees, [1 / n_trees] * n_trees, size=replicates).astype(np.float64)
+    if method == "jackknife":
+        kept = max(1, round(keep_fraction * n_trees))
+        weights = np.zeros((replicates, n_trees))
+        for r in range(replicates):
+            weights[r, rng.choice(n_trees, kept, replace=False)] = 1
+        return weights
+    raise ValueError(f"Unknown resampling method {method}")
+
+
+def _node_masks(tree: ete3.Tree, leaves: dict[str, int]) -> dict[ete3.Tree, int]:
+    """ Return the clade (bitset over the leaf ids) of each node of a tree
+    """
+    masks = {}
+    for node in tree.traverse("postorder"):
+        if node.is_leaf():
+            masks[node] = 1 << leaves[node.name]
+        else:
+            masks[node] = 0
+            for c in node.children:
+                masks[node] |= masks[c]
+    return masks
+
+
+def _tree_clades(tree: ete3.Tree, leaves: dict[str, int]) -> set[int]:
+    """ Return the clades (bitsets over the leaf ids) of the internal nodes of a tree
+    """
+    return {m for node, m in _node_masks(tree, leaves).items() if not node.is_leaf()}
+
+
+# Contributions and criteria shared by the replicates of a worker process
+_worker_data = {}
+
+
+def _init_worker(contributions: TreeContributions, old_prim: bool, avg_on_merge: bool) -> None:
+    _worker_data["contributions"] = contributions
+    _worker_data["criteria"] = (old_prim, avg_on_merge)
+
+
+def _replicate_clades(weights: np.ndarray) -> list[set[int]]:
+    """ Compute the consensus clades of a batch of replicates (one row of weights per replicate)
+    """
+    contributions = _worker_data["contributions"]
+    old_prim, avg_on_merge = _worker_data["criteria"]
+    clades = []
+    for w in weights:
+        super_graph = contributions.weighted_graph(w)
+        mst = super_graph.modified_prim(super_graph.root, old_prim)
+        tree = mst_to_consensus(super_graph, mst, avg_on_merge)
+        clades.append(_tree_clades(tree, contributions.leaves))
+    return clades
+
+
+def resampling_support(inputs: list[ete3.Tree], replicates: int = 100, method: str = "bootstrap",
+                       old_prim: bool = False, avg_on_merge: bool = False, keep_fraction: float = 0.5,
+                       workers: int = None, seed: int = None) -> ete3.Tree:
+    """ Generate the PrimConsTree consensus with support values obtained by resampling the input trees
+
+    Args:
+        inputs (list[ete3.Tree]): list of input trees
+        replicates (int, optional): number of replicates. Defaults to 100.
+        method (str, optional): "bootstrap" or "jackknife" (see resampling_weights()). Defaults to "bootstrap".
+        old_prim (bool, optional): if True, use previous mst criteria (see algorithm.primconstree()). Defaults to False.
+        avg_on_merge (bool, optional): if True, average lengths of merged branches (see algorithm.primconstree()). Defaults to False.
+        keep_fraction (float, optional): proportion of input trees kept by each jackknife replicate. Defaults to 0.5.
+        workers (int, optional): number of worker processes (1 to run in the current process). Defaults to None (number of cpus).
+        seed (int, optional): seed of the random generator. Defaults to None.
+
+    Returns:
+        ete3.Tree: the consensus tree, support of the internal nodes being the proportion of replicates
+            whose consensus contains the same clade
+    """
+    if replicates < 1:
+        raise ValueError("Need at least one replicate")
+    if workers is not None and workers < 1:
+        raise ValueError("Need at least one worker process")
+    super_graph = SuperGraph(inputs, keep_tree_edges=True)
+    mst = super_graph.modified_prim(super_graph.root, old_prim)
+    consensus = mst_to_consensus(super_graph, mst, avg_on_merge)
+
+    contributions = TreeContributions(super_graph)
+    weights = resampling_weights(contributions.n_trees, replicates, method, keep_fraction, seed)
+    logging.debug("Computing %i %s replicates", replicates, method)
+
+    if workers == 1:
+        _init_worker(contributions, old_prim, avg_on_merge)
+        replicate_clades = _replicate_clades(weights)
+    else:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(contributions, old_prim, avg_on_merge)) as executor:
+            batches = np.array_split(weights, min(replicates, 4 * workers))
+            replicate_clades = [c for batch in executor.map(_replicate_clades, batches) for c in batch]
+
+    # Attach the support values to the consensus nodes
+    counts = {}
+    for clades in replicate_clades:
+        for c in clades:
+            counts[c] = counts.get(c, 0) + 1
+    for node, mask in _node_masks(consensus, super_graph.leaves).items():
+        if not node.is_leaf():
+            node.support = counts.get(mask, 0) / replicates
+    return consensus
@@ -0,0 +1,379 @@
+""" Approximate super-graph within a fixed number of counters, for inputs whose clade table does not fit in memory.
+
+When the input trees are highly discordant, almost every clade is unique, while the MST only selects
+well-supported clades and edges. The clade degrees and the edge frequencies are thus counted with Space-Saving
+heavy-hitter sketches (Metwally et al., 2005): a table of at most `capacity` counters where a new key replaces
+the key with the minimal count, inheriting this count as its error. For each kept key, the true count is between
+count - error and count, and any key with a true count above the minimal count is kept.
+
+The super-graph is built from the kept edges only, each edge having the bounds of its frequency. Edges of the MST
+whose frequency may be exceeded by another parent of the same child (kept or not) are ambiguous: their children
+can be counted exactly by a new pass over the input trees (SketchSuperGraph.refine()), before computing the MST
+again. With a capacity large enough to keep every key, the super-graph and the consensus are the same as SuperGraph.
+"""
+import heapq
+import logging
+import numpy as np
+import networkx as nx
+import ete3
+from .dedup import collapse_trees, ordered_sum
+from .super_graph import SuperGraph, clade_bitsets
+
+
+# Features of the consensus nodes: bounds of the frequency of their MST edge
+SKETCH_FEATURES = ["freq_low", "freq_high"]
+
+
+def _add_lengths(total: list, dist: float, lengths: list[tuple[int, float]] = None) -> None:
+    """ Add the branch lengths of a node to a sum kept as a list: a single value the lengths are added to
+        in the order of the trees, or the (input index, branch length) contributions of the collapsed trees
+        (see dedup.TreeRecord), as in SuperGraph
+    """
+    if lengths is not None:
+        total.extend(lengths)
+    elif total:
+        total[0] += dist
+    else:
+        total.append(dist)
+
+
+class SpaceSaving:
+    """
+    A Space-Saving sketch of the heavy hitters of a weighted stream.
+    Each kept key has a [count, error, payload] entry, where the payload is reset when the key is replaced.
+    """
+    def __init__(self, capacity: int):
+        """ Instanciate an empty sketch
+
+        Args:
+            capacity (int): maximal number of kept keys
+        """
+        if capacity < 1:
+            raise ValueError("The sketch capacity should be positive")
+        self.capacity : int = capacity
+        self.entries : dict = {}
+        # Number of replaced keys (the counts are exact while it is 0)
+        self.evictions : int = 0
+        # (count, key) of each kept key, the counts being lower bounds of the current ones (updated lazily)
+        self._heap : list = []
+
+    def _pop_min(self):
+        # Lazy min-heap: refresh the stale counts until the top is up to date
+        while True:
+            count, key = self._heap[0]
+            if self.entries[key][0] == count:
+                return count, key
+            heapq.heapreplace(self._heap, (self.entries[key][0], key))
+
+    def add(self, key, weight: int = 1) -> list:
+        """ Count a key
+
+        Args:
+            key (Hashable): the key (comparable with the other keys)
+            weight (int, optional): the number of occurrences. Defaults to 1.
+
+        Returns:
+            list: the [count, error, payload] entry of the key
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return entry
+        if len(self.entries) < self.capacity:
+            entry = self.entries[key] = [weight, 0, None]
+            heapq.heappush(self._heap, (weight, key))
+            return entry
+
+        # Replace the key with the minimal count
+        count, old = self._pop_min()
+        del self.entries[old]
+        self.evictions += 1
+        entry = self.entries[key] = [count + weight, count, None]
+        heapq.heapreplace(self._heap, (count + weight, key))
+        return entry
+
+    def minimum(self) -> int:
+        """ Return the upper bound of the count of the keys not kept (0 if no key was replaced)
+        """
+        return self._pop_min()[0] if self.evictions else 0
+
+
+class SketchSuperGraph(SuperGraph):
+    """
+    A super-graph of the heavy-hitter clades and edges, counted with Space-Saving sketches.
+    Edges have an "error" attribute: their true frequency is between frequency - error and frequency.
+    Nodes have a "ndegree_error" attribute in the same way. self.node_ids is not available (None).
+    """
+    def __init__(self, inputs: list[ete3.Tree], sketch_size: int = 100000, deduplicate: bool = False):
+        """ Instanciate the super-graph from the sketches of the input trees
+
+        Args:
+            inputs (list[ete3.Tree]): the list of trees to build the super-graph from
+            sketch_size (int, optional): number of counters of the clade sketch and of the edge sketch. Defaults to 100000.
+            deduplicate (bool, optional): if True, collapse the input trees with the same topology
+                (see SuperGraph). Defaults to False.
+        """
+        if inputs == []:
+            raise ValueError("Need at least one tree to build the SuperGraph")
+
+        self.node_ids : dict[frozenset, int] = None
+        self.leaves : dict[str, int] = {l: i for i, l in enumerate(inputs[0].get_leaf_names())}
+        self.root : int = len(self.leaves)
+        self.mst : nx.Graph = None
+        self.input : list[ete3.Tree] = inputs
+        self.length_stats : bool = False
+        self.tree_edges : list = None
+        self.deduplicate : bool = deduplicate
+        # Clade bitset of each node id, and the reverse mapping
+        self.masks : list[int] = [1 << i for i in range(len(self.leaves))] + [(1 << len(self.leaves)) - 1]
+        self.ids : dict[int, int] = {m: i for i, m in enumerate(self.masks)}
+        # Node ids whose parent edges were counted exactly (see refine())
+        self.exact_children : set[int] = set()
+
+        self.clades : SpaceSaving = SpaceSaving(sketch_size)
+        self.edges : SpaceSaving = SpaceSaving(sketch_size)
+        # Exact number of trees and sum of the pendant branch lengths of each leaf (leaves are in every tree)
+        self.n_trees : int = 0
+        self._pendant : list[list[float]] = [[] for _ in self.leaves]
+        # Preorder position in the stream, to number the nodes as SuperGraph (first appearance)
+        self._position : int = 0
+
+        for t, multiplicity, lengths in self.records():
+            self.incorporate_tree(t, multiplicity, lengths)
+        self.build_graph()
+        logging.debug("Sketched Super-Graph: %i nodes, %i edges (%i clade and %i edge evictions)",
+                      self.graph.number_of_nodes(), self.graph.number_of_edges(),
+                      self.clades.evictions, self.edges.evictions)
+
+    def records(self):
+        """ Iterate on the input trees as (tree, multiplicity, lengths), see SuperGraph.incorporate_tree()
+        """
+        if self.deduplicate:
+            for record in collapse_trees(self.input):
+                yield record.tree, record.multiplicity, record.lengths
+        else:
+            for t in self.input:
+                yield t, 1, None
+
+    def incorporate_tree(self, t: ete3.Tree, multiplicity: int = 1,
+                         lengths: list[list[tuple[int, float]]] = None) -> None:
+        """ Count the clades and edges of a tree in the sketches
+
+        Args:
+            t (ete3.Tree): the tree to incorporate
+            multiplicity (int, optional): number of input trees with this topology. Defaults to 1.
+            lengths (list[list[tuple[int, float]]], optional): (input index, branch length) of these trees for each
+                node of t in preorder (see dedup.TreeRecord). Defaults to None (branch lengths of t).
+        """
+        nodes = list(t.traverse("preorder"))
+        index = {node: i for i, node in enumerate(nodes)}
+        masks = clade_bitsets(nodes, self.leaves)
+        self.n_trees += multiplicity
+
+        for i, node in enumerate(nodes):
+            self._position += 1
+            if node.up is None:
+                continue
+            contributions = None if lengths is None else lengths[i]
+            if node.is_leaf():
+                _add_lengths(self._pendant[self.leaves[node.name]], node.dist, contributions)
+            else:
+                self.clades.add(masks[i], multiplicity)
+
+            edge = self.edges.add((masks[index[node.up]], masks[i]), multiplicity)
+            if edge[2] is None:
+                edge[2] = [[], self._position]
+            _add_lengths(edge[2][0], node.dist, contributions)
+
+    def length_sum(self, total: list) -> float:
+        """ Return the sum of the branch lengths kept for an edge (see _add_lengths())
+        """
+        return ordered_sum(total) if self.deduplicate else total[0]
+
+    def node_id(self, mask: int) -> int:
+        """ Return the node id of a clade bitset, creating the node if needed (with the bounds of its degree)
+
+        Args:
+            mask (int): the clade bitset
+
+        Returns:
+            int: the node id
+        """
+        nid = self.ids.get(mask)
+        if nid is None:
+            nid = self.ids[mask] = len(self.masks)
+            self.masks.append(mask)
+            entry = self.clades.entries.get(mask)
+            # A clade not kept occurred at most minimum() times
+            count, error = (entry[0], entry[1]) if entry is not None else (self.clades.minimum(),) * 2
+            self.graph.add_node(nid, ndegree=count, ndegree_error=error)
+        return nid
+
+    def build_graph(self) -> None:
+        """ Build the super-graph from the kept edges
+        """
+        self.graph = nx.Graph()
+        for i in range(len(self.masks)):
+            self.graph.add_node(i, ndegree=self.n_trees if i != self.root else 0, ndegree_error=0)
+
+        # Number the clades in order of first appearance (as SuperGraph if no key was replaced)
+        first = {}
+        for (parent, child), (_, _, (_, position)) in self.edges.entries.items():
+            first[child] = min(first.get(child, position), position)
+            first[parent] = min(first.get(parent, position - 0.5), position - 0.5)
+        for mask in sorted(first, key=first.get):
+            self.node_id(mask)
+
+        for (parent, child), (count, error, (total, _)) in self.edges.entries.items():
+            # Mean of the lengths seen since the edge is kept (count - error occurrences)
+            self.graph.add_edge(self.ids[parent], self.ids[child], frequency=count, error=error,
+                                avglen=self.length_sum(total) / (count - error))
+
+    def clade_sizes(self) -> np.ndarray:
+        """ Return the number of leaves in the clade of each node
+        """
+        return np.array([bin(m).count("1") for m in self.masks], dtype=np.int64)
+
+    def clade_masks(self) -> dict[int, int]:
+        """ Return the clade of each node as a bitset over the leaf ids
+        """
+        return dict(enumerate(self.masks))
+
+    def attach_leaves(self, parent: list[int], old: bool) -> None:
+        """ Attach each leaf to its best neighbour in the spanning tree (see SuperGraph.attach_leaves()),
+            or to the root if none is in the spanning tree (with frequency bounds [0, minimum()])
+        """
+        super().attach_leaves(parent, old)
+        bound = self.edges.minimum()
+        detached = [u for u in self.leaves.values() if parent[u] == -1]
+        if detached:
+            logging.warning("No kept edge attaches %i leaves to the spanning tree: attached to the root", len(detached))
+        for u in detached:
+            if not self.graph.has_edge(self.root, u):
+                self.graph.add_edge(self.root, u, frequency=bound, error=bound,
+                                    avglen=self.length_sum(self._pendant[u]) / self.n_trees)
+            parent[u] = self.root
+
+    def oriented_edges(self, mst: nx.Graph = None) -> list[tuple[int, int]]:
+        """ Return the (parent, child) edges of a spanning tree, from its root
+
+        Args:
+            mst (nx.Graph, optional): the spanning tree. Defaults to None (use self.mst).
+
+        Returns:
+            list[tuple[int, int]]: the edges in breadth first order
+        """
+        return list(nx.bfs_edges(self.mst if mst is None else mst, self.root))
+
+    def frequency_bounds(self, mst: nx.Graph = None) -> dict[tuple[int, int], tuple[int, int]]:
+        """ Return the bounds of the frequency of each edge of a spanning tree
+
+        Args:
+            mst (nx.Graph, optional): the spanning tree. Defaults to None (use self.mst).
+
+        Returns:
+            dict[tuple[int, int], tuple[int, int]]: (parent, child) => (lower bound, upper bound)
+        """
+        bounds = {}
+        for u, v in self.oriented_edges(mst):
+            data = self.graph[u][v]
+            bounds[(u, v)] = (data["frequency"] - data["error"], data["frequency"])
+        return bounds
+
+    def ambiguous_edges(self, mst: nx.Graph = None) -> list[tuple[int, int]]:
+        """ Return the edges of a spanning tree whose child may have a more frequent parent:
+            the lower bound of their frequency is at most the upper bound of another edge to a super-set
+            of the child (kept edge, or minimum() for edges not kept), one of these bounds being approximate.
+            Children already counted exactly (see refine()) are not ambiguous.
+
+        Args:
+            mst (nx.Graph, optional): the spanning tree. Defaults to None (use self.mst).
+
+        Returns:
+            list[tuple[int, int]]: the ambiguous (parent, child) edges
+        """
+        untracked = self.edges.minimum()
+        ambiguous = []
+        for (u, v), (low, high) in self.frequency_bounds(mst).items():
+            if v in self.exact_children:
+                continue
+            exact = untracked == 0 and low == high
+            rival = untracked
+            for w, data in self.graph[v].items():
+                if w != u and self.masks[w] & self.masks[v] == self.masks[v]:
+                    rival = max(rival, data["frequency"])
+                    exact = exact and data["error"] == 0
+            if not exact and rival >= low:
+                ambiguous.append((u, v))
+        return ambiguous
+
+    def refine(self, edges: list[tuple[int, int]]) -> None:
+        """ Count exactly, with a new pass over the input trees, the edges from all the parents of the children of
+            the given edges and the degrees of these children. The super-graph is updated (the MST should be
+            computed again). Only these counts are kept in memory.
+
+        Args:
+            edges (list[tuple[int, int]]): the (parent, child) edges, e.g. ambiguous_edges()
+        """
+        targets = {self.masks[v] for _, v in edges}
+        degrees = {}
+        counts = {}
+        for t, multiplicity, lengths in self.records():
+            nodes = list(t.traverse("preorder"))
+            index = {node: i for i, node in enumerate(nodes)}
+            masks = clade_bitsets(nodes, self.leaves)
+            for i, node in enumerate(nodes):
+                if node.up is None or masks[i] not in targets:
+                    continue
+                degrees[masks[i]] = degrees.get(masks[i], 0) + multiplicity
+                edge = counts.get((masks[index[node.up]], masks[i]))
+                if edge is None:
+                    edge = counts[(masks[index[node.up]], masks[i])] = [0, []]
+                edge[0] += multiplicity
+                _add_lengths(edge[1], node.dist, None if lengths is None else lengths[i])
+
+        # Replace the parent edges of the children by the exact ones
+        for mask in targets:
+            v = self.ids[mask]
+            self.graph.remove_edges_from([(v, w) for w in list(self.graph[v])
+                                          if self.masks[w] & mask == mask])
+            if v > self.root: # Leaves (ids lower than the root) already have exact degrees
+                self.graph.nodes[v].update(ndegree=degrees[mask], ndegree_error=0)
+            self.exact_children.add(v)
+        for (parent, child), (count, total) in counts.items():
+            self.graph.add_edge(self.node_id(parent), self.ids[child], frequency=count, error=0,
+                                avglen=self.length_sum(total) / count)
+        logging.debug("Counted exactly the parent edges of %i nodes", len(targets))
+
+    def to_tree(self, root: int, mst: nx.Graph = None) -> ete3.Tree:
+        """ Return the maximum spanning tree as an ete3.Tree instance, each node annotated with the
+            bounds of the frequency of its edge (see SKETCH_FEATURES)
+        """
+        mst = self.mst if mst is None else mst
+        tree = super().to_tree(root, mst)
+        for node in tree.iter_descendants():
+            data = mst[node.up.name][node.name]
+            node.add_features(freq_low=data["frequency"] - data["error"], freq_high=data["frequency"])
+        return tree
+
+    def display_info(self, list_nodes: bool = False) -> None:
+        """
+        Display object usefull information.
+        arguments:
+            list_nodes: if True, list all distinct nodes with their corresponding clade bitset
+        """
+        print("\n== Displaying SuperGraph infos ==\n")
+        print("Number of input trees :", len(self.input))
+        print("Sketch capacity :", self.edges.capacity)
+        print("Replaced clades / edges :", self.clades.evictions, "/", self.edges.evictions)
+        print("Number of distict nodes kept :", self.graph.number_of_nodes())
+        print("Species mapping :")
+        for l, i in self.leaves.items():
+            print("\t", i, "<=>", l)
+
+        print("Root node id: ", self.root)
+
+        if list_nodes:
+            print("Listing all distinct node identifier :")
+            for i, mask in enumerate(self.masks):
+                print("\t", i, "<=>", bin(mask))
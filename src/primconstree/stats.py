@@ -0,0 +1,148 @@
+""" Streaming statistics on the branch lengths aggregated on the super-graph edges.
+Every statistic is updated in O(1) time and memory per observed length (no second pass over the input trees):
+- mean and variance with the Welford algorithm
+- min / max
+- approximate quantile with the P² algorithm (Jain & Chlamtac, 1985)
+"""
+from math import sqrt
+
+
+# Features written as annotations on the consensus nodes (see BranchLengthStats.features())
+STAT_FEATURES = ["len_mean", "len_var", "len_min", "len_max", "len_median"]
+
+
+class P2Quantile:
+    """
+    Approximate a quantile of a stream of values with five markers (P² algorithm).
+    The quantile is exact while less than five values were observed.
+    """
+    __slots__ = ("p", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p: float = 0.5):
+        """ Instanciate the estimator
+
+        Args:
+            p (float, optional): the quantile to estimate, in [0, 1]. Defaults to 0.5 (median).
+        """
+        self.p : float = p
+        # Marker heights (the first observed values until five are collected)
+        self.heights : list[float] = []
+        # Actual and desired marker positions, and desired position increments
+        self.positions : list[int] = [0, 1, 2, 3, 4]
+        self.desired : list[float] = [0, 2*p, 4*p, 2 + 2*p, 4]
+        self.increments : list[float] = [0, p/2, p, (1 + p)/2, 1]
+
+    def add(self, x: float) -> None:
+        """ Observe a new value
+
+        Args:
+            x (float): the observed value
+        """
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # Find the cell containing x and update extreme markers
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust the heights of the middle markers if necessary
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    # Linear prediction when the parabolic one is not monotonic
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self) -> float:
+        """ Return the current estimation of the quantile (None if no value was observed)
+        """
+        q = self.heights
+        if not q:
+            return None
+        if self.positions[4] == 4:
+            # At most five observations: exact quantile, interpolated between the neighbouring order statistics
+            if len(q) == 1:
+                return q[0]
+            h = self.p * (len(q) - 1)
+            i = min(int(h), len(q) - 2)
+            return q[i] + (h - i) * (q[i + 1] - q[i])
+        return q[2]
+
+
+class BranchLengthStats:
+    """
+    Bounded-memory summary of the lengths observed for one super-graph edge.
+    """
+    __slots__ = ("count", "mean", "m2", "min", "max", "median")
+
+    def __init__(self):
+        self.count : int = 0
+        self.mean : float = 0.0
+        self.m2 : float = 0.0 # Sum of squared differences to the mean (Welford)
+        self.min : float = float('inf')
+        self.max : float = float('-inf')
+        self.median : P2Quantile = P2Quantile(0.5)
+
+    def add(self, length: float) -> None:
+        """ Observe a new branch length
+
+        Args:
+            length (float): the branch length
+        """
+        self.count += 1
+        delta = length - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (length - self.mean)
+        self.min = min(self.min, length)
+        self.max = max(self.max, length)
+        self.median.add(length)
+
+    @property
+    def variance(self) -> float:
+        """ Sample variance of the observed lengths (0 for less than two observations)
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        """ Sample standard deviation of the observed lengths
+        """
+        return sqrt(self.variance)
+
+    def features(self) -> dict[str, float]:
+        """ Return the statistics as node features (see STAT_FEATURES)
+        """
+        return {
+            "len_mean": self.mean,
+            "len_var": self.variance,
+            "len_min": self.min,
+            "len_max": self.max,
+            "len_median": self.median.value()
+        }
+
+    def __repr__(self) -> str:
+        return (f"BranchLengthStats(count={self.count}, mean={self.mean:g}, var={self.variance:g}, "
+                f"min={self.min:g}, max={self.max:g}, median~{self.median.value()})")
@@ -0,0 +1,181 @@
+""" Consensus restricted to a subset of the taxa, projected from the super-graph of all the taxa.
+
+Pruning an input tree to a subset S of its leaves maps each node to the projection of its clade on S (clade & S
+as bitsets). An edge of the tree whose child projection is empty disappears, an edge whose two projections are
+equal is merged with the edge above it (the node has a single child left), and any other edge becomes the edge
+between the two projections in the pruned tree. The super-graph of the pruned trees is thus obtained from the
+edges contributed by each input tree (see resampling.TreeContributions) with vectorised operations: no tree is
+parsed, pruned nor incorporated again for a query. The consensus is the same as from the trees pruned with
+ete3.Tree.prune(taxa, preserve_branch_length=True), up to the order of the children and the rounding of the
+merged branch lengths. The default prune drops the lengths of the removed nodes, so its consensus has other lengths.
+"""
+from math import fsum
+import numpy as np
+import networkx as nx
+import ete3
+from .super_graph import SuperGraph
+from .resampling import TreeContributions
+from .algorithm import spanning_tree, mst_to_consensus
+
+
+def _bits(mask: int) -> list[int]:
+    """ Return the ids of the bits set in a bitset, in increasing order
+    """
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return bits
+
+
+def _group_sum(groups: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """ Return the sum of the values of each group, added in order (as SuperGraph adds the lengths of the trees)
+    """
+    sums = [0.0] * n_groups
+    for g, x in zip(groups.tolist(), values.tolist()):
+        sums[g] += x
+    return np.array(sums)
+
+
+def _group_fsum(groups: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """ Return the correctly rounded sum of the values of each group
+    """
+    order = np.argsort(groups, kind="stable")
+    bounds = np.searchsorted(groups[order], np.arange(n_groups + 1))
+    values = values[order].tolist()
+    return np.array([fsum(values[bounds[g]:bounds[g + 1]]) for g in range(n_groups)])
+
+
+class SubsetQuery:
+    """
+    Answer consensus queries restricted to subsets of the taxa from a single super-graph build.
+    """
+    def __init__(self, super_graph: SuperGraph):
+        """ Prepare the queries from a super-graph built with keep_tree_edges=True
+
+        Args:
+            super_graph (SuperGraph): the super-graph of all the taxa
+        """
+        self.contributions : TreeContributions = TreeContributions(super_graph)
+        self.leaves : dict[str, int] = super_graph.leaves
+        self._names : list[str] = sorted(self.leaves, key=self.leaves.get)
+        masks = super_graph.clade_masks()
+        # Clade bitset of each node id
+        self.masks : list[int] = [masks[i] for i in range(self.contributions.n_nodes)]
+        # Parent and child node ids of each entry (contribution of an input tree to an edge)
+        self._entry_parent : np.ndarray = self.contributions.edge_parent[self.contributions.entry_edge]
+        self._entry_child : np.ndarray = self.contributions.edge_child[self.contributions.entry_edge]
+
+    @classmethod
+    def from_trees(cls, inputs: list[ete3.Tree]) -> "SubsetQuery":
+        """ Build the super-graph of the input trees and prepare the queries
+        """
+        return cls(SuperGraph(inputs, keep_tree_edges=True))
+
+    def subset_mask(self, taxa: list[str]) -> int:
+        """ Return the bitset of a subset of the taxa
+
+        Args:
+            taxa (list[str]): the names of the taxa
+
+        Returns:
+            int: the bitset over the leaf ids
+        """
+        unknown = [t for t in taxa if t not in self.leaves]
+        if unknown:
+            raise ValueError(f"Unknown taxa: {', '.join(unknown)}")
+        mask = 0
+        for t in taxa:
+            mask |= 1 << self.leaves[t]
+        if bin(mask).count("1") < 2:
+            raise ValueError("Need at least two taxa to build a consensus")
+        return mask
+
+    def super_graph(self, taxa: list[str], weights: np.ndarray = None) -> SuperGraph:
+        """ Build the super-graph of the input trees pruned to a subset of the taxa
+            (node ids and edge order as SuperGraph built from the pruned trees)
+
+        Args:
+            taxa (list[str]): the names of the taxa to keep
+            weights (np.ndarray, optional): the weight of each input tree (see TreeContributions.weighted_graph()).
+                Defaults to None (1 for each tree).
+
+        Returns:
+            SuperGraph: the projected super-graph
+        """
+        subset = self.subset_mask(taxa)
+        contributions = self.contributions
+
+        # Project the clades, numbering the leaves then the root first
+        kept_leaves = [self._names[i] for i in _bits(subset)]
+        ids = {1 << self.leaves[l]: i for i, l in enumerate(kept_leaves)}
+        ids[subset] = len(kept_leaves)
+        projection = np.full(contributions.n_nodes, -1, dtype=np.int64)
+        for u, mask in enumerate(self.masks):
+            mask &= subset
+            if mask:
+                projection[u] = ids.setdefault(mask, len(ids))
+        n_ids = len(ids)
+
+        parents = projection[self._entry_parent]
+        children = projection[self._entry_child]
+        kept = np.flatnonzero((children >= 0) & (parents != children))
+        merged = np.flatnonzero((children >= 0) & (parents == children))
+
+        # Length of each pruned edge of each tree: the kept entry plus the merged entries below it
+        # (one kept entry per tree and child projection, except the root)
+        tree_keys = contributions.entry_tree[kept] * n_ids + children[kept]
+        order = np.argsort(tree_keys)
+        lengths = contributions.entry_length[kept]
+        merged_keys = contributions.entry_tree[merged] * n_ids + children[merged]
+        position = np.minimum(np.searchsorted(tree_keys, merged_keys, sorter=order), len(kept) - 1)
+        below = tree_keys[order[position]] == merged_keys
+        lengths = _group_fsum(np.concatenate([np.arange(len(kept)), order[position[below]]]),
+                              np.concatenate([lengths, contributions.entry_length[merged[below]]]), len(kept))
+
+        # Renumber the internal nodes in order of first appearance (entries are in preorder of each tree)
+        first = np.full(n_ids, len(kept), dtype=np.int64)
+        np.minimum.at(first, children[kept], np.arange(len(kept)))
+        internal = np.arange(len(kept_leaves) + 1, n_ids)
+        renumber = np.arange(n_ids)
+        renumber[internal[np.argsort(first[internal], kind="stable")]] = internal
+        parents, children = renumber[parents[kept]], renumber[children[kept]]
+
+        # Aggregate the pruned edges, in order of first appearance
+        w = np.ones(contributions.n_trees) if weights is None else weights
+        w = w[contributions.entry_tree[kept]]
+        edges, first_entry, inverse = np.unique(parents * n_ids + children, return_index=True, return_inverse=True)
+        freq = np.bincount(inverse, w, minlength=len(edges))
+        lensum = _group_sum(inverse, w * lengths, len(edges))
+        ndegree = np.bincount(edges % n_ids, freq, minlength=n_ids)
+
+        graph = nx.Graph()
+        graph.add_nodes_from((i, {"ndegree": d}) for i, d in enumerate(ndegree.tolist()))
+        for e in np.argsort(first_entry, kind="stable").tolist():
+            if freq[e] > 0:
+                graph.add_edge(int(edges[e] // n_ids), int(edges[e] % n_ids),
+                               avglen=lensum[e] / freq[e], frequency=freq[e])
+
+        # Clades of the nodes, for the engines using the clade sizes
+        node_ids = {frozenset(self._names[i] for i in _bits(mask)): int(renumber[i]) for mask, i in ids.items()}
+        return SuperGraph.from_graph(graph, {l: i for i, l in enumerate(kept_leaves)}, len(kept_leaves), node_ids)
+
+    def consensus(self, taxa: list[str], old_prim: bool = False, avg_on_merge: bool = False,
+                  engine: str = "prim", weights: np.ndarray = None) -> ete3.Tree:
+        """ Generate the consensus tree of the input trees pruned to a subset of the taxa,
+            keeping the lengths of the removed nodes (preserve_branch_length=True, see the module)
+
+        Args:
+            taxa (list[str]): the names of the taxa to keep
+            old_prim (bool, optional): if True, use previous mst criteria (see algorithm.primconstree()). Defaults to False.
+            avg_on_merge (bool, optional): if True, average lengths of merged branches (see algorithm.primconstree()). Defaults to False.
+            engine (str, optional): algorithm computing the MST, "prim" or "kruskal". Defaults to "prim".
+            weights (np.ndarray, optional): the weight of each input tree. Defaults to None (1 for each tree).
+
+        Returns:
+            ete3.Tree: the consensus tree
+        """
+        super_graph = self.super_graph(taxa, weights)
+        mst = spanning_tree(super_graph, old_prim, engine)
+        return mst_to_consensus(super_graph, mst, avg_on_merge)
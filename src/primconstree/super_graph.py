@@ -3,9 +3,14 @@
 - finding mst
 """
 import heapq
+import logging
+import random
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 import ete3
+from .stats import BranchLengthStats
+from .dedup import collapse_trees, ordered_sum
 
 
 def parent_to_graph(parent: list[int], graph: nx.Graph, src: int) -> nx.Graph:
@@ -13,7 +18,7 @@ def parent_to_graph(parent: list[int], graph: nx.Graph, src: int) -> nx.Graph:
         from a list of parents and a graph instance
 
     Args:
-        parent (list[int]): list of parent node id for each node in graph
+        parent (list[int]): list of parent node id for each node in graph (-1 if not reached)
         graph (nx.Graph): the graph instance to build the mst from
         src (int): the source node id to start the mst
 
@@ -24,12 +29,122 @@ def parent_to_graph(parent: list[int], graph: nx.Graph, src: int) -> nx.Graph:
     g.add_nodes_from(graph.nodes(data=True))
 
     for i, p in enumerate(parent):
-        if i != src:
-            g.add_edge(i, p, avglen=graph[i][p]["avglen"], frequency=graph[i][p]["frequency"])
+        if i != src and p != -1:
+            g.add_edge(i, p, **graph[i][p])
 
     return g
 
 
+def clade_bitsets(nodes: list[ete3.Tree], leaves: dict[str, int]) -> list[int]:
+    """ Compute the clade of each node of a tree as a bitset over the leaf ids
+
+    Args:
+        nodes (list[ete3.Tree]): the nodes of the tree in preorder
+        leaves (dict[str, int]): mapping of the leaf names to their id
+
+    Returns:
+        list[int]: the bitset of each node (bit i set if the leaf of id i is in the clade), in the same order
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    masks = [0] * len(nodes)
+    # Children follow their parent in preorder: accumulate the clades in reverse
+    for i in range(len(nodes) - 1, -1, -1):
+        if nodes[i].is_leaf():
+            masks[i] |= 1 << leaves[nodes[i].name]
+        if nodes[i].up is not None:
+            masks[index[nodes[i].up]] |= masks[i]
+    return masks
+
+
+# Width of the random leaf keys of the hashed clade ids (see SuperGraph hashed_clades)
+CLADE_KEY_BITS = 128
+
+
+class CladeCollisionError(RuntimeError):
+    """
+    Two distinct clades got the same hashed id.
+    """
+
+
+def clade_hashes(nodes: list[ete3.Tree], leaf_keys: dict[str, int],
+                 leaf_checks: dict[str, int]) -> list[tuple[int, int, int]]:
+    """ Compute the hashed id of the clade of each node of a tree (XOR of the random keys of its leaves),
+        with a fingerprint to detect collisions (size of the clade, sum of other random keys of its leaves)
+
+    Args:
+        nodes (list[ete3.Tree]): the nodes of the tree in preorder
+        leaf_keys (dict[str, int]): random key of each leaf name (CLADE_KEY_BITS bits)
+        leaf_checks (dict[str, int]): random check key of each leaf name (64 bits)
+
+    Returns:
+        list[tuple[int, int, int]]: (hashed id, size, check sum) of each node, in the same order
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    keys, sizes, checks = [0] * len(nodes), [0] * len(nodes), [0] * len(nodes)
+    # Children follow their parent in preorder: combine the clades in reverse, O(1) per node
+    for i in range(len(nodes) - 1, -1, -1):
+        if nodes[i].is_leaf():
+            keys[i] ^= leaf_keys[nodes[i].name]
+            sizes[i] += 1
+            checks[i] += leaf_checks[nodes[i].name]
+        if nodes[i].up is not None:
+            p = index[nodes[i].up]
+            keys[p] ^= keys[i]
+            sizes[p] += sizes[i]
+            checks[p] = (checks[p] + checks[i]) & 0xFFFFFFFFFFFFFFFF
+    return list(zip(keys, sizes, checks))
+
+
+def kruskal_parents(n: int, n_components: int, edges, src: int) -> list[int]:
+    """ Build a spanning forest by joining components with a union-find structure
+        (path halving and union by size), then orient it from a source node
+
+    Args:
+        n (int): number of nodes (ids from 0 to n-1)
+        n_components (int): number of nodes to span (stop once they are in a single component)
+        edges (Iterable[tuple[int, int]]): the candidate edges, in decreasing order of preference
+        src (int): the source node id to orient the tree from
+
+    Returns:
+        list[int]: list of parent node id for each node (-1 if not reached from src)
+    """
+    uf = list(range(n))
+    uf_size = [1] * n
+    def find(x):
+        while uf[x] != x:
+            uf[x] = uf[uf[x]]
+            x = uf[x]
+        return x
+
+    adjacency = [[] for _ in range(n)]
+    for u, v in edges:
+        if n_components == 1:
+            break
+        ru, rv = find(u), find(v)
+        if ru == rv:
+            continue
+        if uf_size[ru] < uf_size[rv]:
+            ru, rv = rv, ru
+        uf[rv] = ru
+        uf_size[ru] += uf_size[rv]
+        adjacency[u].append(v)
+        adjacency[v].append(u)
+        n_components -= 1
+
+    # Orient the spanning tree from the source node
+    parent = [-1] * n
+    stack = [src]
+    visited = {src}
+    while stack:
+        u = stack.pop()
+        for v in adjacency[u]:
+            if v not in visited:
+                visited.add(v)
+                parent[v] = u
+                stack.append(v)
+    return parent
+
+
 class SuperGraph:
     """
     A class to store and use the supergraph. Main purposes are:
@@ -38,16 +153,31 @@ class SuperGraph:
     - display informations from the super graph or its corresponding maximum spanning tree
     - yield the maximum spanning tree as an ete3.Tree instance
     """
-    def __init__(self, inputs: list[ete3.Tree]):
+    def __init__(self, inputs: list[ete3.Tree], length_stats: bool = False, keep_tree_edges: bool = False,
+                 deduplicate: bool = False, hashed_clades: bool = False, verify_clades: bool = False,
+                 seed: int = 0):
         """ Instanciate the super-graph and compute associated metrics
 
         Args:
             inputs (list[ete3.Tree]): the list of trees to build the super-graph from
+            length_stats (bool, optional): if True, also keep streaming statistics on the branch lengths
+                of each edge (edge attribute "lenstats", see stats.BranchLengthStats). Defaults to False.
+            keep_tree_edges (bool, optional): if True, also keep the edges contributed by each input tree
+                (see self.tree_edges). Defaults to False.
+            deduplicate (bool, optional): if True, collapse the input trees with the same topology and incorporate
+                each distinct topology once, weighted by its multiplicity (see dedup.collapse_trees()). Defaults to False.
+            hashed_clades (bool, optional): if True, identify the clades by the XOR of random keys of their leaves
+                (CLADE_KEY_BITS bits, computed in O(1) per node) instead of the set of their leaf names. Collisions
+                are detected with a fingerprint of each clade, and the super-graph is then built again with the
+                sets of leaf names. Defaults to False.
+            verify_clades (bool, optional): if True, also compare the leaves of each hashed clade with the first
+                occurrence of its id (memory and time of the exact clades, to check the hashed ids). Defaults to False.
+            seed (int, optional): seed of the random leaf keys. Defaults to 0.
         """
         # A graph instance to hold : connectivity, node degree, average edge length, edge frequency
         self.graph : nx.Graph = nx.Graph()
-        # Mapping of node ids following this pattern : set of leaf names (frozenset) => id (integer)
-        self.node_ids : dict[frozenset, int] = {}
+        # Mapping of node ids following this pattern : set of leaf names (frozenset) or hashed id (int) => id (integer)
+        self.node_ids : dict[frozenset | int, int] = {}
         # Mapping of the leaves to store which node should stay a leaf
         self.leaves : dict[str, int] = {}
         # Node id corresponding to the root node
@@ -56,29 +186,118 @@ class SuperGraph:
         self.mst : nx.Graph = None
         # The list of input trees (just in case)
         self.input : list[ete3.Tree] = inputs
+        # Keep distribution statistics of the branch lengths on each edge
+        self.length_stats : bool = length_stats
+        # The (parent id, child id, branch length) edges of each input tree, if kept
+        self.tree_edges : list[list[tuple[int, int, float]]] = [] if keep_tree_edges else None
+        # Hashed clade ids: random keys of the leaves, (size, check sum) fingerprint and
+        # (tree, preorder index) of the first occurrence of each node (None for the leaves and the root)
+        self.hashed_clades : bool = hashed_clades
+        self.verify_clades : bool = verify_clades
+        self.leaf_keys : dict[str, int] = {}
+        self.leaf_checks : dict[str, int] = {}
+        self.fingerprints : list[tuple[int, int]] = []
+        self.representatives : list[tuple[ete3.Tree, int]] = []
 
         if inputs == []:
             raise ValueError("Need at least one tree to build the SuperGraph")
+        if deduplicate and keep_tree_edges:
+            raise ValueError("keep_tree_edges needs the edges of every input tree, it can not be used with deduplicate")
+
+        rng = random.Random(seed)
+        for l in inputs[0].get_leaf_names():
+            self.leaf_keys[l] = rng.getrandbits(CLADE_KEY_BITS)
+            self.leaf_checks[l] = rng.getrandbits(64)
+
+        try:
+            self.build(deduplicate)
+        except CladeCollisionError as e:
+            logging.warning("%s: building the super-graph with exact clade ids", e)
+            self.hashed_clades = False
+            self.build(deduplicate)
+
+    def build(self, deduplicate: bool = False) -> None:
+        """ Build the super-graph from the input trees (see __init__())
+
+        Args:
+            deduplicate (bool, optional): if True, collapse the input trees with the same topology. Defaults to False.
+        """
+        self.graph = nx.Graph()
+        self.node_ids = {}
+        self.leaves = {}
+        self.fingerprints, self.representatives = [], []
+        self._verified : dict[int, int] = {}
+        if self.tree_edges is not None:
+            self.tree_edges = []
 
         # Parse and leaves and map leaves ids
-        for i, l in enumerate(inputs[0].get_leaf_names()):
-            self.node_ids[frozenset({l})] = i
+        for i, l in enumerate(self.input[0].get_leaf_names()):
+            if self.hashed_clades:
+                self.node_ids[self.leaf_keys[l]] = i
+                self.fingerprints.append((1, self.leaf_checks[l]))
+                self.representatives.append(None)
+            else:
+                self.node_ids[frozenset({l})] = i
             self.leaves[l] = i
             self.graph.add_node(i, ndegree=0)
 
         # Identify root node
         self.root = len(self.node_ids)
-        self.node_ids[frozenset(self.leaves.keys())] = self.root
+        if self.hashed_clades:
+            key = 0
+            for l in self.leaves:
+                key ^= self.leaf_keys[l]
+            self.node_ids[key] = self.root
+            self.fingerprints.append((len(self.leaves), sum(self.leaf_checks.values()) & 0xFFFFFFFFFFFFFFFF))
+            self.representatives.append(None)
+        else:
+            self.node_ids[frozenset(self.leaves.keys())] = self.root
         self.graph.add_node(self.root, ndegree=0)
 
         # Build the SuperGraph
-        for t in self.input:
-            self.incorporate_tree(t)
+        if deduplicate:
+            # Branch length statistics need individual lengths: only collapse strictly identical trees
+            for record in collapse_trees(self.input, same_lengths=self.length_stats):
+                self.incorporate_tree(record.tree, record.multiplicity, record.lengths)
+        else:
+            for t in self.input:
+                self.incorporate_tree(t)
 
-        # Update average branch length
+        # Update average branch length (lengths of the collapsed trees summed in input order, if any)
         for u, v in self.graph.edges():
+            lengths = self.graph[u][v].pop("lengths")
+            if lengths:
+                self.graph[u][v]["avglen"] = ordered_sum(lengths)
             self.graph[u][v]["avglen"] = self.graph[u][v]["avglen"] / self.graph[u][v]["frequency"]
 
+    @classmethod
+    def from_graph(cls, graph: nx.Graph, leaves: dict[str, int], root: int,
+                   node_ids: dict[frozenset, int] = None, inputs: list[ete3.Tree] = None) -> "SuperGraph":
+        """ Instanciate a super-graph from an already aggregated graph (e.g. reweighted or projected counts)
+
+        Args:
+            graph (nx.Graph): graph with "ndegree" node attribute, "avglen" (average) and "frequency" edge attributes.
+                Node ids must be integers lower than the number of nodes.
+            leaves (dict[str, int]): mapping of the leaf names to their node id
+            root (int): the root node id
+            node_ids (dict[frozenset, int], optional): mapping of the clades to their node id. Defaults to None.
+            inputs (list[ete3.Tree], optional): the input trees the counts come from. Defaults to None.
+
+        Returns:
+            SuperGraph: the super-graph instance
+        """
+        super_graph = cls.__new__(cls)
+        super_graph.graph = graph
+        super_graph.node_ids = node_ids if node_ids is not None else {}
+        super_graph.leaves = leaves
+        super_graph.root = root
+        super_graph.mst = None
+        super_graph.input = inputs if inputs is not None else []
+        super_graph.length_stats = False
+        super_graph.tree_edges = None
+        super_graph.hashed_clades = False
+        return super_graph
+
     def get_node_id(self, node: ete3.Tree) -> int:
         """ Return a node id (int) from a ete3 node instance (create if not exist)
             Id is created from the set of leaf names in the subtree
@@ -94,16 +313,57 @@ class SuperGraph:
             self.node_ids[cluster] = len(self.node_ids)
         return self.node_ids[cluster]
 
-    def incorporate_tree(self, t: ete3.Tree) -> None:
+    def get_hashed_id(self, clades: list[tuple[int, int, int]], i: int, t: ete3.Tree) -> int:
+        """ Return a node id (int) from the hashed id of a node (create if not exist)
+
+        Args:
+            clades (list[tuple[int, int, int]]): the hashed ids and fingerprints of the nodes of t (see clade_hashes())
+            i (int): the preorder index of the node in t
+            t (ete3.Tree): the tree
+
+        Returns:
+            int: the node id
+        """
+        key, size, check = clades[i]
+        nid = self.node_ids.get(key)
+        if nid is None:
+            nid = self.node_ids[key] = len(self.node_ids)
+            self.fingerprints.append((size, check))
+            self.representatives.append((t, i))
+        elif self.fingerprints[nid] != (size, check):
+            raise CladeCollisionError(f"Collision of the hashed clade id {key:x} (node {nid})")
+        return nid
+
+    def incorporate_tree(self, t: ete3.Tree, multiplicity: int = 1, lengths: list[list[tuple[int, float]]] = None) -> None:
         """ Incorporate a tree in the supergraph. 
             Update nodes, edges and node degree, edge frequency, average edge length
 
         Args:
             t (ete3.Tree): the tree to incorporate
+            multiplicity (int, optional): number of input trees with this topology. Defaults to 1.
+            lengths (list[list[tuple[int, float]]], optional): (input index, branch length) of these trees for each
+                node of t in preorder (see dedup.TreeRecord). Defaults to None (branch lengths of t).
         """
+        edges = []
+        if self.tree_edges is not None:
+            self.tree_edges.append(edges)
+        nodes = list(t.traverse("preorder"))
+        if self.hashed_clades:
+            index = {node: i for i, node in enumerate(nodes)}
+            clades = clade_hashes(nodes, self.leaf_keys, self.leaf_checks)
+            # Repeated leaves cancel out in the XOR, while the sets of leaf names ignore them
+            if len({node.name for node in nodes if node.is_leaf()}) != clades[0][1]:
+                raise CladeCollisionError("Repeated leaf names in an input tree")
+            masks = clade_bitsets(nodes, self.leaves) if self.verify_clades else None
+
         # Preorder ensure to incorporate parent before children
-        for node in t.traverse("preorder"):
-            nid = self.get_node_id(node)
+        for i, node in enumerate(nodes):
+            if self.hashed_clades:
+                nid = self.get_hashed_id(clades, i, t)
+                if masks is not None and self._verified.setdefault(nid, masks[i]) != masks[i]:
+                    raise CladeCollisionError(f"Collision of the hashed clade id {clades[i][0]:x} (node {nid})")
+            else:
+                nid = self.get_node_id(node)
 
             # The node is not in the graph
             if nid not in self.graph.nodes:
@@ -111,15 +371,81 @@ class SuperGraph:
 
             # The node is not the root
             if node.up:
-                self.graph.nodes[nid]["ndegree"] += 1
-                parent = self.get_node_id(node.up)
+                self.graph.nodes[nid]["ndegree"] += multiplicity
+                parent = self.get_hashed_id(clades, index[node.up], t) if self.hashed_clades else self.get_node_id(node.up)
 
                 # The edge is not in the graph
                 if nid not in self.graph[parent]:
-                    self.graph.add_edge(parent, nid, avglen=0, frequency=0)
+                    self.graph.add_edge(parent, nid, avglen=0, frequency=0, lengths=[])
+                    if self.length_stats:
+                        self.graph[parent][nid]["lenstats"] = BranchLengthStats()
+
+                if lengths is None:
+                    self.graph[parent][nid]["avglen"] += node.dist
+                else:
+                    self.graph[parent][nid]["lengths"].extend(lengths[i])
+                self.graph[parent][nid]["frequency"] += multiplicity
+                if self.length_stats:
+                    for _ in range(multiplicity):
+                        self.graph[parent][nid]["lenstats"].add(node.dist)
+                if self.tree_edges is not None:
+                    edges.append((parent, nid, node.dist))
+
+    def clade_masks(self) -> dict[int, int]:
+        """ Return the clade of each node as a bitset over the leaf ids
+
+        Returns:
+            dict[int, int]: node id => bitset (bit i set if the leaf of id i is in the clade)
+        """
+        if not self.hashed_clades:
+            return {nid: sum(1 << self.leaves[l] for l in cluster) for cluster, nid in self.node_ids.items()}
+
+        # Recompute the clades of the trees where the nodes first occurred
+        masks = {i: 1 << i for i in self.leaves.values()}
+        masks[self.root] = (1 << len(self.leaves)) - 1
+        occurrences = {}
+        for nid, representative in enumerate(self.representatives):
+            if representative is not None:
+                t, i = representative
+                occurrences.setdefault(id(t), (t, []))[1].append((nid, i))
+        for t, nodes in occurrences.values():
+            tree_masks = clade_bitsets(list(t.traverse("preorder")), self.leaves)
+            for nid, i in nodes:
+                masks[nid] = tree_masks[i]
+        return masks
+
+    def clade_sizes(self) -> np.ndarray:
+        """ Return the number of leaves in the clade of each node
 
-                self.graph[parent][nid]["avglen"] += node.dist
-                self.graph[parent][nid]["frequency"] += 1
+        Returns:
+            np.ndarray: the clade size, indexed by node id
+        """
+        if self.hashed_clades:
+            return np.array([size for size, _ in self.fingerprints], dtype=np.int64)
+        sizes = np.zeros(self.graph.number_of_nodes(), dtype=np.int64)
+        for cluster, nid in self.node_ids.items():
+            sizes[nid] = len(cluster)
+        return sizes
+
+    def clade_table(self) -> dict[int, tuple[int, float]]:
+        """ Return the frequency and total branch length of each clade (root excluded) in the input trees
+
+        Returns:
+            dict[int, tuple[int, float]]: bitset of the clade => (number of input trees containing the clade,
+                sum of the lengths of the branch above the clade)
+        """
+        masks = self.clade_masks()
+        table = {}
+        for nid, mask in masks.items():
+            if nid == self.root:
+                continue
+            length = 0
+            for v, data in self.graph[nid].items():
+                # Edges toward a super-set of the clade are the branches above it
+                if masks[v] != mask and masks[v] & mask == mask:
+                    length += data["avglen"] * data["frequency"]
+            table[mask] = (self.graph.nodes[nid]["ndegree"], length)
+        return table
 
     def modified_prim(self, src: int, old: bool) -> nx.Graph:
         """ Create a maximum spanning tree using a priority queue.
@@ -144,6 +470,8 @@ class SuperGraph:
         parent = [-1] * n    # Keep track of the topology of the mst
         in_mst = [False] * n # To keep track of vertices included in MST
 
+        leaves = set(self.leaves.values())
+
         # Init the queue with the source node
         pq = []
         crits = (0, 0) if old else (0, 0, 0)
@@ -159,7 +487,7 @@ class SuperGraph:
             in_mst[u] = True
 
             for v in self.graph[u]:
-                if v in self.leaves.values():
+                if v in leaves:
                     continue
                 ndeg_out = 1/self.graph.nodes[v]["ndegree"] if v != self.root else float('inf')
                 ndeg_in = 1/self.graph.nodes[u]["ndegree"] if u != self.root else float('inf')
@@ -172,33 +500,103 @@ class SuperGraph:
                     parent[v] = u
 
         # Attach the leaf nodes
+        self.attach_leaves(parent, old)
+
+        # Build the networkx instance from a list of parents
+        self.mst = parent_to_graph(parent, self.graph, src)
+        return self.mst
+
+    def modified_kruskal(self, src: int, old: bool) -> nx.Graph:
+        """ Create a maximum spanning tree by sorting all the non-leaf edges once (vectorised
+            lexicographic sort) and joining components with a union-find structure.
+            Each edge is oriented from the larger clade (parent) to the smaller one (child), so that
+            the criteria are (in this order):
+            - edge frequency,
+            - node degree (child vertex),
+            - node degree (parent vertex)
+            The first criteria is the same as modified_prim(), so both trees are maximal for it. Ties on the
+            frequency may be broken differently, as Prim uses the degrees in the direction the tree grows
+            (same consensus on the bundled datasets, see benchmark_mst.py).
+
+        Args:
+            src (int): the source node id to root the mst
+            old (bool): if True use alternative criteria (min branch length and edge frequency)
+
+        Returns:
+            nx.Graph: the mst as a graph instance
+        """
+        n = self.graph.number_of_nodes()
+        leaves = set(self.leaves.values())
+        sizes = self.clade_sizes()
+        ndeg = np.array([d for _, d in sorted(self.graph.nodes(data="ndegree"))], dtype=np.float64)
+        inv_ndeg = np.divide(1, ndeg, out=np.zeros(n), where=ndeg != 0)
+        inv_ndeg[self.root] = float('inf')
+
+        edges = [(u, v, d["frequency"], d["avglen"]) for u, v, d in self.graph.edges(data=True)
+                 if u not in leaves and v not in leaves]
+        if not edges:
+            edges_u = edges_v = order = np.zeros(0, dtype=np.int64)
+        else:
+            edges_u, edges_v, freq, avg_len = (np.array(a) for a in zip(*edges))
+            parents = np.where(sizes[edges_u] >= sizes[edges_v], edges_u, edges_v)
+            children = np.where(sizes[edges_u] >= sizes[edges_v], edges_v, edges_u)
+            # np.lexsort sorts by the last key first, exact ties are broken by child id like the heap of Prim
+            if old:
+                order = np.lexsort((children, 1/freq, avg_len))
+            else:
+                order = np.lexsort((children, inv_ndeg[parents], inv_ndeg[children], 1/freq))
+
+        # Join the components in the sorted order
+        parent = kruskal_parents(n, n - len(leaves), zip(edges_u[order].tolist(), edges_v[order].tolist()), src)
+
+        # Attach the leaf nodes
+        self.attach_leaves(parent, old)
+
+        # Build the networkx instance from a list of parents
+        self.mst = parent_to_graph(parent, self.graph, src)
+        return self.mst
+
+    def attach_leaves(self, parent: list[int], old: bool) -> None:
+        """ Attach each leaf to its best neighbour in the spanning tree, based on (in this order):
+            - edge frequency,
+            - node degree (neighbour vertex)
+
+        Args:
+            parent (list[int]): list of parent node id for each node, modified in place for the leaves
+            old (bool): if True use alternative criteria (min branch length and edge frequency)
+        """
+        k = (float('inf'), float('inf')) if old else (float('inf'), float('inf'), float('inf'))
         for u in self.leaves.values():
+            key = k
             for v in self.graph[u]:
+                if parent[v] == -1 and v != self.root:
+                    continue
                 ndeg_in = 1/self.graph.nodes[v]["ndegree"] if v != self.root else float('inf')
                 freq = 1/self.graph[u][v]["frequency"]
                 avg_len = self.graph[u][v]["avglen"]
                 weights = (avg_len, freq) if old else (freq, ndeg_in, 0)
-                if key[u] > weights:
-                    key[u] = weights
+                if key > weights:
+                    key = weights
                     parent[u] = v
 
-        # Build the networkx instance from a list of parents
-        self.mst = parent_to_graph(parent, self.graph, src)
-        return self.mst
-
-    def to_tree(self, root: int) -> ete3.Tree:
+    def to_tree(self, root: int, mst: nx.Graph = None) -> ete3.Tree:
         """ Return the maximum spanning tree as an ete3.Tree instance from the nx.Graph
 
         Args:
             root (int): the root node id of the tree
+            mst (nx.Graph, optional): the spanning tree to convert. Defaults to None (use self.mst).
 
         Returns:
-            ete3.Tree: the mst as a tree instance
+            ete3.Tree: the mst as a tree instance (nodes annotated with the branch length statistics
+                of their edge if length_stats is enabled, see stats.STAT_FEATURES)
         """
+        mst = self.mst if mst is None else mst
         tree = ete3.Tree(name=root)
         nodes = {root: tree}
-        for u, v in nx.bfs_edges(self.mst, root):
-            nodes[v] = nodes[u].add_child(dist=self.mst[u][v]["avglen"], name=v)
+        for u, v in nx.bfs_edges(mst, root):
+            nodes[v] = nodes[u].add_child(dist=mst[u][v]["avglen"], name=v)
+            if "lenstats" in mst[u][v]:
+                nodes[v].add_features(**mst[u][v]["lenstats"].features())
         return tree
 
     def replace_leaves_names(self, t: ete3.Tree) -> ete3.Tree:
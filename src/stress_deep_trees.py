@@ -0,0 +1,114 @@
+""" Stress test of the tree algorithms on very deep (caterpillar) trees.
+
+For caterpillars of at least three increasing sizes (each level adds a leaf), time newick parsing and depths
+(utils.kcdist), the in-memory super-graph build with hashed clade ids, consensus extraction from the MST
+(super-graph stored on disk, see primconstree.disk_graph) and newick writing, and check that the time per node
+does not grow with the number of levels. Each step is timed as the best of several repeats. The Kendall-Colijn
+distance is timed on smaller trees: its vector has one value per pair of leaves, so its time is compared per pair.
+The recursion limit is lowered to show that no step recurses per level.
+"""
+import argparse
+import random
+import sys
+import time
+import ete3
+from utils.kcdist import KC_dist, _KC_tree
+from primconstree.super_graph import SuperGraph
+from primconstree.disk_graph import DiskSuperGraph
+from primconstree.algorithm import mst_to_consensus
+
+
+RECURSION_LIMIT = 500
+
+
+def caterpillar(n_leaves: int, seed: int = 0) -> ete3.Tree:
+    """ Generate a caterpillar tree (one leaf and one internal node per level) with shuffled leaves
+        and random branch lengths
+
+    Args:
+        n_leaves (int): number of leaves
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        ete3.Tree: the tree
+    """
+    rng = random.Random(seed)
+    names = [f"t{i}" for i in range(n_leaves)]
+    rng.shuffle(names)
+    tree = ete3.Tree()
+    node = tree
+    for name in names[:-1]:
+        node.add_child(name=name, dist=rng.random())
+        node = node.add_child(dist=rng.random())
+    node.name = names[-1]
+    return tree
+
+
+def timed(f, repeat: int = 1) -> float:
+    """ Return the best duration of repeated calls in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def check_scaling(name: str, sizes: list[int], times: list[float], tolerance: float) -> bool:
+    """ Print the time per unit of size (node or pair) and check that it does not grow by more than tolerance
+        from the smallest size
+    """
+    per_unit = [t / s for s, t in zip(sizes, times)]
+    linear = max(per_unit) <= tolerance * per_unit[0]
+    details = ", ".join(f"{s}: {t:.3f}s" for s, t in zip(sizes, times))
+    print(f"{name:<24} {details} -> {'linear' if linear else 'NOT LINEAR'} "
+          f"(time per unit x{max(per_unit) / per_unit[0]:.2f})")
+    return linear
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--levels', type=int, nargs="+", help='number of levels of the caterpillars', default=[10000, 20000, 40000])
+    parser.add_argument('--kc-levels', type=int, nargs="+", help='number of levels of the caterpillars compared with KC', default=[1000, 2000, 4000])
+    parser.add_argument('--trees', type=int, help='number of input trees of the consensus', default=3)
+    parser.add_argument('--tolerance', type=float, help='maximal growth of the time per unit of size', default=2.0)
+    parser.add_argument('--repeat', type=int, help='number of timed repeats of each step (the best is kept)', default=3)
+    args = parser.parse_args()
+    if min(len(args.levels), len(args.kc_levels)) < 3:
+        parser.error("at least three sizes are needed to check the scaling")
+    args.levels, args.kc_levels = sorted(args.levels), sorted(args.kc_levels)
+    sys.setrecursionlimit(RECURSION_LIMIT)
+
+    stages = {"parse + depths": [], "hashed super-graph": [], "consensus extraction": [], "newick writing": []}
+    for n in args.levels:
+        trees = [caterpillar(n, seed) for seed in range(args.trees)]
+        newick = trees[0].write()
+        stages["parse + depths"].append(timed(lambda: _KC_tree(newick), args.repeat))
+        stages["hashed super-graph"].append(timed(lambda: SuperGraph(trees, hashed_clades=True), args.repeat))
+
+        super_graph = DiskSuperGraph(trees)
+        mst = super_graph.modified_prim(super_graph.root, False)
+        consensus = None
+        def extract():
+            nonlocal consensus
+            consensus = mst_to_consensus(super_graph, mst)
+        stages["consensus extraction"].append(timed(extract, args.repeat))
+        super_graph.close()
+        stages["newick writing"].append(timed(lambda: consensus.write(), args.repeat))
+
+    kc_times, kc_pairs = [], []
+    for n in args.kc_levels:
+        t1, t2 = caterpillar(n, 0).write(), caterpillar(n, 1).write()
+        kc_times.append(timed(lambda: KC_dist(t1, t2, 0.5), args.repeat))
+        kc_pairs.append(n * (n - 1) // 2)
+
+    # A caterpillar with n leaves has 2n - 1 nodes
+    nodes = [2 * n - 1 for n in args.levels]
+    linear = all(check_scaling(name, nodes, times, args.tolerance) for name, times in stages.items())
+    linear &= check_scaling("KC distance (pairs)", kc_pairs, kc_times, args.tolerance)
+    print("All steps scale linearly" if linear else "Some steps do not scale linearly")
+    sys.exit(0 if linear else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+""" Tests are run from src/ (python -m pytest tests): the packages are imported as by the scripts.
+"""
+import os
+import sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from utils.trees import read_trees  # noqa: E402
+
+
+@pytest.fixture
+def dataset():
+    """ Read the trees of a bundled dataset, given by its path in datasets/
+    """
+    def read(name: str):
+        return read_trees(os.path.join(os.path.dirname(SRC_DIR), "datasets", name))
+    return read
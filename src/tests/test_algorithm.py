@@ -0,0 +1,21 @@
+""" Tests of the options of primconstree.algorithm
+"""
+import pytest
+import ete3
+from primconstree.algorithm import build_super_graph, primconstree
+
+
+TREES = ["((A:1,B:1):1,(C:1,D:1):1);", "((A:1,C:1):1,(B:1,D:1):1);", "((A:1,B:1):1,(C:1,D:1):1);"]
+
+
+@pytest.mark.parametrize("options", [{"memory_budget": 16}, {"sketch_size": 10}])
+def test_hashed_clades_only_in_memory(options):
+    with pytest.raises(ValueError):
+        build_super_graph([ete3.Tree(t) for t in TREES], hashed_clades=True, **options)
+
+
+def test_options_are_keyword_only():
+    inputs = [ete3.Tree(t) for t in TREES]
+    with pytest.raises(TypeError):
+        primconstree(inputs, False, False, False, True)
+    assert primconstree(inputs, hashed_clades=True).write(format=9) == primconstree(inputs).write(format=9)
@@ -0,0 +1,32 @@
+""" Tests of the collapsed input trees (primconstree.dedup): the consensus is the one of the input trees
+"""
+import pytest
+from primconstree.algorithm import primconstree
+from primconstree.dedup import collapse_trees
+
+TREX = [f"simulated/Trex_trees{n}.txt" for n in [20, 40, 60, 80, 100]]
+
+
+@pytest.mark.parametrize("old_prim", [False, True])
+@pytest.mark.parametrize("name", TREX)
+def test_dedup_same_consensus(dataset, name, old_prim):
+    trees = dataset(name)
+    assert primconstree(trees, old_prim, deduplicate=True).write() == primconstree(trees, old_prim).write()
+
+
+@pytest.mark.parametrize("options", [{"engine": "kruskal"}, {"memory_budget": 16}, {"sketch_size": 100000}])
+def test_dedup_same_consensus_other_engines(dataset, options):
+    trees = dataset("simulated/Trex_trees100.txt")
+    assert (primconstree(trees, True, deduplicate=True, **options).write()
+            == primconstree(trees, True, **options).write())
+
+
+def test_collapse_records(dataset):
+    trees = dataset("simulated/Trex_trees100.txt")
+    records = collapse_trees(trees)
+    assert sum(r.multiplicity for r in records) == len(trees)
+    assert len(records) < len(trees)
+    # Each node keeps one (input index, length) per collapsed tree, the first one of the representative
+    for r in records:
+        assert all(len(contributions) == r.multiplicity for contributions in r.lengths)
+        assert [l for _, l in (c[0] for c in r.lengths)] == [n.dist for n in r.tree.traverse("preorder")]
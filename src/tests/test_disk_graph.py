@@ -0,0 +1,29 @@
+""" Tests of the super-graph stored on disk (primconstree.disk_graph)
+"""
+import pytest
+from primconstree.algorithm import primconstree
+
+DATASETS = ["kmedoids/cluster1.txt", "simulated/Trex_trees60.txt", "biological/47_ribosomal_proteins_trees.txt"]
+
+
+@pytest.mark.parametrize("engine", ["prim", "kruskal"])
+@pytest.mark.parametrize("old_prim", [False, True])
+@pytest.mark.parametrize("name", DATASETS)
+def test_same_consensus_as_in_memory(dataset, name, old_prim, engine):
+    trees = dataset(name)
+    # A small budget forces several flushes and evictions of the clade id cache
+    assert (primconstree(trees, old_prim, memory_budget=0.01, engine=engine).write()
+            == primconstree(trees, old_prim, engine=engine).write())
+
+
+def test_existing_store_is_kept(dataset, tmp_path):
+    trees = dataset("simulated/Trex_trees20.txt")
+    store = tmp_path / "super_graph.sqlite"
+    store.write_text("previous")
+    with pytest.raises(FileExistsError):
+        primconstree(trees, memory_budget=16, store_path=str(store))
+    assert store.read_text() == "previous"
+
+    consensus = primconstree(trees, memory_budget=16, store_path=str(store), overwrite_store=True)
+    assert consensus.write() == primconstree(trees).write()
+    assert store.read_bytes().startswith(b"SQLite format 3")
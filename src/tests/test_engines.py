@@ -0,0 +1,16 @@
+""" Tests of the MST engines: Kruskal gives the same consensus as Prim
+"""
+import pytest
+from primconstree.algorithm import primconstree
+
+DATASETS = ["articles-illustrations/fig5.txt", "kmedoids/cluster1.txt", "simulated/Trex_trees40.txt",
+            "simulated/Trex_trees100.txt", "biological/47_ribosomal_proteins_trees.txt"]
+
+
+@pytest.mark.parametrize("avg_on_merge", [False, True])
+@pytest.mark.parametrize("old_prim", [False, True])
+@pytest.mark.parametrize("name", DATASETS)
+def test_kruskal_same_consensus(dataset, name, old_prim, avg_on_merge):
+    trees = dataset(name)
+    assert (primconstree(trees, old_prim, avg_on_merge, engine="kruskal").write()
+            == primconstree(trees, old_prim, avg_on_merge, engine="prim").write())
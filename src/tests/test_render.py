@@ -0,0 +1,23 @@
+""" Tests of the selection of the exported part of the super-graph (primconstree.render)
+"""
+import networkx as nx
+import pytest
+from primconstree.super_graph import SuperGraph
+from primconstree.render import select_edges
+
+
+@pytest.mark.parametrize("radius", [1, 2, 3])
+def test_mst_neighbourhood(dataset, radius):
+    super_graph = SuperGraph(dataset("simulated/Trex_trees100.txt"))
+    mst = super_graph.modified_prim(super_graph.root, False)
+    hops = dict(nx.all_pairs_shortest_path_length(mst))
+    expected = {frozenset((u, v)) for u, v in super_graph.graph.edges() if hops[u][v] <= radius}
+    selected = select_edges(super_graph, mst_radius=radius)
+    assert {frozenset(e) for e in selected.edges()} == expected
+    if radius == 1:
+        assert expected == {frozenset(e) for e in mst.edges()}
+
+
+def test_mst_neighbourhood_needs_mst(dataset):
+    with pytest.raises(ValueError):
+        select_edges(SuperGraph(dataset("simulated/Trex_trees20.txt")), mst_radius=1)
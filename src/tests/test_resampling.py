@@ -0,0 +1,37 @@
+""" Tests of the resampling support values (primconstree.resampling)
+"""
+import pytest
+from primconstree.algorithm import primconstree
+from primconstree.resampling import resampling_support, resampling_weights, _node_masks, _tree_clades
+
+
+@pytest.mark.parametrize("old_prim", [False, True])
+@pytest.mark.parametrize("method", ["bootstrap", "jackknife"])
+@pytest.mark.parametrize("name", ["simulated/Trex_trees20.txt", "kmedoids/cluster1.txt"])
+def test_support_as_brute_force(dataset, name, method, old_prim):
+    trees = dataset(name)
+    leaves = {l: i for i, l in enumerate(trees[0].get_leaf_names())}
+    replicates, seed = 10, 3
+    consensus = resampling_support(trees, replicates, method, old_prim, workers=1, seed=seed)
+
+    # Consensus of each replicate computed from the resampled trees
+    counts = {}
+    for weights in resampling_weights(len(trees), replicates, method, seed=seed):
+        sample = [t for t, k in zip(trees, weights) for _ in range(int(k))]
+        for clade in _tree_clades(primconstree(sample, old_prim), leaves):
+            counts[clade] = counts.get(clade, 0) + 1
+    for node, mask in _node_masks(consensus, leaves).items():
+        if not node.is_leaf():
+            assert node.support == counts.get(mask, 0) / replicates
+
+
+def test_worker_processes(dataset):
+    trees = dataset("simulated/Trex_trees20.txt")
+    assert (resampling_support(trees, 6, workers=2, seed=1).write(features=["support"])
+            == resampling_support(trees, 6, workers=1, seed=1).write(features=["support"]))
+
+
+@pytest.mark.parametrize("options", [{"replicates": 0}, {"workers": 0}])
+def test_invalid_options(dataset, options):
+    with pytest.raises(ValueError):
+        resampling_support(dataset("simulated/Trex_trees20.txt"), **{"replicates": 5, **options})
@@ -0,0 +1,24 @@
+""" Tests of the results store (csv format, available without pandas)
+"""
+import csv
+import os
+from utils.results import ResultsStore
+
+
+def read_rows(path):
+    with open(os.path.join(path, "results.csv"), newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_csv_new_columns_widen_the_header(tmp_path):
+    params = {"file": "k10.txt", "k": 10, "n": 5, "c": 1, "batch": 0, "benchmark": 0}
+    with ResultsStore(str(tmp_path), "csv", buffer_size=1) as store:
+        iid = store.add_inputs(params, ["(A,B);"])
+        store.add_result(iid, params, "pct", {"cons": "(A,B);", "kcdist0": 1.5})
+        store.add_result(iid, params, "maj", {"cons": "(A,B);", "kcdist0": 2.0, "duration": 0.1})
+
+    rows = read_rows(str(tmp_path))
+    assert [r["alg"] for r in rows] == ["pct", "maj"]
+    assert rows[0]["duration"] == ""
+    assert rows[1]["duration"] == "0.1"
+    assert rows[1]["kcdist0"] == "2.0"
@@ -0,0 +1,60 @@
+""" Tests of utils.runner with stand-in executables (shell scripts) instead of HybridSim, FACT and tqDist.
+"""
+import os
+import stat
+import time
+import pytest
+from utils.runner import ProcessRunner, ProcessError
+
+
+def write_script(path, body: str) -> str:
+    """ Write an executable shell script and return its path
+    """
+    with open(path, "w") as f:
+        f.write("#!/bin/bash\n" + body)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_files_and_outputs(tmp_path):
+    script = write_script(tmp_path / "tool.sh", 'cat input.txt > output.txt; echo "$1"\n')
+    result = ProcessRunner().run_sync([script, "{tmp}"], files={"input.txt": "tree"}, outputs=["output.txt"])
+    assert result.ok
+    assert result.files["output.txt"] == "tree"
+    # The temporary directory is removed after the run
+    assert not os.path.exists(result.stdout.strip())
+
+
+def test_timeout_kills_wrapper_children(tmp_path):
+    # A wrapper whose child keeps the pipes open, like utils/fact1.sh or utils/tqdist.sh
+    script = write_script(tmp_path / "wrapper.sh", "sleep 6\necho done\n")
+    start = time.perf_counter()
+    result = ProcessRunner(timeout=1).run_sync([script])
+    assert time.perf_counter() - start < 3
+    assert result.timed_out
+    assert not result.ok
+
+
+def test_retries_and_check(tmp_path):
+    script = write_script(tmp_path / "fail.sh", "echo error >&2\nexit 3\n")
+    runner = ProcessRunner(retries=2)
+    result = runner.run_sync([script])
+    assert result.attempts == 3
+    assert result.returncode == 3
+    with pytest.raises(ProcessError):
+        runner.run_sync([script], check=True)
+
+
+def test_failing_callback_does_not_stop_other_jobs(tmp_path):
+    script = write_script(tmp_path / "echo.sh", 'echo "$1"\n')
+    jobs = {i: {"cmd": [script, str(i)]} for i in range(6)}
+    handled = []
+
+    def on_result(key, result):
+        if key == 0:
+            raise ValueError("malformed output")
+        handled.append(key)
+
+    results = ProcessRunner(concurrency=2).run_all(jobs, on_result)
+    assert sorted(results) == list(range(6))
+    assert sorted(handled) == list(range(1, 6))
@@ -0,0 +1,22 @@
+""" Tests of the streaming statistics of primconstree.stats
+"""
+import numpy as np
+import pytest
+from primconstree.stats import P2Quantile
+
+
+@pytest.mark.parametrize("p", [0, 0.25, 0.5, 0.9, 1])
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5])
+def test_quantile_warm_up_is_exact(n, p):
+    values = [3.0, 0.5, 2.0, 8.0, 1.0][:n]
+    estimator = P2Quantile(p)
+    for x in values:
+        estimator.add(x)
+    assert estimator.value() == pytest.approx(np.quantile(values, p))
+
+
+def test_median_of_two_values():
+    estimator = P2Quantile(0.5)
+    estimator.add(1.0)
+    estimator.add(2.0)
+    assert estimator.value() == 1.5
@@ -0,0 +1,32 @@
+""" Tests of the consensus restricted to a subset of the taxa (primconstree.subsets)
+"""
+import pytest
+from primconstree.algorithm import primconstree
+from primconstree.subsets import SubsetQuery
+
+
+def clade_lengths(tree):
+    return {frozenset(n.get_leaf_names()): n.dist for n in tree.traverse() if not n.is_root()}
+
+
+@pytest.mark.parametrize("old_prim", [False, True])
+@pytest.mark.parametrize("name, n_taxa", [("simulated/Trex_trees40.txt", 7), ("kmedoids/cluster3.txt", 12)])
+def test_same_as_pruned_trees(dataset, name, n_taxa, old_prim):
+    trees = dataset(name)
+    query = SubsetQuery.from_trees(trees)
+    names = trees[0].get_leaf_names()
+    for taxa in [names[:n_taxa], names[::2]]:
+        pruned = [t.copy() for t in trees]
+        for t in pruned:
+            t.prune(taxa, preserve_branch_length=True)
+        expected = clade_lengths(primconstree(pruned, old_prim))
+        result = clade_lengths(query.consensus(taxa, old_prim))
+        assert result.keys() == expected.keys()
+        for clade, length in expected.items():
+            assert result[clade] == pytest.approx(length)
+
+
+def test_unknown_taxa(dataset):
+    query = SubsetQuery.from_trees(dataset("simulated/Trex_trees20.txt"))
+    with pytest.raises(ValueError):
+        query.consensus(["unknown", "taxa"])
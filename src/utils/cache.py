@@ -0,0 +1,216 @@
+""" Parse-once binary cache of the tree datasets.
+
+Each source file (newick, one tree per line, or FACT nexus) is parsed once and stored as numpy arrays
+in its own cache directory:
+- offsets.npy: index of the first node of each tree (n_trees + 1 values)
+- parent.npy: index of the parent node inside the tree (-1 for the root), nodes in preorder
+- dist.npy / support.npy: branch length and support of each node
+- leaf.npy: taxon index of each leaf (-1 for internal nodes)
+- clades.npy: clade of each node as a bitset over the taxa (n_nodes x words uint64)
+- taxa.json / meta.json: taxon names and source file signature
+
+Arrays are loaded through memory mapping, and the cache is rebuilt when the source file changes.
+"""
+import json
+import os
+import re
+import shutil
+import numpy as np
+import ete3
+from Bio.Phylo.BaseTree import Clade, Tree
+from .trees import read_trees
+
+
+CACHE_VERSION = 1
+ARRAYS = ["offsets", "parent", "dist", "support", "leaf", "clades"]
+
+nexus_tree_pattern = re.compile(r'^\s*tree\s+\S+\s*=\s*(.*;)', re.IGNORECASE | re.MULTILINE)
+
+
+class CachedTrees:
+    """
+    A set of trees loaded from the binary cache (arrays are memory mapped).
+    """
+    def __init__(self, cache_dir: str):
+        """ Load a cache directory (see build_cache())
+
+        Args:
+            cache_dir (str): the cache directory of a source file
+        """
+        self.cache_dir : str = cache_dir
+        with open(os.path.join(cache_dir, "taxa.json"), "r") as f:
+            self.taxa : list[str] = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def tree_slice(self, i: int) -> slice:
+        """ Return the slice of the node arrays corresponding to the i-th tree
+        """
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def ete3_tree(self, i: int) -> ete3.Tree:
+        """ Rebuild the i-th tree as an ete3 instance
+        """
+        s = self.tree_slice(i)
+        parent, dist, support, leaf = (self.parent[s].tolist(), self.dist[s].tolist(),
+                                       self.support[s].tolist(), self.leaf[s].tolist())
+        root = ete3.Tree(dist=dist[0], support=support[0])
+        nodes = [root]
+        for j in range(1, len(parent)):
+            name = self.taxa[leaf[j]] if leaf[j] >= 0 else ""
+            nodes.append(nodes[parent[j]].add_child(name=name, dist=dist[j], support=support[j]))
+        return root
+
+    def ete3_trees(self) -> list[ete3.Tree]:
+        """ Rebuild the trees as ete3 instances (same as utils.trees.read_trees() on the source file)
+        """
+        return [self.ete3_tree(i) for i in range(len(self))]
+
+    def phylo_trees(self) -> list[Tree]:
+        """ Rebuild the trees as Bio.Phylo instances (same as Bio.Phylo.parse() on the source file)
+        """
+        trees = []
+        for i in range(len(self)):
+            s = self.tree_slice(i)
+            parent, dist, leaf = self.parent[s].tolist(), self.dist[s].tolist(), self.leaf[s].tolist()
+            nodes = [Clade()]
+            for j in range(1, len(parent)):
+                clade = Clade(branch_length=dist[j], name=self.taxa[leaf[j]] if leaf[j] >= 0 else None)
+                nodes[parent[j]].clades.append(clade)
+                nodes.append(clade)
+            trees.append(Tree(root=nodes[0], rooted=False))
+        return trees
+
+    def tree_clades(self, i: int) -> np.ndarray:
+        """ Return the clade bitsets of the nodes of the i-th tree (preorder, one row per node)
+        """
+        return self.clades[self.tree_slice(i)]
+
+
+def cache_path(source: str, cache_root: str) -> str:
+    """ Return the cache directory of a source file: <cache_root>/<source directory name>/<source file name>
+    """
+    source = os.path.abspath(source)
+    return os.path.join(cache_root, os.path.basename(os.path.dirname(source)), os.path.basename(source))
+
+
+def _signature(source: str) -> dict:
+    """ Return the information identifying the version of a source file
+    """
+    stat = os.stat(source)
+    return {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_valid(source: str, cache_dir: str) -> bool:
+    """ Check if the cache directory exists and was built from the current version of the source file
+    """
+    meta_file = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file, "r") as f:
+        meta = json.load(f)
+    return meta.get("signature") == _signature(source)
+
+
+def _parse_source(source: str) -> list[ete3.Tree]:
+    """ Parse a newick file (one tree per line) or a FACT nexus file
+    """
+    with open(source, "r") as f:
+        first = f.readline()
+    if first.strip().upper().startswith("#NEXUS") or first.strip().upper().startswith("BEGIN TREES"):
+        with open(source, "r") as f:
+            return [ete3.Tree(t) for t in nexus_tree_pattern.findall(f.read())]
+    return read_trees(source)
+
+
+def build_cache(source: str, cache_dir: str) -> None:
+    """ Parse a source file and write its binary cache
+
+    Args:
+        source (str): the newick or FACT nexus file
+        cache_dir (str): the directory to write the cache to
+    """
+    signature = _signature(source)
+    trees = _parse_source(source)
+    taxa = sorted({l for t in trees for l in t.get_leaf_names()})
+    taxa_ids = {l: i for i, l in enumerate(taxa)}
+    words = max(1, (len(taxa) + 63) // 64)
+
+    offsets, parent, dist, support, leaf, masks = [0], [], [], [], [], []
+    for t in trees:
+        start = len(parent)
+        ids = {}
+        for node in t.traverse("preorder"):
+            ids[node] = len(parent) - start
+            parent.append(ids[node.up] if node.up else -1)
+            dist.append(node.dist)
+            support.append(node.support)
+            leaf.append(taxa_ids[node.name] if node.is_leaf() else -1)
+            masks.append(1 << taxa_ids[node.name] if node.is_leaf() else 0)
+        # Children follow their parent in preorder: accumulate the clades in reverse
+        for j in range(len(parent) - 1, start, -1):
+            masks[start + parent[j]] |= masks[j]
+        offsets.append(len(parent))
+
+    clades = np.array([[(m >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(words)] for m in masks],
+                      dtype=np.uint64).reshape(len(masks), words)
+
+    # Write in a temporary directory and move, so that a cache is never partially written
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_dir, "parent.npy"), np.array(parent, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "dist.npy"), np.array(dist, dtype=np.float64))
+    np.save(os.path.join(tmp_dir, "support.npy"), np.array(support, dtype=np.float64))
+    np.save(os.path.join(tmp_dir, "leaf.npy"), np.array(leaf, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "clades.npy"), clades)
+    with open(os.path.join(tmp_dir, "taxa.json"), "w") as f:
+        json.dump(taxa, f)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"source": os.path.abspath(source), "n_trees": len(trees), "signature": signature}, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+
+
+def load_cached(source: str, cache_root: str) -> CachedTrees:
+    """ Load the trees of a source file from the cache, (re)building the cache if missing or outdated
+
+    Args:
+        source (str): the newick or FACT nexus file
+        cache_root (str): the root directory of the cache
+
+    Returns:
+        CachedTrees: the cached trees
+    """
+    cache_dir = cache_path(source, cache_root)
+    if not is_valid(source, cache_dir):
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        build_cache(source, cache_dir)
+    return CachedTrees(cache_dir)
+
+
+def cache_directory(directory: str, cache_root: str) -> int:
+    """ Build (or refresh) the cache of every file in a directory
+
+    Args:
+        directory (str): the directory of the source files
+        cache_root (str): the root directory of the cache
+
+    Returns:
+        int: the number of cache entries (re)built
+    """
+    built = 0
+    for name in sorted(os.listdir(directory)):
+        source = os.path.join(directory, name)
+        if not os.path.isfile(source):
+            continue
+        cache_dir = cache_path(source, cache_root)
+        if not is_valid(source, cache_dir):
+            os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+            build_cache(source, cache_dir)
+            built += 1
+    return built
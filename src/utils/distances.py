@@ -5,9 +5,13 @@ from itertools import combinations
 import ete3
 from Bio.Phylo import read
 from io import StringIO
-import subprocess
+import os
 import math
 from .kcdist import KC_dist
+from .runner import ProcessRunner
+
+
+TQDIST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tqdist.sh") # tqDist wrapper script
 
 
 def average_rf(input_trees: list[ete3.Tree], consensus: ete3.Tree) -> float:
@@ -35,27 +39,31 @@ def average_kc(input_trees: list[ete3.Tree], consensus: ete3.Tree, lamb: float)
     return dist/len(input_trees)
 
 
-def average_tqd(input_trees: list[ete3.Tree], consensus: ete3.Tree, exec: str) -> float:
-    """ Compute the average triplet/quartet distance between the input trees and the consensus
+def average_tqd(input_trees: list[ete3.Tree], consensus: ete3.Tree, exec: str, runner: ProcessRunner = None) -> float:
+    """ Compute the average triplet/quartet distance between the input trees and the consensus.
+        The tqDist processes run concurrently, each one in its own temporary directory.
 
     Args:
         input_trees (list[ete3.Tree]): the list of input trees
         consensus (ete3.Tree): the consensus computed with any algorithm
         exec (str): quartet_dist | triplet_dist
+        runner (ProcessRunner, optional): runner of the tqDist processes. Defaults to None (default runner).
 
     Return:
         float: the average triplet distance
     """
+    runner = runner if runner is not None else ProcessRunner()
     dist = 0
     minus = 0
     max_dist = 2*math.comb(len(consensus.get_leaves()), 3 if exec=="triplet_dist" else 4)
-    for tree in input_trees:
-        cmd = ["./src/utils/tqdist.sh", exec, tree.write(format=9), consensus.write(format=9)]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    cons = consensus.write(format=9)
+    jobs = {i: {"cmd": [TQDIST_SCRIPT, exec, tree.write(format=9), cons]} for i, tree in enumerate(input_trees)}
+    results = runner.run_all(jobs)
+    for i, tree in enumerate(input_trees):
         try:
-            dist += float(result.stdout) / max_dist
+            dist += float(results[i].stdout) / max_dist
         except Exception:
-            print(f"WARNING error computing the {exec} distance metric !!!!\n executable stdrr: '{result.stderr}'")
+            print(f"WARNING error computing the {exec} distance metric !!!!\n executable stdrr: '{results[i].stderr}'")
             print(consensus.write())
             print(tree.write())
             print()
@@ -1,110 +1,150 @@
-class _KC_node:
-    name: str
-    depth_unweighted: int
-    depth_weighted: float
-    son: list[int]
-    label: set
-    father: int
-
-def _combinations(iterable, r):
-    pool = tuple(iterable)
-    n = len(pool)
-    if r > n:
-        return
-    indices = list(range(r))
-    yield tuple(pool[i] for i in indices)
-    while True:
-        for i in reversed(range(r)):
-            if indices[i] != i + n - r:
-                break
-        else:
-            return
-        indices[i] += 1
-        for j in range(i+1, r):
-            indices[j] = indices[j-1] + 1
-        yield tuple(pool[i] for i in indices)
-
-def _read_newick(newick_str: str, nodes: list[_KC_node],
-                 depth_weighted: float, depth_unweighted: int):
-    def _split_newick(newick_str: str) -> list[str]:
-        n_lbracket = 0
-        rtn = []
-        last_i = 0
-        for i, char in enumerate(newick_str):
-            if char == '(':
-                n_lbracket += 1
-            elif char == ')':
-                n_lbracket -= 1
-            elif char == ',' and n_lbracket == 0:
-                rtn.append(newick_str[last_i:i])
-                last_i = i+1
-        rtn.append(newick_str[last_i:])
-        return rtn
-    
+""" Kendall-Colijn distance between two trees given as newick strings.
+
+Parsing, depths and vectors are computed without recursion (trees of any depth, e.g. caterpillars):
+- the newick string is read in a single scan, nodes being created in preorder
+- depths are accumulated in preorder, from the parent to its children
+- leaves of a subtree are contiguous in preorder, so the pairs of leaves having a node as most recent common
+  ancestor are products of ranges, filled at once in a matrix indexed by the leaves
+The time is linear in the size of the string plus the size of the vector (one value per pair of leaves).
+"""
+import numpy as np
+
+
+def _read_newick(newick_str: str) -> tuple[list[str], list[int], list[float]]:
+    """ Parse a newick string with an explicit stack
+
+    Args:
+        newick_str (str): the tree
+
+    Returns:
+        tuple: (name, parent index (-1 for the root), branch length (0 if missing)) of each node, in preorder
+    """
     newick_str = newick_str.rstrip(";\n")
-    if newick_str[0] == '(': # not a leaf
-        is_leaf = False
-        node_info = newick_str[newick_str.rfind(')') + 1:]
-        son_str = _split_newick(newick_str[1:newick_str.rfind(')')])
-    else:
-        is_leaf = True
-        node_info = newick_str
-    new_node = _KC_node()
-    new_node.son = []
-    if ':' in node_info:
-        new_node.name = node_info.split(':')[0]
-        branch_length = float(node_info.split(':')[1])
-    else:
-        new_node.name = node_info
-        branch_length = 0
-    new_node.depth_unweighted = depth_unweighted + 1
-    new_node.depth_weighted = depth_weighted + branch_length
-    if not is_leaf:
-        for i in range(len(son_str)):
-            son_ind= _read_newick(son_str[i], nodes,
-                                  new_node.depth_weighted,
-                                  new_node.depth_unweighted)
-            new_node.son.append(son_ind)
-        new_node.label = set()
-        for ind in new_node.son:
-            new_node.label = new_node.label | nodes[ind].label
-            nodes[ind].father = len(nodes)
-    else:
-        new_node.label = {new_node.name}
-    nodes.append(new_node)
-    return len(nodes) - 1
-
-def _get_vector(focal_ind: int, nodes: list[_KC_node], lam: float) -> dict:
-    focal_node = nodes[focal_ind]
-    if focal_node.son == []:
-        dist = focal_node.depth_weighted - nodes[focal_node.father].depth_weighted
-        return {focal_node.name: (1 + lam * (dist - 1))}
-    rtn_vector = {}
-    labels = []
-    for ind in focal_node.son:
-        rlt = _get_vector(ind, nodes, lam)
-        # print(rlt, nodes[ind].name, ind)
-        rtn_vector = rtn_vector | rlt
-        labels.append(nodes[ind].label)
-    dist = focal_node.depth_unweighted * (1 - lam) + focal_node.depth_weighted * lam
-    for label_i, label_j in _combinations(labels, 2):
-        for item_i in label_i:
-            for item_j in label_j:
-                rtn_vector[frozenset({item_i, item_j})] = dist
-    return rtn_vector
+    names, parent, length = [], [], []
+
+    def read_info(start: int, node: int) -> int:
+        # Node information (name and branch length) runs until the next delimiter
+        end = start
+        while end < len(newick_str) and newick_str[end] not in ",);":
+            end += 1
+        info = newick_str[start:end]
+        if ':' in info:
+            names[node] = info.split(':')[0]
+            length[node] = float(info.split(':')[1])
+        else:
+            names[node] = info
+        return end
+
+    stack = [] # Open internal nodes
+    i = 0
+    while True:
+        # A new node starts, child of the open node at the top of the stack
+        node = len(names)
+        names.append("")
+        parent.append(stack[-1] if stack else -1)
+        length.append(0)
+        if i < len(newick_str) and newick_str[i] == '(':
+            stack.append(node)
+            i += 1
+            continue
+        i = read_info(i, node)
+
+        # Close the internal nodes ending here
+        while i < len(newick_str) and newick_str[i] == ')':
+            i = read_info(i + 1, stack.pop())
+        if i >= len(newick_str) or newick_str[i] != ',':
+            break
+        i += 1
+
+    if stack:
+        raise ValueError("Invalid newick string: unbalanced parentheses")
+    return names, parent, length
+
+
+class _KC_tree:
+    """
+    A tree prepared for the Kendall-Colijn distance: nodes in preorder with their depths
+    and the range of their leaves in preorder.
+    """
+    def __init__(self, newick_str: str):
+        names, parent, length = _read_newick(newick_str)
+        n = len(names)
+        self.names : list[str] = names
+        self.parent : list[int] = parent
+        self.children : list[list[int]] = [[] for _ in range(n)]
+        for i in range(1, n):
+            self.children[parent[i]].append(i)
+
+        # Depths (the root has depth 1 and its own branch length)
+        self.depth_unweighted : list[int] = [1] * n
+        self.depth_weighted : list[float] = [length[0]] + [0.0] * (n - 1)
+        for i in range(1, n):
+            self.depth_unweighted[i] = self.depth_unweighted[parent[i]] + 1
+            self.depth_weighted[i] = self.depth_weighted[parent[i]] + length[i]
+
+        # Leaves in preorder, and range [first, end) of the leaves of each node in this order
+        self.leaves : list[int] = [i for i in range(n) if not self.children[i]]
+        self.first : list[int] = [0] * n
+        self.end : list[int] = [0] * n
+        for rank, i in enumerate(self.leaves):
+            self.first[i], self.end[i] = rank, rank + 1
+        for i in range(n - 1, -1, -1):
+            if self.children[i]:
+                self.first[i] = self.first[self.children[i][0]]
+                self.end[i] = self.end[self.children[i][-1]]
+
+    def labels(self) -> set[str]:
+        """ Return the names of the leaves
+        """
+        return {self.names[i] for i in self.leaves}
+
+    def vector(self, order: dict[str, int], lam: float) -> tuple[np.ndarray, np.ndarray]:
+        """ Compute the Kendall-Colijn vector
+
+        Args:
+            order (dict[str, int]): index of each leaf name in the vector
+            lam (float): weight of the branch lengths
+
+        Returns:
+            tuple: (symmetric matrix of the values of the pairs of leaves, values of the leaves), indexed by order
+        """
+        n_leaves = len(self.leaves)
+        position = np.array([order[self.names[i]] for i in self.leaves], dtype=np.int64)
+        pairs = np.zeros((n_leaves, n_leaves))
+        for i, children in enumerate(self.children):
+            if len(children) < 2:
+                continue
+            dist = self.depth_unweighted[i] * (1 - lam) + self.depth_weighted[i] * lam
+            # Pairs of leaves in two different children have this node as most recent common ancestor:
+            # the leaves of a child are paired with those of all the following children at once
+            for c in children[:-1]:
+                ra = position[self.first[c]:self.end[c]]
+                rb = position[self.end[c]:self.end[i]]
+                pairs[np.ix_(ra, rb)] = dist
+                pairs[np.ix_(rb, ra)] = dist
+
+        singles = np.zeros(n_leaves)
+        for i in self.leaves:
+            dist = self.depth_weighted[i] - self.depth_weighted[self.parent[i]]
+            singles[order[self.names[i]]] = 1 + lam * (dist - 1)
+        return pairs, singles
+
 
 def KC_dist(tree1: str, tree2: str, lam: float = 0) -> float:
     if lam > 1 or lam < 0:
         raise ValueError("Invalid lambda! Lambda value should be between 0 and 1.")
-    tree_node1 = []
-    _read_newick(tree1, tree_node1, 0, 0)
-    tree_node2 = []
-    _read_newick(tree2, tree_node2, 0, 0)
-    if tree_node1[-1].label != tree_node2[-1].label:
+    t1 = _KC_tree(tree1)
+    t2 = _KC_tree(tree2)
+    labels = t1.labels()
+    if labels != t2.labels():
         raise ValueError("Invalid tree nodes! Tips of two trees should be the same.")
-    vec1 = _get_vector(len(tree_node1)-1, tree_node1, lam)
-    vec2 = _get_vector(len(tree_node2)-1, tree_node2, lam)
-    rtn = 0
-    for item in vec1:
-        rtn += (vec1[item] - vec2[item]) ** 2
-    return rtn ** 0.5
\ No newline at end of file
+    if len(labels) != len(t1.leaves) or len(labels) != len(t2.leaves):
+        raise ValueError("Invalid tree nodes! Tips of a tree should have distinct names.")
+    order = {l: i for i, l in enumerate(sorted(labels))}
+    pairs, singles1 = t1.vector(order, lam)
+    pairs2, singles2 = t2.vector(order, lam)
+    pairs -= pairs2
+    del pairs2
+    # Each pair is counted twice in the symmetric matrices (null diagonal)
+    rtn = np.vdot(pairs, pairs) / 2 + np.sum((singles1 - singles2) ** 2)
+    return float(rtn ** 0.5)
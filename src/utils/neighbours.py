@@ -0,0 +1,307 @@
+""" Approximate nearest-neighbour search over a collection of trees, on their sets of clades.
+
+Each clade (a bitset over the taxa, as in utils.cache) is hashed to 64 bits, and each tree is summarised by
+a MinHash signature of its set of clades: the proportion of equal signature values of two trees estimates
+the Jaccard similarity of their clade sets. Signatures are split in bands, and trees sharing a band are
+candidate neighbours (locality sensitive hashing). A query only looks at its candidates: they are ranked by
+the estimated similarity, the best ones by their exact RF or Jaccard distance, and the neighbours can then
+be re-ranked with the branch score or the Kendall-Colijn distance (see utils.distances).
+
+Without rooted=True, the clades are the unrooted splits (the side without the first taxon), as for average_rf().
+"""
+import numpy as np
+import ete3
+from .cache import CachedTrees
+from .distances import bsd
+from .kcdist import KC_dist
+
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """ Mix 64 bits integers (splitmix64 finalizer), vectorised
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def tree_clades(tree: ete3.Tree, taxa_ids: dict[str, int], words: int) -> np.ndarray:
+    """ Return the clades of the nodes of a tree as bitsets (same layout as CachedTrees.clades)
+
+    Args:
+        tree (ete3.Tree): the tree
+        taxa_ids (dict[str, int]): index of each taxon
+        words (int): number of 64 bits words of a bitset
+
+    Returns:
+        np.ndarray: n_nodes x words bitsets, nodes in preorder
+    """
+    nodes = list(tree.traverse("preorder"))
+    index = {node: i for i, node in enumerate(nodes)}
+    masks = [0] * len(nodes)
+    # Children follow their parent in preorder: accumulate the clades in reverse
+    for i in range(len(nodes) - 1, -1, -1):
+        if nodes[i].is_leaf():
+            if nodes[i].name not in taxa_ids:
+                raise ValueError(f"Unknown taxon {nodes[i].name}")
+            masks[i] |= 1 << taxa_ids[nodes[i].name]
+        if nodes[i].up is not None:
+            masks[index[nodes[i].up]] |= masks[i]
+    return np.array([[(m >> (64 * w)) & MASK64 for w in range(words)] for m in masks],
+                    dtype=np.uint64).reshape(len(masks), words)
+
+
+class CladeIndex:
+    """
+    MinHash / LSH index over the clade sets of a collection of trees.
+    """
+    def __init__(self, taxa: list[str], n_perm: int = 128, bands: int = 32, rooted: bool = False, seed: int = 0):
+        """ Instanciate an empty index (see from_trees() and from_cache())
+
+        Args:
+            taxa (list[str]): the taxa of the trees, in the order of the clade bitsets
+            n_perm (int, optional): number of hash functions of the signatures. Defaults to 128.
+            bands (int, optional): number of LSH bands (dividing n_perm). More bands find neighbours
+                with a lower similarity, but return more candidates. Defaults to 32.
+            rooted (bool, optional): if True, compare the rooted clades instead of the splits. Defaults to False.
+            seed (int, optional): seed of the hash functions. Defaults to 0.
+        """
+        if n_perm % bands:
+            raise ValueError("The number of bands should divide the number of hash functions")
+        self.taxa : list[str] = list(taxa)
+        self.taxa_ids : dict[str, int] = {l: i for i, l in enumerate(self.taxa)}
+        self.words : int = max(1, (len(self.taxa) + 63) // 64)
+        self.rooted : bool = rooted
+        self.bands : int = bands
+        self.rows : int = n_perm // bands
+
+        rng = np.random.default_rng(seed)
+        self._salts : np.ndarray = rng.integers(0, MASK64, self.words, dtype=np.uint64, endpoint=True)
+        # Multiply-shift hash functions (odd multipliers)
+        self._mult : np.ndarray = rng.integers(0, MASK64, n_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self._add : np.ndarray = rng.integers(0, MASK64, n_perm, dtype=np.uint64, endpoint=True)
+        full = [(((1 << len(self.taxa)) - 1) >> (64 * w)) & MASK64 for w in range(self.words)]
+        self._full : np.ndarray = np.array(full, dtype=np.uint64)
+
+        # Clade hashes of each tree (sorted, concatenated), signatures and bands
+        self.indptr : np.ndarray = np.zeros(1, dtype=np.int64)
+        self.clades : np.ndarray = np.zeros(0, dtype=np.uint64)
+        self.signatures : np.ndarray = np.zeros((0, n_perm), dtype=np.uint32)
+        self._band_order : list[np.ndarray] = []
+        self._band_keys : list[np.ndarray] = []
+        # Trees used to re-rank the neighbours (list of ete3.Tree or CachedTrees)
+        self.trees = None
+
+    @classmethod
+    def from_trees(cls, trees: list[ete3.Tree], **kwargs) -> "CladeIndex":
+        """ Build the index of a list of trees (taxa sorted by name, as in utils.cache)
+
+        Args:
+            trees (list[ete3.Tree]): the trees
+            **kwargs: parameters of the index (see CladeIndex())
+
+        Returns:
+            CladeIndex: the index
+        """
+        index = cls(sorted({l for t in trees for l in t.get_leaf_names()}), **kwargs)
+        index.build(index.clade_set(tree_clades(t, index.taxa_ids, index.words)) for t in trees)
+        index.trees = trees
+        return index
+
+    @classmethod
+    def from_cache(cls, cached: CachedTrees, **kwargs) -> "CladeIndex":
+        """ Build the index of cached trees, from their clade bitsets (the trees are not rebuilt)
+
+        Args:
+            cached (CachedTrees): the cached trees
+            **kwargs: parameters of the index (see CladeIndex())
+
+        Returns:
+            CladeIndex: the index
+        """
+        index = cls(cached.taxa, **kwargs)
+        index.build(index.clade_set(cached.tree_clades(i)) for i in range(len(cached)))
+        index.trees = cached
+        return index
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def clade_set(self, clades: np.ndarray) -> np.ndarray:
+        """ Hash the non trivial clades (or splits) of a tree
+
+        Args:
+            clades (np.ndarray): n_nodes x words bitsets of the nodes of the tree
+
+        Returns:
+            np.ndarray: the sorted distinct hashes (uint64)
+        """
+        clades = np.asarray(clades, dtype=np.uint64)
+        n = len(self.taxa)
+        if not self.rooted:
+            # Unrooted split: the side without the first taxon
+            flip = (clades[:, 0] & np.uint64(1)).astype(bool)
+            clades = np.where(flip[:, None], clades ^ self._full, clades)
+        sizes = np.bitwise_count(clades).sum(axis=1)
+        clades = clades[(sizes >= 2) & (sizes <= (n - 1 if self.rooted else n - 2))]
+
+        hashes = np.zeros(len(clades), dtype=np.uint64)
+        for w in range(self.words):
+            hashes ^= _mix(clades[:, w] ^ self._salts[w])
+        return np.unique(hashes)
+
+    def signature(self, clade_set: np.ndarray) -> np.ndarray:
+        """ Compute the MinHash signature of a clade set (all values are maximal for an empty set)
+
+        Args:
+            clade_set (np.ndarray): the clade hashes (see clade_set())
+
+        Returns:
+            np.ndarray: the signature (n_perm uint32)
+        """
+        if len(clade_set) == 0:
+            return np.full(len(self._mult), 0xFFFFFFFF, dtype=np.uint32)
+        values = (self._mult[:, None] * clade_set[None, :] + self._add[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+    def _band_hashes(self, signatures: np.ndarray) -> np.ndarray:
+        """ Hash the bands of signatures (n x n_perm) to n x bands keys
+        """
+        keys = np.zeros((len(signatures), self.bands), dtype=np.uint64)
+        for r in range(self.rows):
+            keys = _mix(keys ^ signatures[:, r::self.rows].astype(np.uint64))
+        return keys
+
+    def build(self, clade_sets) -> None:
+        """ Index a collection of clade sets (replaces the current content)
+
+        Args:
+            clade_sets (Iterable[np.ndarray]): the clade set of each tree (see clade_set())
+        """
+        indptr, chunks, signatures = [0], [], []
+        for c in clade_sets:
+            chunks.append(c)
+            indptr.append(indptr[-1] + len(c))
+            signatures.append(self.signature(c))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.clades = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint64)
+        self.signatures = np.array(signatures, dtype=np.uint32).reshape(len(signatures), -1)
+
+        keys = self._band_hashes(self.signatures)
+        self._band_order = [np.argsort(keys[:, b], kind="stable") for b in range(self.bands)]
+        self._band_keys = [keys[order, b] for b, order in enumerate(self._band_order)]
+
+    def candidates(self, signature: np.ndarray) -> np.ndarray:
+        """ Return the trees sharing at least one band with a signature
+
+        Args:
+            signature (np.ndarray): the signature of the query
+
+        Returns:
+            np.ndarray: the indices of the candidate trees
+        """
+        keys = self._band_hashes(signature[None, :])[0]
+        found = []
+        for b in range(self.bands):
+            lo, hi = np.searchsorted(self._band_keys[b], keys[b], "left"), np.searchsorted(self._band_keys[b], keys[b], "right")
+            found.append(self._band_order[b][lo:hi])
+        return np.unique(np.concatenate(found))
+
+    def distances(self, clade_set: np.ndarray, ids: np.ndarray = None, metric: str = "rf") -> np.ndarray:
+        """ Compute the exact distance between a clade set and indexed trees
+
+        Args:
+            clade_set (np.ndarray): the clade hashes of the query (see clade_set())
+            ids (np.ndarray, optional): indices of the trees. Defaults to None (all the trees).
+            metric (str, optional): "rf" (symmetric difference over the total number of clades) or
+                "jaccard" (1 - Jaccard similarity). Defaults to "rf".
+
+        Returns:
+            np.ndarray: the distance to each tree
+        """
+        ids = np.arange(len(self)) if ids is None else np.asarray(ids, dtype=np.int64)
+        starts, ends = self.indptr[ids], self.indptr[ids + 1]
+        sizes = ends - starts
+        # Gather the clades of the trees, and count those in the query for each tree
+        positions = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        shared = np.isin(self.clades[positions], clade_set)
+        common = np.bincount(np.repeat(np.arange(len(ids)), sizes), shared, minlength=len(ids))
+
+        total = sizes + len(clade_set)
+        if metric == "rf":
+            return np.divide(total - 2 * common, total, out=np.zeros(len(ids)), where=total > 0)
+        if metric == "jaccard":
+            union = total - common
+            return np.divide(union - common, union, out=np.zeros(len(ids)), where=union > 0)
+        raise ValueError(f"Unknown metric {metric}")
+
+    def query(self, tree: ete3.Tree, k: int = 10, metric: str = "rf",
+              max_candidates: int = None) -> list[tuple[int, float]]:
+        """ Find approximate nearest neighbours of a tree: the LSH candidates with the best estimated
+            similarity are ranked by their exact distance
+
+        Args:
+            tree (ete3.Tree): the query tree (on the taxa of the index)
+            k (int, optional): number of neighbours. Defaults to 10.
+            metric (str, optional): "rf" or "jaccard" (see distances()). Defaults to "rf".
+            max_candidates (int, optional): number of candidates whose exact distance is computed.
+                Defaults to None (max(10 * k, 100)).
+
+        Returns:
+            list[tuple[int, float]]: (tree index, distance) of at most k neighbours, by increasing distance
+        """
+        clade_set = self.clade_set(tree_clades(tree, self.taxa_ids, self.words))
+        signature = self.signature(clade_set)
+        ids = self.candidates(signature)
+
+        max_candidates = max(10 * k, 100) if max_candidates is None else max_candidates
+        if len(ids) > max_candidates:
+            # Keep the candidates with the highest estimated similarity
+            estimate = (self.signatures[ids] == signature).sum(axis=1)
+            ids = ids[np.argpartition(-estimate, max_candidates - 1)[:max_candidates]]
+
+        dist = self.distances(clade_set, ids, metric)
+        order = np.lexsort((ids, dist))[:k]
+        return [(int(ids[i]), float(dist[i])) for i in order]
+
+    def scan(self, tree: ete3.Tree, k: int = 10, metric: str = "rf") -> list[tuple[int, float]]:
+        """ Find the exact nearest neighbours of a tree by computing the distance to every tree (see query())
+        """
+        clade_set = self.clade_set(tree_clades(tree, self.taxa_ids, self.words))
+        dist = self.distances(clade_set, None, metric)
+        order = np.lexsort((np.arange(len(dist)), dist))[:k]
+        return [(int(i), float(dist[i])) for i in order]
+
+    def tree(self, i: int) -> ete3.Tree:
+        """ Return the i-th indexed tree
+        """
+        if self.trees is None:
+            raise ValueError("The indexed trees are not available")
+        if isinstance(self.trees, CachedTrees):
+            return self.trees.ete3_tree(i)
+        return self.trees[i]
+
+    def rerank(self, tree: ete3.Tree, neighbours: list[tuple[int, float]], metric: str = "bsd",
+               lamb: float = 0, normalize: bool = True) -> list[tuple[int, float]]:
+        """ Re-rank neighbours (see query()) with an exact distance using the branch lengths
+
+        Args:
+            tree (ete3.Tree): the query tree
+            neighbours (list[tuple[int, float]]): the neighbours, as (tree index, any score)
+            metric (str, optional): "bsd" (branch score distance) or "kc" (Kendall-Colijn distance). Defaults to "bsd".
+            lamb (float, optional): weight of the branch lengths in the KC distance. Defaults to 0.
+            normalize (bool, optional): normalize the BSD with respect to the length of each tree. Defaults to True.
+
+        Returns:
+            list[tuple[int, float]]: (tree index, distance) by increasing distance
+        """
+        if metric == "bsd":
+            dist = [(i, bsd(tree, self.tree(i), normalize)) for i, _ in neighbours]
+        elif metric == "kc":
+            newick = tree.write()
+            dist = [(i, KC_dist(newick, self.tree(i).write(), lamb)) for i, _ in neighbours]
+        else:
+            raise ValueError(f"Unknown metric {metric}")
+        return sorted(dist, key=lambda d: (d[1], d[0]))
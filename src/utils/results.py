@@ -0,0 +1,264 @@
+""" Columnar and appendable storage of the evaluation results.
+
+A store is a directory holding two tables:
+- inputs: one row per set of input trees (input_id, parameters, newick strings), stored once
+- results: one row per (set of input trees, algorithm) with the parameters, the consensus and the metrics,
+  the input trees being referenced by input_id
+
+Tables are written as Parquet part files (one per flush) when pandas and pyarrow are available,
+otherwise the inputs are appended to a JSONL file and the results to a CSV file.
+"""
+import csv
+import glob
+import hashlib
+import json
+import os
+
+try:
+    import pandas as pd
+    import pyarrow  # noqa: F401 (parquet engine)
+    HAS_PARQUET = True
+except ImportError:
+    pd = None
+    HAS_PARQUET = False
+
+
+PARAMS = ["file", "k", "n", "c", "batch", "benchmark"] # parameters stored with both inputs and results
+
+
+def input_id(trees: list[str]) -> str:
+    """ Compute a stable identifier for a set of input trees
+
+    Args:
+        trees (list[str]): the input trees as newick strings
+
+    Returns:
+        str: the identifier (hexadecimal digest of the trees)
+    """
+    return hashlib.sha1("\n".join(trees).encode()).hexdigest()[:16]
+
+
+class ResultsStore:
+    """
+    Appendable writer for the evaluation results. Rows are buffered and written
+    by batches, each input tree set being written only once per store.
+    """
+    def __init__(self, path: str, fmt: str = None, buffer_size: int = 1000):
+        """ Open (or create) a results store
+
+        Args:
+            path (str): directory of the store
+            fmt (str, optional): "parquet" or "csv". Defaults to None (parquet if available, else csv).
+            buffer_size (int, optional): number of buffered result rows before writing. Defaults to 1000.
+        """
+        self.path : str = path
+        self.fmt : str = fmt or _detect_format(path)
+        self.buffer_size : int = buffer_size
+        self.inputs : list[dict] = []
+        self.results : list[dict] = []
+
+        if self.fmt == "parquet" and not HAS_PARQUET:
+            raise ImportError("pandas and pyarrow are required to write a parquet results store")
+        if self.fmt not in ["parquet", "csv"]:
+            raise ValueError(f"Unknown results store format {self.fmt}")
+
+        os.makedirs(path, exist_ok=True)
+        self.known_inputs : set[str] = set(load_input_ids(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def add_inputs(self, params: dict, trees: list[str]) -> str:
+        """ Register a set of input trees (written only if not already in the store)
+
+        Args:
+            params (dict): parameters of the combination (see PARAMS)
+            trees (list[str]): the input trees as newick strings
+
+        Returns:
+            str: the input id to reference the trees in the results
+        """
+        iid = input_id(trees)
+        if iid not in self.known_inputs:
+            self.known_inputs.add(iid)
+            self.inputs.append({"input_id": iid, **{p: params.get(p) for p in PARAMS}, "inputs": trees})
+        return iid
+
+    def add_result(self, iid: str, params: dict, alg: str, result: dict) -> None:
+        """ Add the result of an algorithm on a set of input trees
+
+        Args:
+            iid (str): the input id (see add_inputs())
+            params (dict): parameters of the combination (see PARAMS)
+            alg (str): the consensus algorithm
+            result (dict): consensus and metrics (see eval_consensus.eval_consensus())
+        """
+        self.results.append({"input_id": iid, **{p: params.get(p) for p in PARAMS}, "alg": alg, **result})
+        if len(self.results) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write the buffered rows in the store
+        """
+        if self.fmt == "parquet":
+            if self.inputs:
+                _write_part(pd.DataFrame(self.inputs), os.path.join(self.path, "inputs"))
+            if self.results:
+                _write_part(pd.DataFrame(self.results), os.path.join(self.path, "results"))
+        else:
+            if self.inputs:
+                with open(os.path.join(self.path, "inputs.jsonl"), "a") as f:
+                    for row in self.inputs:
+                        f.write(json.dumps(row) + "\n")
+            if self.results:
+                _append_csv(self.results, os.path.join(self.path, "results.csv"))
+        self.inputs = []
+        self.results = []
+
+
+def _detect_format(path: str) -> str:
+    """ Return the format of an existing store, or the preferred format for a new one
+    """
+    if os.path.isdir(os.path.join(path, "results")) or os.path.isdir(os.path.join(path, "inputs")):
+        return "parquet"
+    if os.path.exists(os.path.join(path, "results.csv")) or os.path.exists(os.path.join(path, "inputs.jsonl")):
+        return "csv"
+    return "parquet" if HAS_PARQUET else "csv"
+
+
+def _write_part(df, directory: str) -> None:
+    """ Write a dataframe as a new parquet part file in the directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    part = len(glob.glob(os.path.join(directory, "part-*.parquet")))
+    df.to_parquet(os.path.join(directory, f"part-{part:05d}.parquet"), index=False)
+
+
+def _append_csv(rows: list[dict], filename: str) -> None:
+    """ Append rows to a csv file, writing the header if the file is new. If the rows have new columns,
+        the file is rewritten with the widened header (empty values for the previous rows).
+    """
+    fields = []
+    if os.path.exists(filename):
+        with open(filename, "r", newline="") as f:
+            fields = next(csv.reader(f), [])
+    previous = len(fields)
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+
+    if previous and len(fields) > previous:
+        tmp = filename + ".tmp"
+        with open(filename, "r", newline="") as src, open(tmp, "w", newline="") as dst:
+            writer = csv.DictWriter(dst, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(csv.DictReader(src))
+        os.replace(tmp, filename)
+        previous = len(fields)
+
+    with open(filename, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        if not previous:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_input_ids(path: str) -> list[str]:
+    """ List the input ids already written in a store
+
+    Args:
+        path (str): directory of the store
+
+    Returns:
+        list[str]: the input ids
+    """
+    if os.path.isdir(os.path.join(path, "inputs")):
+        return list(pd.read_parquet(os.path.join(path, "inputs"), columns=["input_id"])["input_id"])
+    ids = []
+    if os.path.exists(os.path.join(path, "inputs.jsonl")):
+        with open(os.path.join(path, "inputs.jsonl"), "r") as f:
+            for line in f:
+                ids.append(json.loads(line)["input_id"])
+    return ids
+
+
+def load_results(path: str, columns: list[str] = None, filters: list[tuple] = None):
+    """ Load the results table, reading only the requested columns
+
+    Args:
+        path (str): directory of the store
+        columns (list[str], optional): columns to read. Defaults to None (all columns).
+        filters (list[tuple], optional): (column, operator, value) row filters (pyarrow syntax, parquet only,
+            applied after loading for csv). Defaults to None.
+
+    Returns:
+        pandas.DataFrame: the results
+    """
+    if pd is None:
+        raise ImportError("pandas is required to load the results")
+    if os.path.isdir(os.path.join(path, "results")):
+        return pd.read_parquet(os.path.join(path, "results"), columns=columns, filters=filters)
+
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(columns + [f[0] for f in filters or []]))
+    df = pd.read_csv(os.path.join(path, "results.csv"), usecols=usecols)
+    for col, op, value in filters or []:
+        if op in ["=", "=="]:
+            df = df[df[col] == value]
+        elif op == "!=":
+            df = df[df[col] != value]
+        elif op == "in":
+            df = df[df[col].isin(value)]
+        else:
+            df = df.query(f"`{col}` {op} @value")
+    return df[columns] if columns is not None else df
+
+
+def load_inputs(path: str, input_ids: list[str] = None) -> dict[str, list[str]]:
+    """ Load the input trees of a store
+
+    Args:
+        path (str): directory of the store
+        input_ids (list[str], optional): input ids to load. Defaults to None (all input sets).
+
+    Returns:
+        dict[str, list[str]]: input id => list of newick strings
+    """
+    wanted = set(input_ids) if input_ids is not None else None
+    inputs = {}
+    if os.path.isdir(os.path.join(path, "inputs")):
+        filters = [("input_id", "in", list(wanted))] if wanted is not None else None
+        df = pd.read_parquet(os.path.join(path, "inputs"), columns=["input_id", "inputs"], filters=filters)
+        for iid, trees in zip(df["input_id"], df["inputs"]):
+            inputs[iid] = list(trees)
+        return inputs
+
+    with open(os.path.join(path, "inputs.jsonl"), "r") as f:
+        for line in f:
+            row = json.loads(line)
+            if wanted is None or row["input_id"] in wanted:
+                inputs[row["input_id"]] = row["inputs"]
+    return inputs
+
+
+def convert_json(json_file: str, path: str, fmt: str = None) -> None:
+    """ Convert a results file written as a single json document (previous eval_consensus output) in a store
+
+    Args:
+        json_file (str): the json results file
+        path (str): directory of the store
+        fmt (str, optional): "parquet" or "csv". Defaults to None (see ResultsStore).
+    """
+    with open(json_file, "r") as f:
+        combinations = json.load(f)
+
+    with ResultsStore(path, fmt) as store:
+        for comb in combinations:
+            params = {p: comb.get(p) for p in PARAMS}
+            iid = store.add_inputs(params, comb["inputs"])
+            for alg, result in comb.items():
+                if isinstance(result, dict):
+                    store.add_result(iid, params, alg, result)
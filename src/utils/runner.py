@@ -0,0 +1,189 @@
+""" Concurrent execution of external programs (HybridSim, FACT, tqDist) with asyncio.
+
+Each process runs in its own temporary directory (its working directory, removed afterwards): input files
+are written in it before the launch, and output files are read back before it is removed, so that programs
+writing fixed file names can run concurrently. "{tmp}" in the arguments is replaced by this directory.
+Processes are limited in number, killed after a timeout, and retried when they fail. Each process leads its own
+process group, so that a timeout also kills the programs launched by a wrapper script.
+Results are handed to a callback as soon as each process ends, to write the outputs incrementally.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+
+# Time limit (in seconds) to collect the outputs of a killed process group
+KILL_GRACE = 5
+
+
+class ProcessResult:
+    """
+    The outcome of an external process (last attempt).
+    """
+    __slots__ = ("cmd", "returncode", "stdout", "stderr", "files", "attempts", "timed_out", "duration")
+
+    def __init__(self, cmd: list[str]):
+        self.cmd : list[str] = cmd
+        self.returncode : int = None
+        self.stdout : str = ""
+        self.stderr : str = ""
+        # Content of the requested output files (None if missing)
+        self.files : dict[str, str] = {}
+        self.attempts : int = 0
+        self.timed_out : bool = False
+        self.duration : float = 0.0 # Duration of the last attempt in seconds
+
+    @property
+    def ok(self) -> bool:
+        """ True if the process ended normally and wrote all the requested output files
+        """
+        return self.returncode == 0 and not self.timed_out and all(c is not None for c in self.files.values())
+
+    def __repr__(self) -> str:
+        return (f"ProcessResult(cmd={self.cmd[0]!r}, returncode={self.returncode}, attempts={self.attempts}, "
+                f"timed_out={self.timed_out}, duration={self.duration:.3f})")
+
+
+class ProcessError(RuntimeError):
+    """
+    An external process failed after all its attempts.
+    """
+    def __init__(self, result: ProcessResult):
+        reason = "timed out" if result.timed_out else f"exited with {result.returncode}"
+        super().__init__(f"{' '.join(result.cmd)} {reason} after {result.attempts} attempt(s): {result.stderr.strip()}")
+        self.result : ProcessResult = result
+
+
+class ProcessRunner:
+    """
+    Run external processes concurrently, with a concurrency limit, timeouts and retries.
+    """
+    def __init__(self, concurrency: int = None, timeout: float = None, retries: int = 0):
+        """ Instanciate the runner
+
+        Args:
+            concurrency (int, optional): maximal number of processes at the same time. Defaults to None (number of cpus).
+            timeout (float, optional): time limit of each attempt in seconds. Defaults to None (no limit).
+            retries (int, optional): number of additional attempts of a failed process. Defaults to 0.
+        """
+        self.concurrency : int = concurrency or os.cpu_count()
+        self.timeout : float = timeout
+        self.retries : int = retries
+
+    async def _attempt(self, result: ProcessResult, stdin: str, files: dict[str, str], outputs: list[str]) -> None:
+        """ Run one attempt of a process in a new temporary directory, updating its result
+        """
+        directory = tempfile.mkdtemp(prefix="pct-")
+        try:
+            for name, content in (files or {}).items():
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(content)
+            cmd = [arg.replace("{tmp}", directory) for arg in result.cmd]
+
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *cmd, cwd=directory, stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+            communicate = asyncio.ensure_future(process.communicate(stdin.encode() if stdin is not None else None))
+            try:
+                stdout, stderr = await asyncio.wait_for(asyncio.shield(communicate), self.timeout)
+                result.timed_out = False
+            except asyncio.TimeoutError:
+                # Kill the whole group: the children of a wrapper would otherwise keep the pipes open
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                try:
+                    stdout, stderr = await asyncio.wait_for(communicate, KILL_GRACE)
+                except asyncio.TimeoutError:
+                    communicate.cancel()
+                    stdout, stderr = b"", b""
+                    await process.wait()
+                result.timed_out = True
+            result.duration = time.perf_counter() - start
+            result.returncode = process.returncode
+            result.stdout = stdout.decode(errors="replace")
+            result.stderr = stderr.decode(errors="replace")
+
+            result.files = {}
+            for name in outputs or []:
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    with open(path, "r") as f:
+                        result.files[name] = f.read()
+                else:
+                    result.files[name] = None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    async def run(self, cmd: list[str], stdin: str = None, files: dict[str, str] = None,
+                  outputs: list[str] = None, check: bool = False) -> ProcessResult:
+        """ Run a process (retried if it fails), without concurrency limit (see run_all())
+
+        Args:
+            cmd (list[str]): the program and its arguments ("{tmp}" is replaced by the temporary directory,
+                relative paths are relative to it)
+            stdin (str, optional): the standard input. Defaults to None.
+            files (dict[str, str], optional): files to write in the temporary directory (name => content). Defaults to None.
+            outputs (list[str], optional): files to read from the temporary directory after the run. Defaults to None.
+            check (bool, optional): if True, raise a ProcessError when the last attempt fails. Defaults to False.
+
+        Returns:
+            ProcessResult: the result of the last attempt
+        """
+        result = ProcessResult(list(cmd))
+        while result.attempts <= self.retries:
+            result.attempts += 1
+            try:
+                await self._attempt(result, stdin, files, outputs)
+            except OSError as e: # The program can not be started
+                result.returncode, result.stderr = -1, str(e)
+            if result.ok:
+                break
+            logging.warning("Attempt %i of %s failed (%s)", result.attempts, cmd[0],
+                            "timeout" if result.timed_out else f"exit code {result.returncode}")
+        if check and not result.ok:
+            raise ProcessError(result)
+        return result
+
+    async def _run_all(self, jobs: dict, on_result) -> dict:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(key, options):
+            async with semaphore:
+                return key, await self.run(**options)
+
+        results = {}
+        for task in asyncio.as_completed([limited(key, options) for key, options in jobs.items()]):
+            key, result = await task
+            results[key] = result
+            if on_result is not None:
+                # A failing callback is logged like a failed attempt, the other jobs go on
+                try:
+                    on_result(key, result)
+                except Exception:
+                    logging.exception("Handling the result of job %s failed", key)
+        return results
+
+    def run_all(self, jobs: dict, on_result=None) -> dict:
+        """ Run several processes concurrently (at most self.concurrency at the same time)
+
+        Args:
+            jobs (dict): key => options of run() (cmd, stdin, files, outputs, check)
+            on_result (Callable[[Hashable, ProcessResult], None], optional): called with each result
+                as soon as its process ends (e.g. to write it), its exceptions being logged. Defaults to None.
+
+        Returns:
+            dict: key => ProcessResult
+        """
+        return asyncio.run(self._run_all(jobs, on_result))
+
+    def run_sync(self, cmd: list[str], **options) -> ProcessResult:
+        """ Run a single process and wait for its result (see run())
+        """
+        return asyncio.run(self.run(cmd, **options))